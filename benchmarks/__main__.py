@@ -0,0 +1,97 @@
+from datetime import datetime
+import argparse
+import importlib
+import json
+import platform
+import subprocess
+import sys
+
+"""
+    Runs all the benchmarks and writes their results as JSON, to track performance regressions
+    between releases.
+
+    Run from the repository root with:
+        python -m benchmarks [--only parser scheduler] [--output results.json]
+                             [--baseline previous.json] [--threshold 10]
+    With --baseline, results slower (or bigger) than the baseline by more than threshold percent are
+    reported and the exit code is 1.
+"""
+
+BENCHMARK_MODULES = ["parser", "crc", "transformations", "scheduler", "processors", "memory", "metrics", "pipeline"]
+
+# the measure of each result which is compared to the baseline (lower is better)
+COMPARED_MEASURES = ["microsecondsPerCall", "bytesPerSequence"]
+
+def getGitRevision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def runBenchmarks(moduleNames: list) -> dict:
+    report = {
+        "formatVersion": 1,
+        "startTime": datetime.now().astimezone().isoformat(),
+        "gitRevision": getGitRevision(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "results": list()
+    }
+    for moduleName in moduleNames:
+        print("Running bench_%s" % moduleName, file=sys.stderr)
+        benchmarkModule = importlib.import_module(".bench_" + moduleName, __package__)
+        for result in benchmarkModule.run():
+            result["module"] = moduleName
+            report["results"].append(result)
+    return report
+
+def compareToBaseline(report: dict, baseline: dict, thresholdPercent: float) -> list:
+    """
+        Returns the (name, measure, baseline value, value, change percent) of the results which regressed
+    """
+    baselineResults = {result["name"]: result for result in baseline["results"]}
+    regressions = list()
+    for result in report["results"]:
+        baselineResult = baselineResults.get(result["name"])
+        if (baselineResult is None):
+            continue
+        for measureName in COMPARED_MEASURES:
+            value = result.get(measureName)
+            baselineValue = baselineResult.get(measureName)
+            if ((value is None) or (not baselineValue)):
+                continue
+            changePercent = (value - baselineValue) / baselineValue * 100
+            result.setdefault("changePercent", dict())[measureName] = changePercent
+            if (changePercent > thresholdPercent):
+                regressions.append((result["name"], measureName, baselineValue, value, changePercent))
+    return regressions
+
+if __name__ == "__main__":
+    argumentParser = argparse.ArgumentParser(prog="python -m benchmarks", description="Runs the besmreader benchmarks")
+    argumentParser.add_argument("--only", nargs="+", choices=BENCHMARK_MODULES, default=BENCHMARK_MODULES)
+    argumentParser.add_argument("--output", help="JSON file to write (default: standard output)", default=None)
+    argumentParser.add_argument("--baseline", help="JSON file of a previous run to compare to", default=None)
+    argumentParser.add_argument("--threshold", type=float, help="regression threshold in percent (default: 10)", default=10)
+    arguments = argumentParser.parse_args()
+
+    report = runBenchmarks(arguments.only)
+
+    regressions = list()
+    if (arguments.baseline is not None):
+        with open(arguments.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        report["baselineGitRevision"] = baseline.get("gitRevision")
+        regressions = compareToBaseline(report, baseline, arguments.threshold)
+
+    if (arguments.output is None):
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(arguments.output, "w") as outputFile:
+            json.dump(report, outputFile, indent=2)
+
+    for name, measureName, baselineValue, value, changePercent in regressions:
+        print("REGRESSION %s %s: %.2f -> %.2f (%+.1f%%)" % (name, measureName, baselineValue, value, changePercent), file=sys.stderr)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from besmreader.generator import P1TelegramGenerator
+from besmreader.sequence import P1Sequence
+from besmreader.telegram import P1TelegramCRC
+
+from .common import SAMPLE_TELEGRAM_LINES, BenchmarkConfiguration, measure, printResults
+
+"""
+    CRC16 validation overhead compared to parsing the sample telegram of docs/obis.md, and CRC16 validation
+    of synthetic telegrams whose values change every second (only the lines which changed are computed)
+
+    Run from the repository root with: python -m benchmarks.bench_crc
+"""
+
+SAMPLE_FRAME = ("\r\n".join(SAMPLE_TELEGRAM_LINES) + "\r\n").encode("ascii")
+
+def run(number: int = 2000) -> list:
+    configuration = BenchmarkConfiguration()
+
+    def parseFrame():
+        frameLines = SAMPLE_FRAME.decode("ascii", "replace").splitlines()
+        p1Sequence = P1Sequence(frameLines[0], configuration)
+        for dataLine in frameLines[1:-1]:
+            if (dataLine):
+                p1Sequence.addInformationFromDataLine(dataLine)
+        p1Sequence.packetSignature = frameLines[-1]
+
+    def verifyFrame():
+        P1TelegramCRC.verifyFrame(SAMPLE_FRAME)
+
+    def parseAndVerifyFrame():
+        verifyFrame()
+        parseFrame()
+
+    telegramGenerator = P1TelegramGenerator(phases=3, seed=1)
+    startTime = datetime(2024, 1, 15, 18, 0, 0)
+    # one new telegram per call for each of the 5 repeats of measure
+    generatedFrames = iter([telegramGenerator.telegram(startTime + timedelta(seconds=second)) for second in range(5 * number)])
+
+    def verifyGeneratedFrame():
+        P1TelegramCRC.verifyFrame(next(generatedFrames))
+
+    results = [
+        measure("crc.verifyFrame", verifyFrame, number),
+        measure("crc.parseFrame", parseFrame, number),
+        measure("crc.parseAndVerifyFrame", parseAndVerifyFrame, number),
+        measure("crc.verifyGeneratedFrame", verifyGeneratedFrame, number)
+    ]
+    results[0]["overheadPercentOfParse"] = results[0]["microsecondsPerCall"] / results[1]["microsecondsPerCall"] * 100
+    return results
+
+if __name__ == "__main__":
+    printResults(run())
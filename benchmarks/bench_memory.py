@@ -0,0 +1,88 @@
+from besmreader.sequence import P1Sequence
+from besmreader.tokenizer import OBISLineTokenizer
+
+from decimal import Decimal
+from tzlocal import get_localzone
+import tracemalloc
+
+from .common import SAMPLE_TELEGRAM_LINES, BenchmarkConfiguration
+
+"""
+    Memory footprint of P1Sequence objects kept in memory (eg backlog or history),
+    compared to the former dict-of-list-of-dict layout.
+
+    Run from the repository root with: python -m benchmarks.bench_memory
+"""
+
+class LegacyLayoutSequence:
+
+    """
+        Same storage as P1Sequence before it used __slots__ and P1Value:
+        a __dict__ instance and {obis: [{"value": Decimal, "unit": str}, ...]}
+    """
+
+    def __init__(self, header: str, configuration) -> None:
+        self._packetHeader = header
+        self._packetSignature = None
+        self._informations = dict()
+        self._systemTimeZoneMessageTime = None
+        self._smartMeterTimezone = configuration.smartMeterTimeZone
+        self._systemTimeZone = get_localzone()
+        self._config = configuration
+
+    def addInformationFromDataLine(self, dataLine: str) -> None:
+        obisIdentifier, tokens = OBISLineTokenizer.tokenize(dataLine)
+        if ((obisIdentifier is not None) and (obisIdentifier != P1Sequence.OBIS_PACKET_DATE)):
+            obisContents = list()
+            for valueType, theValue, theUnit in tokens:
+                theData = {"value": Decimal(theValue) if (valueType == OBISLineTokenizer.DECIMAL) else theValue}
+                if (theUnit):
+                    theData["unit"] = theUnit
+                obisContents.append(theData)
+            self._informations[obisIdentifier] = obisContents
+
+def syntheticTelegram(index: int) -> list:
+    """
+        The sample telegram with instantaneous values changing at every telegram
+        and indexes changing every 10 telegrams, like a real meter
+    """
+    dataLines = list(SAMPLE_TELEGRAM_LINES[2:-1])
+    dataLines[3] = "1-0:1.8.1(%010.3f*kWh)" % (316.698 + (index // 10) * 0.001)
+    dataLines[13] = "1-0:21.7.0(%06.3f*kW)" % (2 + (index % 997) * 0.001)
+    dataLines[16] = "1-0:31.7.0(%06.2f*A)" % (13 + (index % 89) * 0.01)
+    dataLines[15] = "1-0:32.7.0(%05.1f*V)" % (230 + (index % 31) * 0.1)
+    return dataLines
+
+def measureLayout(sequenceClass, telegrams: list, configuration) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keptSequences = list()
+    for dataLines in telegrams:
+        p1Sequence = sequenceClass(SAMPLE_TELEGRAM_LINES[0], configuration)
+        for dataLine in dataLines:
+            p1Sequence.addInformationFromDataLine(dataLine)
+        keptSequences.append(p1Sequence)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+def run(sequenceCount: int = 2000) -> list:
+    configuration = BenchmarkConfiguration()
+    telegrams = [syntheticTelegram(index) for index in range(sequenceCount)]
+
+    results = list()
+    for name, sequenceClass in (("memory.legacyLayout", LegacyLayoutSequence), ("memory.slottedLayout", P1Sequence)):
+        usedBytes = measureLayout(sequenceClass, telegrams, configuration)
+        results.append({
+            "name": name,
+            "sequences": sequenceCount,
+            "bytesPerSequence": usedBytes / sequenceCount
+        })
+    return results
+
+def printMemoryResults(results: list) -> None:
+    for result in results:
+        print("%-45s %12.0f bytes/sequence" % (result["name"], result["bytesPerSequence"]))
+
+if __name__ == "__main__":
+    printMemoryResults(run())
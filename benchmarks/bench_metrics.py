@@ -0,0 +1,49 @@
+import time
+
+from besmreader.metrics import P1Counter, P1Histogram
+from besmreader.sequence import P1Sequence
+
+from .common import SAMPLE_TELEGRAM_LINES, SAMPLE_DATA_LINES, BenchmarkConfiguration, measure, printResults
+
+"""
+    Instrumentation cost compared to parsing the sample telegram of docs/obis.md
+
+    Run from the repository root with: python -m benchmarks.bench_metrics
+"""
+
+def run(number: int = 20000) -> list:
+    configuration = BenchmarkConfiguration()
+    counter = P1Counter()
+    histogram = P1Histogram()
+
+    def instrumentTelegram():
+        # what the pipeline does for one telegram in line mode: one counter per line read,
+        # telegram counter, scheduler and latency histograms with their clock reads
+        for dataLine in SAMPLE_TELEGRAM_LINES:
+            time.perf_counter()
+            counter.inc()
+        counter.inc()
+        startTime = time.perf_counter()
+        endTime = time.perf_counter()
+        histogram.observe(endTime - startTime)
+        histogram.observe(endTime - startTime)
+
+    def parseTelegram():
+        p1Sequence = P1Sequence(SAMPLE_TELEGRAM_LINES[0], configuration)
+        for dataLine in SAMPLE_DATA_LINES:
+            p1Sequence.addInformationFromDataLine(dataLine)
+        p1Sequence.packetSignature = SAMPLE_TELEGRAM_LINES[-1]
+
+    results = [
+        measure("metrics.counterInc", counter.inc, number),
+        measure("metrics.histogramObserve", lambda: histogram.observe(0.003), number),
+        measure("metrics.instrumentTelegram", instrumentTelegram, number // 10),
+        measure("metrics.parseTelegram", parseTelegram, number // 10)
+    ]
+    results[2]["overheadPercentOfParse"] = results[2]["microsecondsPerCall"] / results[3]["microsecondsPerCall"] * 100
+    return results
+
+if __name__ == "__main__":
+    results = run()
+    printResults(results)
+    print("instrumentation overhead: %.1f%% of the parsing time" % results[2]["overheadPercentOfParse"])
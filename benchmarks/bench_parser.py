@@ -0,0 +1,47 @@
+from besmreader.sequence import P1Sequence
+from besmreader.tokenizer import OBISLineTokenizer
+from besmreader.timestamps import P1TimestampDecoder
+
+from .common import SAMPLE_TELEGRAM_LINES, SAMPLE_DATA_LINES, BenchmarkConfiguration, measure, printResults
+
+"""
+    Parser micro-benchmark over the sample telegram of docs/obis.md
+
+    Run from the repository root with: python -m benchmarks.bench_parser
+"""
+
+# codes of a typical configuration: indexes, instant power and the telegram timestamp
+SELECTIVE_OBIS_CODES = frozenset({"0-0:1.0.0", "1-0:1.8.1", "1-0:1.8.2", "1-0:2.8.1", "1-0:2.8.2", "1-0:1.7.0", "1-0:2.7.0"})
+
+def run(number: int = 2000) -> list:
+    configuration = BenchmarkConfiguration()
+    selectiveConfiguration = BenchmarkConfiguration(neededOBISCodes=SELECTIVE_OBIS_CODES)
+
+    def tokenizeLines():
+        for dataLine in SAMPLE_DATA_LINES:
+            OBISLineTokenizer.tokenize(dataLine)
+
+    def parseTelegram(parseConfiguration=configuration):
+        p1Sequence = P1Sequence(SAMPLE_TELEGRAM_LINES[0], parseConfiguration)
+        for dataLine in SAMPLE_DATA_LINES:
+            p1Sequence.addInformationFromDataLine(dataLine)
+        p1Sequence.packetSignature = SAMPLE_TELEGRAM_LINES[-1]
+
+    # telegram clocks of one hour, one second apart, and the date of the monthly peak of the sample telegram
+    clockTexts = ["230319%02d%02d%02d" % (20, second // 60, second % 60) for second in range(3600)]
+    timestampDecoder = P1TimestampDecoder(configuration.smartMeterTimeZone)
+
+    def decodeClocks():
+        for clockText in clockTexts:
+            timestampDecoder.decodeClock(clockText, "W")
+
+    return [
+        measure("parser.tokenizeLines", tokenizeLines, number, itemsPerCall=len(SAMPLE_DATA_LINES)),
+        measure("parser.parseTelegram", parseTelegram, number),
+        measure("parser.parseTelegramSelective", lambda: parseTelegram(selectiveConfiguration), number),
+        measure("parser.decodeClock", decodeClocks, number // 200, itemsPerCall=len(clockTexts)),
+        measure("parser.decodeValue", lambda: timestampDecoder.decodeValue("230318200000", "W"), number * 10)
+    ]
+
+if __name__ == "__main__":
+    printResults(run())
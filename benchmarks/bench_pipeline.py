@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+from threading import Event
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from pytz import timezone
+
+import besmreader.threads as besmThreads
+from besmreader.capture import P1CaptureWriter
+from besmreader.configuration import P1Configuration
+from besmreader.generator import P1TelegramGenerator
+from besmreader.metrics import P1Metrics
+from besmreader.queues import P1PipelineQueue
+
+from .common import printResults
+
+"""
+    End-to-end throughput of the reader, parser, scheduler and processors threads, fed by the
+    replay of a capture of synthetic telegrams as fast as possible (no serial port needed), then
+    by several meters generating synthetic telegrams as fast as possible.
+
+    Run from the repository root with: python -m benchmarks.bench_pipeline [--meters N] [--mqtt host:port]
+    Without --mqtt, values are sent to a logger processor whose output is disabled.
+    With --mqtt, values are published to a local broker (eg mosquitto) in async mode.
+"""
+
+SMART_METER_TIMEZONE = "Europe/Brussels"
+
+def writeSyntheticCapture(capturePath: str, telegramCount: int, startTime: datetime) -> None:
+    """
+        Writes telegramCount synthetic telegrams, one second apart from startTime
+    """
+    captureWriter = P1CaptureWriter(capturePath)
+    telegrams = P1TelegramGenerator(meterTimeZone=timezone(SMART_METER_TIMEZONE), seed=1).telegrams(startTime)
+    for telegramIndex in range(telegramCount):
+        telegramTime, telegram = next(telegrams)
+        captureWriter.write(telegram, telegramTime.timestamp())
+    captureWriter.close()
+
+def buildConfiguration(capturePath: str, readerMode: str, mqttBroker: str, meterCount: int = 1) -> dict:
+    """
+        A single meter replaying capturePath, or meterCount meters generating telegrams if capturePath is None
+    """
+    topics = {obisCode: "bench/" + obisCode for obisCode in ["1-0:1.8.1", "1-0:1.8.2", "1-0:2.8.1", "1-0:2.8.2", "1-0:21.7.0", "1-0:1.6.0/0"]}
+    if (mqttBroker is None):
+        processor = {"type": "logger", "logLevel": "DEBUG", "topics": topics}
+    else:
+        brokerHost, brokerPort = mqttBroker.split(":")
+        processor = {"type": "mqtt", "broker": brokerHost, "port": int(brokerPort), "publishMode": "async", "outboundQueue": {"maxSize": 100000}, "topics": topics}
+
+    configuration = {
+        "core": {"smartMeterTimeZone": SMART_METER_TIMEZONE},
+        "reader": {"mode": readerMode},
+        "processors": {"bench": processor},
+        "scheduling": [
+            {"cronFormat": "* * * * * *", "processor": "bench", "mode": "current", "applyTo": ["1-0:1.8.1", "1-0:1.8.2", "1-0:1.6.0/0"]},
+            {"cronFormat": "* * * * * */10", "processor": "bench", "mode": "average", "applyTo": ["1-0:21.7.0"]},
+            {"cronFormat": "* * * * *", "processor": "bench", "mode": "changed", "applyTo": ["1-0:2.8.1", "1-0:2.8.2"]}
+        ]
+    }
+    if (capturePath is not None):
+        configuration["replay"] = {"path": capturePath, "speed": 0}
+    else:
+        configuration["meters"] = [{"id": "meter%d" % meterIndex, "generator": {"rate": 0, "phases": 3}, "topicPrefix": "meter%d/" % meterIndex}
+                                   for meterIndex in range(meterCount)]
+    return configuration
+
+def runPipeline(readerMode: str, telegramCount: int, mqttBroker: str = None, meterCount: int = 0, timeoutSeconds: float = 120) -> dict:
+    """
+        Replays telegramCount telegrams of a capture, or generates telegramCount telegrams with meterCount meters
+    """
+    with tempfile.TemporaryDirectory() as workDirectory:
+        capturePath = None
+        configPath = os.path.join(workDirectory, "config.json")
+
+        if (meterCount == 0):
+            # telegrams must be in the future so that the schedules are triggered
+            capturePath = os.path.join(workDirectory, "bench.cap")
+            writeSyntheticCapture(capturePath, telegramCount, datetime.now().astimezone() + timedelta(seconds=2))
+        with open(configPath, "w") as configFile:
+            json.dump(buildConfiguration(capturePath, readerMode, mqttBroker, meterCount), configFile)
+
+        configuration = P1Configuration(configPath)
+        processedHistogram = P1Metrics.histogram("besm_scheduler_seconds", "Time to process a telegram by the scheduler and the triggered processors")
+        latencyHistogram = P1Metrics.histogram("besm_telegram_latency_seconds", "Time from the first data of a telegram read to the end of its processing")
+        processedBefore = processedHistogram.count
+
+        stopEvent = Event()
+        rawQueue = P1PipelineQueue("raw", blockTimeout=configuration.timeoutCycleLength, **configuration.queueConfig("raw"))
+        p1SequenceQueue = P1PipelineQueue("p1Sequence", blockTimeout=configuration.timeoutCycleLength, **configuration.queueConfig("p1Sequence"))
+        threads = [
+            besmThreads.ProcessP1SequencesThread(p1SequenceQueue, stopEvent, configuration),
+            besmThreads.ParseP1RawDataThread(rawQueue, p1SequenceQueue, stopEvent, configuration)
+        ] + [besmThreads.ReadFromCOMPortThread(rawQueue, stopEvent, configuration, meter) for meter in configuration.meters]
+
+        startTime = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while ((processedHistogram.count - processedBefore < telegramCount) and (time.perf_counter() - startTime < timeoutSeconds)):
+            time.sleep(0.01)
+        elapsedTime = time.perf_counter() - startTime
+
+        processedCount = processedHistogram.count - processedBefore
+        stopEvent.set()
+        for thread in threads:
+            thread.join()
+        configuration.closeProcessors()
+
+    return {
+        "name": "pipeline.%s%s%s" % (readerMode, ".%dMeters" % meterCount if meterCount else "", ".mqtt" if mqttBroker else ""),
+        "calls": processedCount,
+        "itemsPerCall": 1,
+        "bestTotalSeconds": elapsedTime,
+        "microsecondsPerCall": elapsedTime / processedCount * 1e6 if processedCount else None,
+        "itemsPerSecond": processedCount / elapsedTime,
+        "latencyP50Seconds": latencyHistogram.quantile(0.5),
+        "latencyP99Seconds": latencyHistogram.quantile(0.99)
+    }
+
+def run(telegramCount: int = 5000, mqttBroker: str = None, meterCount: int = 4) -> list:
+    return [runPipeline(readerMode, telegramCount, mqttBroker, sourceMeterCount) for sourceMeterCount in (0, meterCount) for readerMode in ["line", "frame"]]
+
+if __name__ == "__main__":
+    argumentParser = argparse.ArgumentParser(description="Pipeline throughput benchmark")
+    argumentParser.add_argument("--telegrams", type=int, default=5000)
+    argumentParser.add_argument("--mqtt", help="host:port of a local MQTT broker", default=None)
+    argumentParser.add_argument("--meters", type=int, help="number of generated meters", default=4)
+    arguments = argumentParser.parse_args()
+    printResults(run(arguments.telegrams, arguments.mqtt, arguments.meters))
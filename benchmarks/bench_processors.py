@@ -0,0 +1,79 @@
+from datetime import datetime
+
+from besmreader.encoding import P1PayloadEncoder
+from besmreader.processors import P1Processor, LiveP1Processor
+from besmreader.sequence import P1Sequence
+
+from .common import SAMPLE_TELEGRAM_LINES, SAMPLE_DATA_LINES, BenchmarkConfiguration, measure, printResults
+
+"""
+    Processor dispatch benchmark: cost of sending the values selected by a schedule to a processor
+    whose sink does nothing, of encoding them as an MQTT batch payload and of handing them to the live
+    server (the part of the live processor which runs in the processing thread)
+
+    Run from the repository root with: python -m benchmarks.bench_processors
+"""
+
+# the topics of the print processor of config/config.json.example
+SAMPLE_TOPICS = {
+    "1-0:1.8.1": "smartmeter/electricity/reading/consumption/day_tariff",
+    "1-0:1.8.2": "smartmeter/electricity/reading/consumption/night_tariff",
+    "1-0:2.8.1": "smartmeter/electricity/reading/injection/day_tariff",
+    "1-0:2.8.2": "smartmeter/electricity/reading/injection/night_tariff",
+    "1-0:21.7.0": "smartmeter/electricity/instant/L1/power/consumption",
+    "1-0:22.7.0": "smartmeter/electricity/instant/L1/power/injection",
+    "1-0:31.7.0": "smartmeter/electricity/instant/L1/intensity",
+    "1-0:32.7.0": "smartmeter/electricity/instant/L1/tension",
+    "1-0:1.6.0/0": "Peak consumtion date",
+    "1-0:1.6.0/1": "Peak consumtion value"
+}
+
+class NullP1Processor (P1Processor):
+
+    """
+        A processor which drops the values: only the dispatch by P1Processor.processSequence is measured.
+        It uses the schema of the print processor.
+    """
+
+    def processInformation(self, processLabel: str, processValue: str, processUnit: str) -> None:
+        pass
+
+    def closeProcessor(self) -> None:
+        pass
+
+    @staticmethod
+    def getConfigurationName() -> str:
+        return "print"
+
+def run(number: int = 20000) -> list:
+    configuration = BenchmarkConfiguration()
+    p1Sequence = P1Sequence(SAMPLE_TELEGRAM_LINES[0], configuration)
+    for dataLine in SAMPLE_DATA_LINES:
+        p1Sequence.addInformationFromDataLine(dataLine)
+    p1Sequence.packetSignature = SAMPLE_TELEGRAM_LINES[-1]
+
+    processor = NullP1Processor({"type": "print", "topics": SAMPLE_TOPICS}, "benchmark")
+    plan = tuple(P1Sequence.compileSelector(obisCode) + (topic, ) for obisCode, topic in SAMPLE_TOPICS.items())
+
+    def selectValues():
+        selectedValues = list()
+        for obisCode, code, index, topic in plan:
+            p1Value = p1Sequence.getSelectedValue(code, index)
+            if (p1Value is not None):
+                selectedValues.append((topic, obisCode, p1Value.value, p1Value.unit))
+        return selectedValues
+
+    batch = P1PayloadEncoder.toBatch(datetime.now().astimezone(), selectValues())
+    liveProcessor = LiveP1Processor({"type": "live", "port": 0, "topics": SAMPLE_TOPICS}, "benchmark")
+
+    results = [
+        measure("processors.nullDispatch", lambda: processor.processSequence(p1Sequence, plan), number, itemsPerCall=len(plan)),
+        measure("processors.batchJSON", lambda: P1PayloadEncoder.encode("json", batch), number, itemsPerCall=len(plan)),
+        measure("processors.batchCBOR", lambda: P1PayloadEncoder.encode("cbor", batch), number, itemsPerCall=len(plan)),
+        measure("processors.liveHandOff", lambda: liveProcessor.processSequence(p1Sequence, plan), number, itemsPerCall=len(plan))
+    ]
+    liveProcessor.closeProcessor()
+    return results
+
+if __name__ == "__main__":
+    printResults(run())
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+from croniter import croniter
+
+from besmreader.aggregates import P1AggregatorFactory
+from besmreader.generator import P1TelegramGenerator
+from besmreader.scheduler import P1Scheduler
+from besmreader.sequence import P1Sequence
+
+from .common import SAMPLE_TELEGRAM_LINES, SAMPLE_DATA_LINES, BenchmarkConfiguration, measure, printResults
+
+"""
+    Scheduler benchmark: one hour of telegrams (one per second) processed by many schedules,
+    then by a single schedule of each mode (current, changed, deadband, average) at several cron densities,
+    then the number of values sent by the changed and deadband modes for one hour of synthetic telegrams
+
+    Run from the repository root with: python -m benchmarks.bench_scheduler
+"""
+
+SCHEDULED_OBIS_CODES = ["1-0:1.8.1", "1-0:1.8.2", "1-0:21.7.0", "1-0:31.7.0", "1-0:32.7.0", "1-0:1.7.0"]
+
+# triggered every telegram, every minute and every quarter hour
+CRON_DENSITIES = {"everySecond": "* * * * * *", "everyMinute": "* * * * *", "everyQuarter": "*/15 * * * *"}
+
+# 50 W or 2% for powers, 1 A for currents, 2 V for voltages, indexes sent every 0.1 kWh, heartbeat every 5 minutes
+SAMPLE_DEADBAND = {
+    "absolute": 0.05, "percent": 2, "maxSilence": 300,
+    "codes": {"1-0:31.7.0": {"absolute": 1}, "1-0:32.7.0": {"absolute": 2, "percent": 0}, "1-0:1.8.1": {"absolute": 0.1}, "1-0:1.8.2": {"absolute": 0.1}}
+}
+
+class NullProcessor:
+
+    topics = dict()
+
+    def processSequence(self, p1Sequence: P1Sequence, plan: tuple, topicPrefix: str = "") -> None:
+        pass
+
+class CountingProcessor (NullProcessor):
+
+    def __init__(self) -> None:
+        self.sentValues = 0
+
+    def processSequence(self, p1Sequence: P1Sequence, plan: tuple, topicPrefix: str = "") -> None:
+        self.sentValues += sum(1 for selector in plan if (p1Sequence.getSelectedValue(selector[1], selector[2]) is not None))
+
+def buildSchedule(cronFormat: str, mode: str, applyTo: list, startTime: datetime, processor: NullProcessor = None) -> dict:
+    """
+        Same schedule state as built by P1Configuration
+    """
+    schedule = {
+        "cronFormat": cronFormat,
+        "mode": mode,
+        "applyTo": applyTo,
+        "processorInstance": processor if (processor is not None) else NullProcessor(),
+        "topicPrefix": ""
+    }
+    schedule["cron"] = croniter(schedule["cronFormat"], startTime)
+    schedule["cron_next_trigger"] = schedule["cron"].get_next(datetime)
+    if (P1AggregatorFactory.isAggregationMode(schedule["mode"])):
+        schedule["aggregators"] = {obisId: P1AggregatorFactory.createAggregator(schedule["mode"]) for obisId in schedule["applyTo"]}
+    if (schedule["mode"] == "deadband"):
+        schedule["deadband"] = SAMPLE_DEADBAND
+        schedule["deadbands"] = P1Scheduler.compileDeadbands(schedule)
+        schedule["_lastPublished"] = dict()
+    schedule["selectors"] = tuple(P1Sequence.compileSelector(obisCode) for obisCode in schedule["applyTo"])
+    schedule["plan"] = tuple(selector + (selector[0], ) for selector in schedule["selectors"])
+    return schedule
+
+def buildSchedules(scheduleCount: int, startTime: datetime) -> list:
+    """
+        Alternating aggregation and current schedules triggered every 1 to 5 minutes
+    """
+    modes = ["average", "current", "max", "changed"]
+    return [buildSchedule("*/%d * * * *" % (scheduleIndex % 5 + 1), modes[scheduleIndex % len(modes)], SCHEDULED_OBIS_CODES[scheduleIndex % 3:], startTime)
+            for scheduleIndex in range(scheduleCount)]
+
+def buildTelegrams(configuration: BenchmarkConfiguration, startTime: datetime, count: int) -> list:
+    telegrams = list()
+    for second in range(count):
+        telegramTime = (startTime + timedelta(seconds=second + 1)).astimezone(configuration.smartMeterTimeZone)
+        p1Sequence = P1Sequence(SAMPLE_TELEGRAM_LINES[0], configuration)
+        p1Sequence.addInformationFromDataLine("0-0:1.0.0(%s%s)" % (telegramTime.strftime("%y%m%d%H%M%S"), "S" if telegramTime.dst() else "W"))
+        for dataLine in SAMPLE_DATA_LINES:
+            # keep the timestamp of this telegram instead of the one of the sample
+            if (not dataLine.startswith(P1Sequence.OBIS_PACKET_DATE)):
+                p1Sequence.addInformationFromDataLine(dataLine)
+        p1Sequence.packetSignature = SAMPLE_TELEGRAM_LINES[-1]
+        telegrams.append(p1Sequence)
+    return telegrams
+
+def buildSyntheticTelegrams(configuration: BenchmarkConfiguration, startTime: datetime, count: int) -> list:
+    """
+        Telegrams of P1TelegramGenerator, whose powers, currents and voltages change at every telegram
+    """
+    telegrams = list()
+    generator = P1TelegramGenerator(meterTimeZone=configuration.smartMeterTimeZone, seed=1)
+    for second in range(count):
+        telegramLines = generator.telegram(startTime + timedelta(seconds=second + 1)).decode("ascii").splitlines()
+        p1Sequence = P1Sequence(telegramLines[0], configuration)
+        for dataLine in telegramLines[1:-1]:
+            if (dataLine):
+                p1Sequence.addInformationFromDataLine(dataLine)
+        p1Sequence.packetSignature = telegramLines[-1]
+        telegrams.append(p1Sequence)
+    return telegrams
+
+def countSentValues(configuration: BenchmarkConfiguration, telegrams: list, mode: str, startTime: datetime) -> dict:
+    processor = CountingProcessor()
+    scheduler = P1Scheduler(configuration, [buildSchedule(CRON_DENSITIES["everySecond"], mode, SCHEDULED_OBIS_CODES, startTime, processor)])
+    for p1Sequence in telegrams:
+        scheduler.processP1(p1Sequence)
+    return {
+        "name": "scheduler.sentValues.%s" % mode,
+        "telegrams": len(telegrams),
+        "sentValues": processor.sentValues,
+        "sentValuesPerTelegram": processor.sentValues / len(telegrams)
+    }
+
+def run(telegramCount: int = 3600, scheduleCounts: tuple = (5, 50)) -> list:
+    configuration = BenchmarkConfiguration()
+    startTime = datetime(2023, 3, 19, 12, 0, 0).astimezone(P1Sequence.getSystemTimeZone())
+    telegrams = buildTelegrams(configuration, startTime, telegramCount)
+
+    results = list()
+    for scheduleCount in scheduleCounts:
+        def processTelegrams():
+            scheduler = P1Scheduler(configuration, buildSchedules(scheduleCount, startTime))
+            for p1Sequence in telegrams:
+                scheduler.processP1(p1Sequence)
+
+        results.append(measure("scheduler.processP1.%dSchedules" % scheduleCount, processTelegrams, 1, repeat=3, itemsPerCall=telegramCount))
+
+    for mode in ("current", "changed", "deadband", "average"):
+        for densityName, cronFormat in CRON_DENSITIES.items():
+            def processTelegrams():
+                scheduler = P1Scheduler(configuration, [buildSchedule(cronFormat, mode, SCHEDULED_OBIS_CODES, startTime)])
+                for p1Sequence in telegrams:
+                    scheduler.processP1(p1Sequence)
+
+            results.append(measure("scheduler.%s.%s" % (mode, densityName), processTelegrams, 1, repeat=3, itemsPerCall=telegramCount))
+
+    syntheticTelegrams = buildSyntheticTelegrams(configuration, startTime, telegramCount)
+    for mode in ("current", "changed", "deadband"):
+        results.append(countSentValues(configuration, syntheticTelegrams, mode, startTime))
+    return results
+
+if __name__ == "__main__":
+    results = run()
+    printResults([result for result in results if ("microsecondsPerCall" in result)])
+    for result in results:
+        if ("sentValues" in result):
+            print("%-45s %12d values %10.2f values/telegram" % (result["name"], result["sentValues"], result["sentValuesPerTelegram"]))
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from besmreader.capacity import P1CapacityTracker
+from besmreader.generator import P1TelegramGenerator
+from besmreader.sequence import P1Sequence
+from besmreader.transformations import P1Transformations
+
+from .common import SAMPLE_TELEGRAM_LINES, SAMPLE_DATA_LINES, BenchmarkConfiguration, measure, printResults
+
+"""
+    p1Transform benchmark: the transformations of config/config.json.example, then a DAG of derived
+    values (net power, phase totals, ratios), applied to the sample telegram of docs/obis.md, then the
+    capacity tariff tracker over one quarter-hour of synthetic telegrams
+
+    Run from the repository root with: python -m benchmarks.bench_transformations
+"""
+
+SAMPLE_TRANSFORMATIONS = {
+    "1-0:1.8.0": {"operation": "sum", "operands": ["1-0:1.8.1", "1-0:1.8.2"], "unit": "kWh"},
+    "1-0:2.8.0": {"operation": "sum", "operands": ["1-0:2.8.1", "1-0:2.8.2"], "unit": "kWh"}
+}
+
+# declared in reverse order: results are used before they are defined
+DAG_TRANSFORMATIONS = {
+    "1-0:0.2.0": {"operation": "ratio", "operands": ["1-0:0.1.0", "1-0:1.8.0"]},
+    "1-0:0.1.0": {"operation": "difference", "operands": ["1-0:1.8.0", "1-0:2.8.0"], "unit": "kWh"},
+    "1-0:0.3.0": {"operation": "product", "operands": ["1-0:0.4.0", "1-0:32.7.0"], "unit": "VA"},
+    "1-0:0.4.0": {"operation": "phaseSum", "operands": ["1-0:31.7.0"], "unit": "A"},
+    "1-0:0.5.0": {"operation": "netPower", "unit": "kW"},
+    **SAMPLE_TRANSFORMATIONS
+}
+
+def buildSequence(configuration: BenchmarkConfiguration) -> P1Sequence:
+    p1Sequence = P1Sequence(SAMPLE_TELEGRAM_LINES[0], configuration)
+    for dataLine in SAMPLE_DATA_LINES:
+        p1Sequence.addInformationFromDataLine(dataLine)
+    p1Sequence.packetSignature = SAMPLE_TELEGRAM_LINES[-1]
+    return p1Sequence
+
+def buildQuarterSequences(configuration: BenchmarkConfiguration) -> list:
+    telegramGenerator = P1TelegramGenerator(seed=1)
+    startTime = configuration.smartMeterTimeZone.localize(datetime(2024, 1, 15, 18, 0, 0))
+    sequences = list()
+    for second in range(P1CapacityTracker.QUARTER_SECONDS):
+        dataLines = telegramGenerator.telegram(startTime + timedelta(seconds=second)).decode("ascii").split("\r\n")
+        p1Sequence = P1Sequence(dataLines[0], configuration)
+        for dataLine in dataLines[1:-2]:
+            p1Sequence.addInformationFromDataLine(dataLine)
+        sequences.append(p1Sequence)
+    return sequences
+
+def trackQuarter(configuration: BenchmarkConfiguration, sequences: list) -> None:
+    capacityTracker = P1CapacityTracker({"enable": True}, configuration.smartMeterTimeZone)
+    for p1Sequence in sequences:
+        capacityTracker.processP1(p1Sequence)
+
+def run(number: int = 20000) -> list:
+    configuration = BenchmarkConfiguration(SAMPLE_TRANSFORMATIONS)
+    p1Sequence = buildSequence(configuration)
+    dagConfiguration = BenchmarkConfiguration(DAG_TRANSFORMATIONS)
+    dagSequence = buildSequence(dagConfiguration)
+    quarterSequences = buildQuarterSequences(configuration)
+
+    # the transformations overwrite their result, so they can be applied to the same sequence
+    return [
+        measure("transformations.applyTransformations", lambda: p1Sequence.applyTransformations(configuration.p1Transformations), number,
+                itemsPerCall=len(SAMPLE_TRANSFORMATIONS)),
+        measure("transformations.dag", lambda: dagSequence.applyTransformations(dagConfiguration.p1Transformations), number,
+                itemsPerCall=len(DAG_TRANSFORMATIONS)),
+        measure("transformations.compile", lambda: P1Transformations(DAG_TRANSFORMATIONS), number // 10,
+                itemsPerCall=len(DAG_TRANSFORMATIONS)),
+        measure("transformations.capacityTracker", lambda: trackQuarter(configuration, quarterSequences), max(number // 2000, 1),
+                itemsPerCall=len(quarterSequences))
+    ]
+
+if __name__ == "__main__":
+    printResults(run())
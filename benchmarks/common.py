@@ -0,0 +1,69 @@
+from pytz import timezone
+
+from besmreader.transformations import P1Transformations
+
+import timeit
+
+#
+# Sample telegram from docs/obis.md (Ores Siconia S211)
+# with the privacy placeholders replaced by digits and a valid CRC
+#
+SAMPLE_TELEGRAM_LINES = [
+    "/FLU5\\253769484_A",
+    "",
+    "0-0:96.1.4(50217)",
+    "0-0:96.1.1(3153414733313031303231363035)",
+    "0-0:1.0.0(230319201739W)",
+    "1-0:1.8.1(000316.698*kWh)",
+    "1-0:1.8.2(000407.323*kWh)",
+    "1-0:2.8.1(000001.447*kWh)",
+    "1-0:2.8.2(000000.000*kWh)",
+    "0-0:96.14.0(0002)",
+    "1-0:1.4.0(00.377*kW)",
+    "1-0:1.6.0(230318200000W)(04.470*kW)",
+    "0-0:98.1.0(0)(1-0:1.6.0)(1-0:1.6.0)()",
+    "1-0:1.7.0(02.959*kW)",
+    "1-0:2.7.0(00.000*kW)",
+    "1-0:21.7.0(02.959*kW)",
+    "1-0:22.7.0(00.000*kW)",
+    "1-0:32.7.0(232.2*V)",
+    "1-0:31.7.0(013.06*A)",
+    "0-0:96.3.10(1)",
+    "0-0:17.0.0(999.9*kW)",
+    "1-0:31.4.0(999*A)",
+    "0-0:96.13.0()",
+    "!C5C3"
+]
+
+SAMPLE_DATA_LINES = SAMPLE_TELEGRAM_LINES[2:-1]
+
+class BenchmarkConfiguration:
+
+    """
+        The subset of P1Configuration needed to build and transform P1Sequence objects
+        without reading config.json from disk.
+    """
+
+    def __init__(self, p1Transformations: dict = None, smartMeterTimeZone: str = "Europe/Brussels", neededOBISCodes: frozenset = None) -> None:
+        self.smartMeterTimeZone = timezone(smartMeterTimeZone)
+        self.p1Transformations = P1Transformations(p1Transformations if (p1Transformations is not None) else dict())
+        self.neededOBISCodes = neededOBISCodes
+
+def measure(name: str, function, number: int, repeat: int = 5, itemsPerCall: int = 1) -> dict:
+    """
+        Runs function number times, repeat times, and keeps the best run.
+        Returns a machine-readable result dictionary.
+    """
+    bestTotal = min(timeit.repeat(function, number=number, repeat=repeat))
+    return {
+        "name": name,
+        "calls": number,
+        "itemsPerCall": itemsPerCall,
+        "bestTotalSeconds": bestTotal,
+        "microsecondsPerCall": bestTotal / number * 1e6,
+        "itemsPerSecond": (number * itemsPerCall) / bestTotal if bestTotal > 0 else None
+    }
+
+def printResults(results: list) -> None:
+    for result in results:
+        print("%-45s %12.2f us/call %14.0f items/s" % (result["name"], result["microsecondsPerCall"], result["itemsPerSecond"]))
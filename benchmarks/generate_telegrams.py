@@ -0,0 +1,60 @@
+from datetime import datetime
+from threading import Event
+import argparse
+import time
+
+from pytz import timezone
+
+from besmreader.capture import P1CaptureWriter
+from besmreader.generator import P1TelegramGenerator, P1PtyGeneratorThread
+
+"""
+    Writes synthetic P1 telegrams for load testing, to pseudo-terminals (one per meter) or to capture files
+
+    Run from the repository root with:
+        python -m benchmarks.generate_telegrams --meters 10 --rate 5 --phases 3 --pty
+        python -m benchmarks.generate_telegrams --meters 10 --telegrams 86400 --capture captures/load.cap.gz
+"""
+
+argumentParser = argparse.ArgumentParser(prog="python -m benchmarks.generate_telegrams", description="Synthetic P1 telegrams generator for load testing")
+argumentParser.add_argument("--meters", type=int, default=1, help="number of simulated meters")
+argumentParser.add_argument("--phases", type=int, choices=(1, 3), default=1)
+argumentParser.add_argument("--no-gas", dest="gas", action="store_false", help="no M-Bus gas meter")
+argumentParser.add_argument("--solar", type=float, default=0.0, help="peak power of the solar panels in kW")
+argumentParser.add_argument("--rate", type=float, default=1.0, help="telegrams per second and per meter (0: as fast as possible)")
+argumentParser.add_argument("--interval", type=float, default=1.0, help="seconds between the timestamps of two telegrams")
+argumentParser.add_argument("--timezone", default="Europe/Brussels", help="time zone of the meters")
+outputGroup = argumentParser.add_mutually_exclusive_group(required=True)
+outputGroup.add_argument("--pty", action="store_true", help="write to one pseudo-terminal per meter")
+outputGroup.add_argument("--capture", metavar="PATH", help="write a capture file (PATH.<meter>.cap[.gz] when there are several meters)")
+argumentParser.add_argument("--telegrams", type=int, default=3600, help="telegrams per meter written with --capture")
+arguments = argumentParser.parse_args()
+
+generators = [P1TelegramGenerator(meterNumber, arguments.phases, arguments.gas, arguments.solar, timezone(arguments.timezone)) for meterNumber in range(arguments.meters)]
+
+if (arguments.pty):
+    stopEvent = Event()
+    ptyThreads = [P1PtyGeneratorThread(generator, stopEvent, arguments.rate, arguments.interval) for generator in generators]
+    for meterNumber, ptyThread in enumerate(ptyThreads):
+        print("meter %d: %s" % (meterNumber, ptyThread.ptyName), flush=True)
+        ptyThread.start()
+    try:
+        while (True):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stopEvent.set()
+else:
+    for meterNumber, generator in enumerate(generators):
+        capturePath = arguments.capture
+        if (arguments.meters > 1):
+            captureRoot, captureExtension = (capturePath[:-3], ".gz") if (capturePath.endswith(".gz")) else (capturePath, "")
+            capturePath = "%s.%d.cap%s" % (captureRoot, meterNumber, captureExtension)
+        captureWriter = P1CaptureWriter(capturePath)
+        startTime = datetime.now().astimezone()
+        telegrams = generator.telegrams(startTime, arguments.interval)
+        for telegramIndex in range(arguments.telegrams):
+            telegramTime, telegram = next(telegrams)
+            # receive times follow the rate so that the capture is replayed at that rate with speed 1
+            captureWriter.write(telegram, startTime.timestamp() + (telegramIndex / arguments.rate if (arguments.rate > 0) else telegramIndex * arguments.interval))
+        captureWriter.close()
+        print("meter %d: %s" % (meterNumber, capturePath))
@@ -0,0 +1,208 @@
+from abc import abstractmethod
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+class P1Aggregator:
+
+    """
+        Interface for streaming aggregators used by the scheduling modes which aggregate values
+        between two triggers of a schedule. Aggregators use O(1) memory whatever the number of values.
+    """
+
+    def __init__(self) -> None:
+        self._count = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @abstractmethod
+    def add(self, value: Decimal, valueTime: datetime) -> None:
+        pass
+
+    @abstractmethod
+    def result(self, triggerTime: datetime) -> Decimal:
+        pass
+
+    def reset(self, triggerTime: datetime) -> None:
+        self._count = 0
+
+    @staticmethod
+    @abstractmethod
+    def getModeName() -> str:
+        pass
+
+class MeanAggregator (P1Aggregator):
+
+    """
+        Arithmetic mean: same result as statistics.mean over all the values
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._sum = Decimal(0)
+
+    def add(self, value: Decimal, valueTime: datetime) -> None:
+        self._count += 1
+        self._sum += value
+
+    def result(self, triggerTime: datetime) -> Decimal:
+        return self._sum / self._count
+
+    def reset(self, triggerTime: datetime) -> None:
+        super().reset(triggerTime)
+        self._sum = Decimal(0)
+
+    @staticmethod
+    def getModeName() -> str:
+        return "average"
+
+class MinAggregator (P1Aggregator):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._min = None
+
+    def add(self, value: Decimal, valueTime: datetime) -> None:
+        self._count += 1
+        if ((self._min is None) or (value < self._min)):
+            self._min = value
+
+    def result(self, triggerTime: datetime) -> Decimal:
+        return self._min
+
+    def reset(self, triggerTime: datetime) -> None:
+        super().reset(triggerTime)
+        self._min = None
+
+    @staticmethod
+    def getModeName() -> str:
+        return "min"
+
+class MaxAggregator (P1Aggregator):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._max = None
+
+    def add(self, value: Decimal, valueTime: datetime) -> None:
+        self._count += 1
+        if ((self._max is None) or (value > self._max)):
+            self._max = value
+
+    def result(self, triggerTime: datetime) -> Decimal:
+        return self._max
+
+    def reset(self, triggerTime: datetime) -> None:
+        super().reset(triggerTime)
+        self._max = None
+
+    @staticmethod
+    def getModeName() -> str:
+        return "max"
+
+class StdDevAggregator (P1Aggregator):
+
+    """
+        Population standard deviation (same as statistics.pstdev) using Welford's online algorithm
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._mean = Decimal(0)
+        self._m2 = Decimal(0)
+
+    def add(self, value: Decimal, valueTime: datetime) -> None:
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+
+    def result(self, triggerTime: datetime) -> Decimal:
+        return (self._m2 / self._count).sqrt()
+
+    def reset(self, triggerTime: datetime) -> None:
+        super().reset(triggerTime)
+        self._mean = Decimal(0)
+        self._m2 = Decimal(0)
+
+    @staticmethod
+    def getModeName() -> str:
+        return "stddev"
+
+class TimeWeightedAverageAggregator (P1Aggregator):
+
+    """
+        Average where each value is weighted by the time during which it was valid, ie until the next
+        value (or until the trigger for the last value). The last value of a period is carried over
+        to the beginning of the next period.
+    """
+    _MICROSECOND = timedelta(microseconds=1)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._weightedSum = Decimal(0)
+        self._totalWeight = 0
+        self._lastValue = None
+        self._lastTime = None
+
+    def __accumulateUntil(self, untilTime: datetime) -> None:
+        if (self._lastValue is not None):
+            weight = (untilTime - self._lastTime) // TimeWeightedAverageAggregator._MICROSECOND
+            if (weight > 0):
+                self._weightedSum += self._lastValue * weight
+                self._totalWeight += weight
+
+    def add(self, value: Decimal, valueTime: datetime) -> None:
+        self._count += 1
+        self.__accumulateUntil(valueTime)
+        self._lastValue = value
+        self._lastTime = valueTime
+
+    def result(self, triggerTime: datetime) -> Decimal:
+        weightedSum = self._weightedSum
+        totalWeight = self._totalWeight
+        weight = (triggerTime - self._lastTime) // TimeWeightedAverageAggregator._MICROSECOND
+        if (weight > 0):
+            weightedSum += self._lastValue * weight
+            totalWeight += weight
+
+        if (totalWeight == 0):
+            return self._lastValue
+        return weightedSum / totalWeight
+
+    def reset(self, triggerTime: datetime) -> None:
+        super().reset(triggerTime)
+        self._weightedSum = Decimal(0)
+        self._totalWeight = 0
+        if (self._lastValue is not None):
+            self._lastTime = triggerTime
+
+    @staticmethod
+    def getModeName() -> str:
+        return "timeWeightedAverage"
+
+class P1AggregatorFactory:
+
+    """
+        A factory for creating aggregators from a schedule mode.
+    """
+    _aggregatorClassList = [MeanAggregator, MinAggregator, MaxAggregator, StdDevAggregator, TimeWeightedAverageAggregator]
+    _aggregatorDictionary = None
+
+    @classmethod
+    def getAggregatorDictionary(cls) -> dict:
+        if (cls._aggregatorDictionary is None):
+            cls._aggregatorDictionary = dict()
+            for aClass in cls._aggregatorClassList:
+                cls._aggregatorDictionary[aClass.getModeName()] = aClass
+
+        return cls._aggregatorDictionary
+
+    @classmethod
+    def isAggregationMode(cls, mode: str) -> bool:
+        return (mode in cls.getAggregatorDictionary())
+
+    @classmethod
+    def createAggregator(cls, mode: str) -> P1Aggregator:
+        return cls.getAggregatorDictionary()[mode]()
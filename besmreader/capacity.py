@@ -0,0 +1,170 @@
+from datetime import datetime
+from decimal import Decimal
+
+from .sequence import P1Sequence, P1Value
+from .timestamps import P1TimestampDecoder
+
+_KW = "kW"
+_MILLI = Decimal("0.001")
+_SECONDS_PER_HOUR = Decimal(3600)
+
+class P1CapacityTracker:
+
+    """
+        Tracks the quarter-hour average power used by capacity tariffs (eg Fluvius), in real time: the meter
+        only reports the monthly peak (1-0:1.6.0) once a quarter-hour is over. Each telegram costs a few
+        operations on the import indexes (1-0:1.8.x), whatever the time since the quarter-hour started:
+            * runningAverage: average power since the start of the quarter-hour (energy delta / elapsed time).
+              The 1 Wh resolution of the indexes makes it coarse during the first seconds of a quarter-hour
+            * projectedAverage: average of the quarter-hour if the current power (1-0:1.7.0) is kept until
+              its end. The part of the quarter-hour which was not measured (eg at startup) counts at the current power
+            * monthlyPeak: (start of the quarter-hour, average) of the highest quarter-hour of the month
+              (months of the smart meter time zone), at least the 1-0:1.6.0 value reported by the meter
+            * headroom: monthlyPeak minus projectedAverage, negative if the quarter-hour will set a new peak
+        The results are set as virtual OBIS codes of the sequence, which schedules can send like any meter value.
+
+        Quarter-hours started before the first telegram (or interrupted by an outage) are only counted in the
+        peak with the energy measured, so that the tracked peak is never above the real one.
+        A tracker is used by the scheduler of one meter, it keeps its state when the configuration is reloaded.
+    """
+    QUARTER_SECONDS = 900
+    DEFAULT_INDEX_CODES = ["1-0:1.8.1", "1-0:1.8.2"]
+    DEFAULT_POWER_CODE = "1-0:1.7.0"
+    METER_PEAK_CODE = "1-0:1.6.0"
+    # group B 128 (manufacturer specific) so that virtual codes never collide with the values of the meter
+    DEFAULT_CODES = {"runningAverage": "1-128:1.4.0", "projectedAverage": "1-128:1.4.1", "headroom": "1-128:1.4.2", "monthlyPeak": "1-128:1.6.0"}
+    # a quarter-hour starts from the last index of the previous one if no more telegrams were missed
+    MAX_TELEGRAM_GAP = 30
+
+    def __init__(self, capacityTariffConfig: dict, smartMeterTimeZone) -> None:
+        self._smartMeterTimeZone = smartMeterTimeZone
+        self._systemTimeZone = P1TimestampDecoder.getSystemTimeZone()
+        self._indexSlots = tuple(P1Sequence.splitOBISCode(obisCode) for obisCode in capacityTariffConfig.get("indexCodes", P1CapacityTracker.DEFAULT_INDEX_CODES))
+        self._powerSlot = P1Sequence.splitOBISCode(capacityTariffConfig.get("powerCode", P1CapacityTracker.DEFAULT_POWER_CODE))
+        codes = dict(P1CapacityTracker.DEFAULT_CODES)
+        codes.update(capacityTariffConfig.get("codes", dict()))
+        self._runningAverageCode = P1Sequence.splitOBISCode(codes["runningAverage"])[0]
+        self._projectedAverageCode = P1Sequence.splitOBISCode(codes["projectedAverage"])[0]
+        self._headroomCode = P1Sequence.splitOBISCode(codes["headroom"])[0]
+        self._monthlyPeakCode = P1Sequence.splitOBISCode(codes["monthlyPeak"])[0]
+
+        self._quarterStart = None
+        self._startTime = None
+        self._startIndex = None
+        self._lastTime = None
+        self._lastIndex = None
+        self._monthStart = None
+        self._nextMonthStart = None
+        self._peak = None
+        self._peakValues = None
+
+    @property
+    def operandCodes(self) -> frozenset:
+        """
+            OBIS codes (without multi-value index) read by the tracker
+        """
+        return frozenset([code for code, index in self._indexSlots] + [self._powerSlot[0], P1CapacityTracker.METER_PEAK_CODE])
+
+    @property
+    def monthlyPeak(self) -> tuple:
+        """
+            (start of the quarter-hour, average power in kW) of the monthly peak, None if not known yet
+        """
+        return self._peak
+
+    def processP1(self, p1Sequence: P1Sequence) -> None:
+        """
+            Updates the tracker with a telegram (which must have a timestamp) and sets the virtual OBIS codes
+        """
+        energyIndex = self.__readSum(p1Sequence, self._indexSlots)
+        if (energyIndex is None):
+            return
+        telegramTime = int(p1Sequence.messageTimeinSystemTimezone.timestamp())
+        if ((self._lastTime is not None) and (telegramTime < self._lastTime)):
+            # the meter clock went back: the quarter-hours will be tracked again from the next one
+            self._quarterStart = None
+
+        quarterStart = telegramTime - telegramTime % P1CapacityTracker.QUARTER_SECONDS
+        if (quarterStart != self._quarterStart):
+            self.__startQuarter(quarterStart, telegramTime, energyIndex)
+        self._lastTime = telegramTime
+        self._lastIndex = energyIndex
+        self.__readMeterPeak(p1Sequence)
+
+        energy = energyIndex - self._startIndex
+        elapsedSeconds = telegramTime - self._startTime
+        power = self.__readSum(p1Sequence, (self._powerSlot, ))
+        runningAverage = None
+        if (elapsedSeconds > 0):
+            runningAverage = energy * _SECONDS_PER_HOUR / elapsedSeconds
+            p1Sequence.setInformationValues(self._runningAverageCode, (P1Value(runningAverage.quantize(_MILLI), _KW), ))
+        if (power is None):
+            power = runningAverage
+
+        if (power is not None):
+            unmeasuredSeconds = P1CapacityTracker.QUARTER_SECONDS - elapsedSeconds
+            projectedAverage = ((energy * _SECONDS_PER_HOUR + power * unmeasuredSeconds) / P1CapacityTracker.QUARTER_SECONDS).quantize(_MILLI)
+            p1Sequence.setInformationValues(self._projectedAverageCode, (P1Value(projectedAverage, _KW), ))
+            if (self._peak is not None):
+                p1Sequence.setInformationValues(self._headroomCode, (P1Value(self._peak[1] - projectedAverage, _KW), ))
+
+        if (self._peakValues is not None):
+            p1Sequence.setInformationValues(self._monthlyPeakCode, self._peakValues)
+
+    @staticmethod
+    def __readSum(p1Sequence: P1Sequence, slots: tuple) -> Decimal:
+        # None if one of the values is missing, so that a partial sum is never taken for an index
+        total = None
+        for code, index in slots:
+            p1Value = p1Sequence.getSelectedValue(code, index)
+            if ((p1Value is None) or (type(p1Value.value) is not Decimal)):
+                return None
+            total = p1Value.value if (total is None) else total + p1Value.value
+        return total
+
+    def __startQuarter(self, quarterStart: int, telegramTime: int, energyIndex: Decimal) -> None:
+        """
+            Closes the former quarter-hour (if any) and starts the one of the telegram
+        """
+        if (self._quarterStart is not None):
+            self.__closeQuarter()
+
+        if ((self._nextMonthStart is None) or (quarterStart >= self._nextMonthStart) or (quarterStart < self._monthStart)):
+            self.__startMonth(quarterStart)
+
+        if ((self._quarterStart is not None) and (self._lastTime >= quarterStart - P1CapacityTracker.MAX_TELEGRAM_GAP)):
+            # the last index of the former quarter-hour is the index at the start of this one
+            self._startTime = quarterStart
+            self._startIndex = self._lastIndex
+        else:
+            self._startTime = telegramTime
+            self._startIndex = energyIndex
+        self._quarterStart = quarterStart
+
+    def __closeQuarter(self) -> None:
+        quarterAverage = ((self._lastIndex - self._startIndex) * _SECONDS_PER_HOUR / P1CapacityTracker.QUARTER_SECONDS).quantize(_MILLI)
+        if ((self._peak is None) or (quarterAverage > self._peak[1])):
+            self.__setPeak(datetime.fromtimestamp(self._quarterStart, self._systemTimeZone), quarterAverage)
+
+    def __startMonth(self, quarterStart: int) -> None:
+        localQuarterStart = datetime.fromtimestamp(quarterStart, self._smartMeterTimeZone)
+        nextYear, nextMonth = (localQuarterStart.year + 1, 1) if (localQuarterStart.month == 12) else (localQuarterStart.year, localQuarterStart.month + 1)
+        self._monthStart = self._smartMeterTimeZone.localize(datetime(localQuarterStart.year, localQuarterStart.month, 1)).timestamp()
+        self._nextMonthStart = self._smartMeterTimeZone.localize(datetime(nextYear, nextMonth, 1)).timestamp()
+        self._peak = None
+        self._peakValues = None
+
+    def __setPeak(self, peakDate: datetime, peakValue: Decimal) -> None:
+        self._peak = (peakDate, peakValue)
+        # the values of the peak are shared by the sequences until the next peak
+        self._peakValues = (P1Value(peakDate), P1Value(peakValue, _KW))
+
+    def __readMeterPeak(self, p1Sequence: P1Sequence) -> None:
+        # the meter peak covers the quarter-hours before the first telegram (eg after a restart),
+        # a peak of the current quarter-hour is not final
+        meterPeak = p1Sequence.getSelectedValue(P1CapacityTracker.METER_PEAK_CODE, 1)
+        if ((meterPeak is None) or (type(meterPeak.value) is not Decimal) or ((self._peak is not None) and (meterPeak.value <= self._peak[1]))):
+            return
+        meterPeakDate = p1Sequence.getSelectedValue(P1CapacityTracker.METER_PEAK_CODE, 0)
+        if ((meterPeakDate is not None) and isinstance(meterPeakDate.value, datetime) and (self._monthStart <= meterPeakDate.value.timestamp() < self._quarterStart)):
+            self.__setPeak(meterPeakDate.value, meterPeak.value)
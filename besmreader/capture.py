@@ -0,0 +1,203 @@
+import gzip
+import os
+import struct
+import time
+import zlib
+
+class P1CaptureFile:
+
+    """
+        A capture file contains the raw bytes read from a P1 Port with their receive time, so that they
+        can be replayed later. It starts with a MAGIC header followed by records of:
+            * the receive time (seconds since epoch, double) and the data length (unsigned int), little endian
+            * the data itself
+        Files whose name ends with ".gz" are gzip compressed (telegrams compress about 10 times).
+    """
+    MAGIC = b"BESMCAP1"
+    RECORD_HEADER = struct.Struct("<dI")
+
+    @staticmethod
+    def open(path: str, mode: str):
+        if (path.endswith(".gz")):
+            return gzip.open(path, mode)
+        return open(path, mode)
+
+class P1CaptureWriter:
+
+    """
+        Appends the data read from a P1 Port to a capture file. Data is flushed to the file
+        at most every flushInterval seconds.
+    """
+
+    def __init__(self, path: str, flushInterval: float = 1.0) -> None:
+        # tell() is 0 for each new gzip member: the size of the file on disk tells whether it is new
+        isNewFile = ((not os.path.exists(path)) or (os.path.getsize(path) == 0))
+        self._file = P1CaptureFile.open(path, "ab")
+        if (isNewFile):
+            self._file.write(P1CaptureFile.MAGIC)
+        self._flushInterval = flushInterval
+        self._lastFlushTime = time.monotonic()
+
+    def write(self, data: bytes, receiveTime: float = None) -> None:
+        if (receiveTime is None):
+            receiveTime = time.time()
+        self._file.write(P1CaptureFile.RECORD_HEADER.pack(receiveTime, len(data)))
+        self._file.write(data)
+
+        if (time.monotonic() - self._lastFlushTime >= self._flushInterval):
+            self._file.flush()
+            self._lastFlushTime = time.monotonic()
+
+    def close(self) -> None:
+        self._file.close()
+
+class P1CaptureReader:
+
+    """
+        Iterates over the (receiveTime, data) records of a capture file
+    """
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+
+    def __iter__(self):
+        with P1CaptureFile.open(self._path, "rb") as captureFile:
+            if (captureFile.read(len(P1CaptureFile.MAGIC)) != P1CaptureFile.MAGIC):
+                raise ValueError("Not a P1 capture file: " + self._path)
+
+            recordHeaderSize = P1CaptureFile.RECORD_HEADER.size
+            while (True):
+                try:
+                    recordHeader = captureFile.read(recordHeaderSize)
+                    if (len(recordHeader) < recordHeaderSize):
+                        # end of file (or record truncated by a crash during the capture)
+                        return
+                    receiveTime, dataLength = P1CaptureFile.RECORD_HEADER.unpack(recordHeader)
+                    data = captureFile.read(dataLength)
+                except (EOFError, zlib.error):
+                    # gzip stream truncated (or corrupted) by a crash during the capture
+                    return
+                if (len(data) < dataLength):
+                    return
+                yield receiveTime, data
+
+class P1ReplayPort:
+
+    """
+        A stand-in for serial.Serial (readline, read, in_waiting and close) which replays a capture file:
+            * speed 1: in real time, as the data was received
+            * speed N: N times faster than real time
+            * speed 0: as fast as possible
+        At the end of the capture, it starts again from the beginning if loop is set, otherwise it behaves
+        like a serial port receiving no data: reads return after timeout seconds.
+        Like the buffer of a serial port, in_waiting is bounded to BUFFER_SIZE bytes (otherwise a looping
+        replay at full speed would never return).
+    """
+    BUFFER_SIZE = 4096
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = False, timeout: float = 5) -> None:
+        self._path = path
+        self._speed = speed
+        self._loop = loop
+        self.timeout = timeout
+
+        self._buffer = bytearray()
+        self._records = self._openRecords()
+        self._nextRecord = None
+        self._captureStartTime = None
+        self._replayStartTime = None
+        self._finished = False
+        self._replayedRecords = 0
+
+    @property
+    def finished(self) -> bool:
+        """
+            True when all the capture was replayed (never for a looping replay)
+        """
+        return (self._finished and (self._nextRecord is None) and (not self._buffer))
+
+    @property
+    def replayedRecords(self) -> int:
+        return self._replayedRecords
+
+    def _openRecords(self):
+        """
+            Returns an iterator over the (receiveTime, data) records to replay
+        """
+        return iter(P1CaptureReader(self._path))
+
+    def __peekRecord(self) -> tuple[float, bytes]:
+        if ((self._nextRecord is None) and (not self._finished)):
+            self._nextRecord = next(self._records, None)
+            if ((self._nextRecord is None) and self._loop):
+                self._records = self._openRecords()
+                self._captureStartTime = None
+                self._nextRecord = next(self._records, None)
+            if (self._nextRecord is None):
+                self._finished = True
+        return self._nextRecord
+
+    def __dueTime(self, receiveTime: float) -> float:
+        if (self._speed <= 0):
+            return 0
+        if (self._captureStartTime is None):
+            self._captureStartTime = receiveTime
+            self._replayStartTime = time.monotonic()
+        return self._replayStartTime + (receiveTime - self._captureStartTime) / self._speed
+
+    def __consumeRecord(self) -> None:
+        self._buffer += self._nextRecord[1]
+        self._nextRecord = None
+        self._replayedRecords += 1
+
+    def __waitForData(self, hasEnoughData) -> None:
+        """
+            Moves the records which are due to the buffer until hasEnoughData() or until timeout
+        """
+        deadline = time.monotonic() + self.timeout
+        while (not hasEnoughData()):
+            record = self.__peekRecord()
+            now = time.monotonic()
+            if (record is None):
+                # end of the capture: same as a serial port receiving nothing
+                if (deadline > now):
+                    time.sleep(deadline - now)
+                return
+
+            dueTime = self.__dueTime(record[0])
+            if (dueTime > now):
+                if (dueTime > deadline):
+                    time.sleep(max(0, deadline - now))
+                    return
+                time.sleep(dueTime - now)
+            self.__consumeRecord()
+
+    @property
+    def in_waiting(self) -> int:
+        record = self.__peekRecord()
+        now = time.monotonic()
+        while ((record is not None) and (len(self._buffer) < P1ReplayPort.BUFFER_SIZE) and (self.__dueTime(record[0]) <= now)):
+            self.__consumeRecord()
+            record = self.__peekRecord()
+        return len(self._buffer)
+
+    def read(self, size: int = 1) -> bytes:
+        self.__waitForData(lambda: len(self._buffer) >= size)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self) -> bytes:
+        self.__waitForData(lambda: b"\n" in self._buffer)
+        lineEnd = self._buffer.find(b"\n") + 1
+        if (lineEnd == 0):
+            # timeout: return the partial line, like serial.Serial
+            lineEnd = len(self._buffer)
+        line = bytes(self._buffer[:lineEnd])
+        del self._buffer[:lineEnd]
+        return line
+
+    def close(self) -> None:
+        self._records = iter(())
+        self._nextRecord = None
+        self._finished = True
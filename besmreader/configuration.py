@@ -3,6 +3,7 @@ from tzlocal import get_localzone
 from pytz import timezone
 from jsonschema import validate as jsvalidate
 
+import copy
 import logging
 import logging.config
 import json
@@ -11,68 +12,174 @@ from datetime import datetime
 
 from .scheduler import P1Scheduler
 from .processors import P1ProcessorFactory, P1Processor
-
-class P1ConfigurationError (Exception):
-    """
-        Exception in the P1Configuration of the overall module
-    """
-
-    def __init__(self, message="Configuration is incorrect"):
-        super().__init__(self.message)
-
+from .sequence import P1Sequence
+from .transformations import P1Transformations
+from .capacity import P1CapacityTracker
+from .aggregates import P1AggregatorFactory
+from .meter import P1Meter
+from .metrics import P1Metrics
+from .helper import P1ConfigurationError
 
 class P1Configuration:
 
     """
         Configuration of the Belgian-SmartMeter-P1-to-MQTT
     """
+    logger = logging.getLogger("besm.P1Configuration")
+
+    # sections which can be changed by reload(), changes to the other sections need a restart
+    RELOADABLE_SECTIONS = ("p1Transform", "processors", "scheduling")
 
     def __init__(self, configFileName: str) -> None:
-        try: 
-            configFile = open(os.path.join(os.getcwd(), "config", configFileName))
-            self._configData = json.load(configFile)
-            configFile.close()
-        except Exception as exceptionMet:
-            raise P1ConfigurationError('Could not load configuration file: ' + str(exceptionMet))
+        self._configFileName = configFileName
+        self._configData = P1Configuration.__loadConfigFile(configFileName)
+        # the configuration as read from the file, _configData is completed with runtime information
+        self._sourceConfigData = copy.deepcopy(self._configData)
         
         self._processors = dict()
         self._filters = None
+        self._neededOBISCodes = None
 
         self.__init_configSchemaCheck()
-        self.__init__scheduling()
+        self.__init_queuesCheck()
+        self._p1Transformations = P1Configuration.__compileTransformations(self._configData.get("p1Transform", dict()))
         self.__init__processors()
-        self.__init_serialPort()
+        self.__init__meters()
+
+    @staticmethod
+    def __loadConfigFile(configFileName: str) -> dict:
+        try: 
+            configFile = open(os.path.join(os.getcwd(), "config", configFileName))
+            configData = json.load(configFile)
+            configFile.close()
+        except Exception as exceptionMet:
+            raise P1ConfigurationError('Could not load configuration file: ' + str(exceptionMet))
+        return configData
 
-    def __init__scheduling(self) -> None:
-        for schedule in self._configData['scheduling']:
-            localTimeZone=get_localzone()
-            startDate = datetime.now(localTimeZone)
+    @property
+    def configFilePath(self) -> str:
+        return os.path.join(os.getcwd(), "config", self._configFileName)
 
-            schedule["cron"] = croniter(schedule["cronFormat"], startDate)
-            schedule["cron_next_trigger"] = schedule["cron"].get_next(datetime)
+    def __init_queuesCheck(self) -> None:
+        # in "line" mode, conflating the raw queue would mix the lines of different telegrams
+        if ((self.readerMode == "line") and (self.queueConfig("raw")["overflowPolicy"] == "conflate")):
+            raise P1ConfigurationError('Configuration error: the raw queue can only be conflated in "frame" reader mode')
+
+    @staticmethod
+    def __compileTransformations(p1TransformConfig: dict) -> P1Transformations:
+        try:
+            return P1Transformations(p1TransformConfig)
+        except ValueError as exceptionMet:
+            raise P1ConfigurationError('Configuration error: ' + str(exceptionMet))
 
-            if (schedule["mode"] == "average"):
-                schedule["history"] = dict()
-                for obisId in schedule["applyTo"]:
-                    schedule["history"][obisId] = list()
-        
-        self._scheduler = P1Scheduler(self)
-    
     def __init__processors(self) -> None:
         processorConfig = self.__processorsConfig
         for processorName in processorConfig:
-            self._processors[processorName] = P1ProcessorFactory.createProcessor(processorConfig[processorName])
+            self._processors[processorName] = P1ProcessorFactory.createProcessor(processorConfig[processorName], processorName)
 
-    def __init_serialPort(self) -> None:
+    def __init__meters(self) -> None:
+        """
+            Creates one P1Meter per entry of the "meters" section, or a single meter using the
+            "serialPortConfig" (or "replay" or "generator") and "capture" sections. Each meter gets its own copy of the schedules.
+        """
+        if ("meters" in self._configData):
+            meterConfigs = self._configData["meters"]
+        else:
+            meterConfigs = [{"id": P1Meter.DEFAULT_METER_ID}]
+            for meterKey in ["serialPortConfig", "replay", "generator", "capture"]:
+                if (meterKey in self._configData):
+                    meterConfigs[0][meterKey] = self._configData[meterKey]
+
+        self._meters = list()
+        meterIds = set()
+        for meterConfig in meterConfigs:
+            if (meterConfig["id"] in meterIds):
+                raise P1ConfigurationError('Configuration error: meter id is used more than once: ' + meterConfig["id"])
+            meterIds.add(meterConfig["id"])
+
+            # a replayed or generated meter has no serial port but its timeout is still used
+            if (not "serialPortConfig" in meterConfig):
+                meterConfig["serialPortConfig"] = dict()
+            self.__init_serialPort(meterConfig["serialPortConfig"])
+            topicPrefix = meterConfig.get("topicPrefix", "")
+            schedules = [self.__init__schedule(dict(scheduleConfig), topicPrefix) for scheduleConfig in self._configData['scheduling']]
+            self._meters.append(P1Meter(meterConfig["id"], meterConfig["serialPortConfig"], topicPrefix, P1Scheduler(self, schedules, self.__createCapacityTracker()),
+                meterConfig.get("replay"), meterConfig.get("capture"), meterConfig.get("generator")))
+
+    def __createCapacityTracker(self) -> P1CapacityTracker:
+        # one tracker per meter, None if the capacity tariff is not tracked
+        if (not self.capacityTariffEnabled):
+            return None
+        return P1CapacityTracker(self._configData["capacityTariff"], self.smartMeterTimeZone)
+
+    def __init__schedule(self, schedule: dict, topicPrefix: str) -> dict:
+        """
+            Initializes the state of a schedule and resolves once the OBIS codes it uses so that
+            no string parsing is done per telegram:
+                * schedule["selectors"]: (obisCode, code, index) for each OBIS code of applyTo
+                * schedule["plan"]: (obisCode, code, index, topic) for each OBIS code of applyTo
+                which has a topic in the schedule processor. The topic starts with topicPrefix.
+        """
+        self.__init__scheduleState(schedule)
+        schedule.update(self.__compileSchedule(schedule, topicPrefix, self._processors))
+        return schedule
+
+    def __init__scheduleState(self, schedule: dict) -> None:
+        localTimeZone=get_localzone()
+        startDate = datetime.now(localTimeZone)
+
+        schedule["cron"] = croniter(schedule["cronFormat"], startDate)
+        schedule["cron_next_trigger"] = schedule["cron"].get_next(datetime)
+
+        if (P1AggregatorFactory.isAggregationMode(schedule["mode"])):
+            schedule["aggregators"] = dict()
+            for obisId in schedule["applyTo"]:
+                schedule["aggregators"][obisId] = P1AggregatorFactory.createAggregator(schedule["mode"])
+
+        if (schedule["mode"] == "deadband"):
+            schedule["deadbands"] = P1Scheduler.compileDeadbands(schedule)
+            schedule["_lastPublished"] = dict()
+
+    @staticmethod
+    def __compileSchedule(schedule: dict, topicPrefix: str, processors: dict, processorsTopics: dict = None) -> dict:
+        """
+            Returns the processorInstance, topicPrefix, selectors and plan of a schedule using processors.
+            processorsTopics overrides the topics of some processors (changed by a reload).
+        """
+        if (not schedule["processor"] in processors):
+            raise P1ConfigurationError('Configuration error: schedule uses an unknown processor: ' + schedule["processor"])
+
+        processor = processors[schedule["processor"]]
+        topics = processorsTopics[schedule["processor"]] if ((processorsTopics is not None) and (schedule["processor"] in processorsTopics)) else processor.topics
+        selectors = tuple(P1Sequence.compileSelector(obisCode) for obisCode in schedule["applyTo"])
+        return {
+            "processorInstance": processor,
+            "topicPrefix": topicPrefix,
+            "selectors": selectors,
+            "plan": tuple(selector + (topicPrefix + topics[selector[0]], ) for selector in selectors if selector[0] in topics)
+        }
+
+    def __init_serialPort(self, serialPortConfig: dict) -> None:
         # if no timeout is set, default value is 5 seconds
-        if (not "timeout" in self._configData["serialPortConfig"]):
-            self._configData["serialPortConfig"]["timeout"] = 5
+        if (not "timeout" in serialPortConfig):
+            serialPortConfig["timeout"] = 5
         
         # since SmartMeter sends one packet per second, timeout should not be lower than 2 seconds
-        if (self._configData["serialPortConfig"]["timeout"] < 2):
-            self._configData["serialPortConfig"] = 2
+        if (serialPortConfig["timeout"] < 2):
+            serialPortConfig["timeout"] = 2
 
     def __init_configSchemaCheck(self) -> None:
+        P1Configuration.__validateConfigData(self._configData)
+
+        self._configData["core"]["smartMeterTimeZone_pytz"] = get_localzone()
+
+        # Set the Timezone information
+        if ("core" in self._configData):
+            if ("smartMeterTimeZone" in self._configData["core"]):
+                self._configData["core"]["smartMeterTimeZone_pytz"] = timezone(self._configData["core"]["smartMeterTimeZone"])
+
+    @staticmethod
+    def __validateConfigData(configData: dict) -> None:
         schemaFileName = os.path.join(os.getcwd(), "schema", 'config.schema.json')
         jsonSchema = None
         
@@ -80,34 +187,199 @@ class P1Configuration:
             schemaFile = open(schemaFileName)
             jsonSchema = json.load(schemaFile)
             schemaFile.close()
-            jsvalidate(self._configData, jsonSchema)
+            jsvalidate(configData, jsonSchema)
         else:
-            raise P1ConfigurationError('Configuration error: Could not find configuration schema') # type: ignore
+            raise P1ConfigurationError('Configuration error: Could not find configuration schema')
 
-        self._configData["core"]["smartMeterTimeZone_pytz"] = get_localzone()
+    def reload(self) -> bool:
+        """
+            Reads the configuration file again and applies the changes of the RELOADABLE_SECTIONS without
+            stopping the pipeline:
+                * processors whose configuration is unchanged are kept (with their connections), processors whose
+                  RELOADABLE_SETTINGS (eg topics) only changed are updated in place, the others are created (and
+                  the former ones closed)
+                * schedules whose configuration is unchanged keep their state (next trigger, aggregated values, last
+                  values of "changed" mode), new or changed schedules start from the current time
+                * transformations are replaced
+            Changes to the other sections are logged and ignored until the next restart.
+            Returns False if nothing changed. Raises an exception (and keeps the running configuration) if the new
+            configuration is invalid.
+        """
+        newConfigData = P1Configuration.__loadConfigFile(self._configFileName)
+        P1Configuration.__validateConfigData(newConfigData)
+        newSourceConfigData = copy.deepcopy(newConfigData)
 
-        # Set the Timezone information
-        if ("core" in self._configData):
-            if ("smartMeterTimeZone" in self._configData["core"]):
-                self._configData["core"]["smartMeterTimeZone_pytz"] = timezone(self._configData["core"]["smartMeterTimeZone"])
+        ignoredSections = sorted(section for section in set(newConfigData) | set(self._sourceConfigData)
+            if ((not section in P1Configuration.RELOADABLE_SECTIONS) and (newConfigData.get(section) != self._sourceConfigData.get(section))))
+        if (ignoredSections):
+            P1Configuration.logger.warning('Changes to %s need a restart and were not applied', ", ".join(ignoredSections))
+
+        if (all(newConfigData.get(section) == self._sourceConfigData.get(section) for section in P1Configuration.RELOADABLE_SECTIONS)):
+            P1Configuration.logger.info('Configuration reloaded: no change to apply')
+            return False
+
+        newTransformations = P1Configuration.__compileTransformations(newConfigData.get("p1Transform", dict()))
+
+        # 1. processors: created first so that nothing is changed if one of them is invalid
+        newProcessors = dict()
+        processorsTopics = dict()
+        reconfiguredProcessors = dict()
+        createdProcessors = list()
+        oldProcessorsConfig = self._sourceConfigData["processors"]
+        try:
+            for processorName, processorConfig in newConfigData["processors"].items():
+                oldProcessorConfig = oldProcessorsConfig.get(processorName)
+                if (oldProcessorConfig == processorConfig):
+                    newProcessors[processorName] = self._processors[processorName]
+                elif ((oldProcessorConfig is not None) and (P1Configuration.__withoutReloadableSettings(oldProcessorConfig, self._processors[processorName])
+                        == P1Configuration.__withoutReloadableSettings(processorConfig, self._processors[processorName]))):
+                    self._processors[processorName].validateConfiguration(processorConfig)
+                    newProcessors[processorName] = self._processors[processorName]
+                    processorsTopics[processorName] = processorConfig["topics"]
+                    reconfiguredProcessors[processorName] = processorConfig
+                else:
+                    newProcessors[processorName] = P1ProcessorFactory.createProcessor(processorConfig, processorName)
+                    createdProcessors.append(newProcessors[processorName])
+
+            # 2. schedules of each meter: unchanged schedules are reused with their state
+            oldSchedulesConfig = self._sourceConfigData["scheduling"]
+            meterSchedules = list()
+            for meter in self._meters:
+                reusableSchedules = dict()
+                for oldScheduleConfig, oldSchedule in zip(oldSchedulesConfig, meter.scheduler.schedules):
+                    reusableSchedules.setdefault(json.dumps(oldScheduleConfig, sort_keys=True), list()).append(oldSchedule)
+
+                schedules = list()
+                for scheduleConfig in newConfigData["scheduling"]:
+                    candidates = reusableSchedules.get(json.dumps(scheduleConfig, sort_keys=True))
+                    if (candidates):
+                        schedule = candidates.pop(0)
+                    else:
+                        schedule = dict(scheduleConfig)
+                        self.__init__scheduleState(schedule)
+                    schedules.append((schedule, P1Configuration.__compileSchedule(schedule, meter.topicPrefix, newProcessors, processorsTopics)))
+                meterSchedules.append(schedules)
+        except Exception:
+            for processor in createdProcessors:
+                processor.closeProcessor()
+            raise
+
+        # 3. swap, meter by meter, between two telegrams
+        for meter, schedules in zip(self._meters, meterSchedules):
+            with meter.schedulerLock:
+                for schedule, compiledSchedule in schedules:
+                    schedule.update(compiledSchedule)
+                meter.scheduler = P1Scheduler(self, [schedule for schedule, compiledSchedule in schedules], meter.scheduler.capacityTracker)
+
+        for processorName, processorConfig in reconfiguredProcessors.items():
+            newProcessors[processorName].reconfigure(processorConfig)
+        formerProcessors = [processor for processor in self._processors.values() if (not processor in newProcessors.values())]
+        self._processors = newProcessors
+        for section in P1Configuration.RELOADABLE_SECTIONS:
+            if (section in newConfigData):
+                self._configData[section] = newConfigData[section]
+                self._sourceConfigData[section] = newSourceConfigData[section]
+            else:
+                self._configData.pop(section, None)
+                self._sourceConfigData.pop(section, None)
+        self._p1Transformations = newTransformations
+        self._filters = None
+        self._neededOBISCodes = None
+
+        for processor in formerProcessors:
+            processor.closeProcessor()
+
+        P1Metrics.counter("besm_config_reloads_total", "Configuration reloads applied").inc()
+        P1Configuration.logger.info('Configuration reloaded: %d processors created, %d closed, %d updated',
+            len(createdProcessors), len(formerProcessors), len(reconfiguredProcessors))
+        return True
+
+    @staticmethod
+    def __withoutReloadableSettings(processorConfig: dict, processor: P1Processor) -> dict:
+        return {key: value for key, value in processorConfig.items() if (not key in processor.RELOADABLE_SETTINGS)}
 
     def closeProcessors(self) -> None:
         for processorName in self._processors:
              self._processors[processorName].closeProcessor()
 
+    @property
+    def meters(self) -> list[P1Meter]:
+        return self._meters
+
     @property
     def serialPortConfig(self) -> dict:
-        return self._configData["serialPortConfig"]
+        return self._meters[0].serialPortConfig
     
     @property
     def timeoutCycleLength(self) -> int:
-        return self.serialPortConfig["timeout"]
+        return max(meter.serialPortConfig["timeout"] for meter in self._meters)
+
+    @property
+    def readerMode(self) -> str:
+        if ("reader" in self._configData):
+            if ("mode" in self._configData["reader"]):
+                return self._configData["reader"]["mode"]
+        # default is to read line by line
+        return "line"
+
+    @property
+    def readerMaxFrameSize(self) -> int:
+        if ("reader" in self._configData):
+            if ("maxFrameSize" in self._configData["reader"]):
+                return self._configData["reader"]["maxFrameSize"]
+        # default is 8 kB, a telegram is usually below 1 kB
+        return 8192
 
     @property
-    def p1Transformations(self) -> dict:
-        if (not "p1Transform" in self._configData):
-            self._configData["p1Transform"] = dict()
-        return self._configData["p1Transform"]
+    def crcPolicy(self) -> str:
+        if ("reader" in self._configData):
+            if ("crcPolicy" in self._configData["reader"]):
+                return self._configData["reader"]["crcPolicy"]
+        # default is to count telegrams with a wrong CRC but still process them
+        return "count"
+
+    @property
+    def readerParseMode(self) -> str:
+        if ("reader" in self._configData):
+            if ("parseMode" in self._configData["reader"]):
+                return self._configData["reader"]["parseMode"]
+        # default is to parse all the datalines
+        return "full"
+
+    # default bound of each inter-thread queue: ~25 telegrams in "line" mode for the raw queue
+    DEFAULT_QUEUE_SIZES = {"raw": 1000, "p1Sequence": 100}
+
+    def queueConfig(self, queueName: str) -> dict:
+        """
+            maxSize and overflowPolicy of the "raw" (reader -> parser) or "p1Sequence" (parser -> schedulers) queue
+        """
+        queueConfig = {"maxSize": P1Configuration.DEFAULT_QUEUE_SIZES[queueName], "overflowPolicy": "block"}
+        if ("reader" in self._configData):
+            queueConfig.update(self._configData["reader"].get("queues", dict()).get(queueName, dict()))
+        return queueConfig
+
+    @property
+    def neededOBISCodes(self) -> frozenset:
+        """
+            OBIS codes (without multi-value index) which have to be parsed in "selective" parse mode:
+            codes used by schedules, operands of transformations and of the capacity tracker and the telegram timestamp.
+            None in "full" parse mode, meaning that all datalines are parsed.
+        """
+        if (self.readerParseMode != "selective"):
+            return None
+
+        if (self._neededOBISCodes is None):
+            neededCodes = {P1Sequence.OBIS_PACKET_DATE}
+            neededCodes.update(P1Sequence.splitOBISCode(obisCode)[0] for obisCode in self.filters)
+            neededCodes.update(self.p1Transformations.operandCodes)
+            if (self.capacityTariffEnabled):
+                neededCodes.update(self.scheduler.capacityTracker.operandCodes)
+            self._neededOBISCodes = frozenset(neededCodes)
+        return self._neededOBISCodes
+
+    @property
+    def p1Transformations(self) -> P1Transformations:
+        return self._p1Transformations
 
     @property
     def scheduling(self) -> dict:
@@ -115,7 +387,7 @@ class P1Configuration:
     
     @property
     def scheduler(self) -> P1Scheduler:
-        return self._scheduler
+        return self._meters[0].scheduler
 
     @property
     def filters(self) -> set:
@@ -133,6 +405,30 @@ class P1Configuration:
                 return self._configData["core"]["restartOnFailure"]
         return False
 
+    @property
+    def restartInitialBackoff(self) -> float:
+        """
+            Seconds before the second restart of a failed stage (the first restart is immediate)
+        """
+        if (("core" in self._configData) and ("restartBackoff" in self._configData["core"])):
+            return self._configData["core"]["restartBackoff"].get("initial", 0.1)
+        return 0.1
+
+    @property
+    def restartMaxBackoff(self) -> float:
+        if (("core" in self._configData) and ("restartBackoff" in self._configData["core"])):
+            return self._configData["core"]["restartBackoff"].get("max", 30)
+        return 30
+
+    @property
+    def watchConfigFile(self) -> bool:
+        """
+            True if the configuration must be reloaded when the configuration file changes
+        """
+        if ("core" in self._configData):
+            return self._configData["core"].get("watchConfigFile", False)
+        return False
+
     @property
     def smartMeterTimeZone(self) -> bool:
         return self._configData["core"]["smartMeterTimeZone_pytz"]
@@ -150,6 +446,38 @@ class P1Configuration:
         # default is 2160 cycles
         return 2160        
 
+    @property
+    def capacityTariffEnabled(self) -> bool:
+        if ("capacityTariff" in self._configData):
+            return self._configData["capacityTariff"]["enable"]
+        return False
+
+    @property
+    def metricsHTTPPort(self) -> int:
+        """
+            Port of the Prometheus metrics endpoint, None if it is disabled
+        """
+        if ("metrics" in self._configData):
+            return self._configData["metrics"].get("httpPort")
+        return None
+
+    @property
+    def metricsHTTPHost(self) -> str:
+        if ("metrics" in self._configData):
+            if ("httpHost" in self._configData["metrics"]):
+                return self._configData["metrics"]["httpHost"]
+        # default is to only serve metrics to the local machine
+        return "127.0.0.1"
+
+    @property
+    def metricsLogInterval(self) -> int:
+        """
+            Interval in seconds between two metrics summaries in the logs, None if disabled
+        """
+        if ("metrics" in self._configData):
+            return self._configData["metrics"].get("logInterval")
+        return None
+
     @property
     def __processorsConfig(self) -> dict:
         return self._configData["processors"]
@@ -0,0 +1,99 @@
+from datetime import datetime
+from decimal import Decimal
+import json
+import struct
+
+class P1PayloadEncoder:
+
+    """
+        Encodes the values selected from one telegram into a single payload, either:
+            * json: {"time": "<ISO 8601>", "values": {"<topic>": {"obis": "<code>", "value": 1.5, "unit": "kW"}}}
+            * cbor: the same structure in CBOR (RFC 8949), with the time as a tag 0 date/time string
+        Decimal values are encoded as numbers, dates as ISO 8601 strings.
+    """
+
+    @staticmethod
+    def toBatch(messageTime: datetime, selectedValues: list) -> dict:
+        """
+            Builds the batch structure from a list of (topic, obisCode, value, unit) tuples
+        """
+        values = dict()
+        for topic, obisCode, value, unit in selectedValues:
+            entry = {"obis": obisCode, "value": value}
+            if (unit is not None):
+                entry["unit"] = unit
+            values[topic] = entry
+        return {"time": messageTime, "values": values}
+
+    @classmethod
+    def encode(cls, payloadFormat: str, batch: dict) -> bytes:
+        if (payloadFormat == "cbor"):
+            return cls.encodeCBOR(batch)
+        return cls.encodeJSON(batch)
+
+    @staticmethod
+    def _jsonDefault(value):
+        if (isinstance(value, Decimal)):
+            return float(value)
+        if (isinstance(value, datetime)):
+            return value.isoformat()
+        return str(value)
+
+    @classmethod
+    def encodeJSON(cls, batch: dict) -> bytes:
+        return json.dumps(batch, separators=(',', ':'), default=cls._jsonDefault).encode("utf-8")
+
+    @classmethod
+    def encodeCBOR(cls, batch: dict) -> bytes:
+        output = bytearray()
+        cls._writeCBOR(output, batch)
+        return bytes(output)
+
+    @staticmethod
+    def _writeCBORHead(output: bytearray, majorType: int, argument: int) -> None:
+        if (argument < 24):
+            output.append((majorType << 5) | argument)
+        elif (argument < 0x100):
+            output.append((majorType << 5) | 24)
+            output.append(argument)
+        elif (argument < 0x10000):
+            output.append((majorType << 5) | 25)
+            output += struct.pack('>H', argument)
+        elif (argument < 0x100000000):
+            output.append((majorType << 5) | 26)
+            output += struct.pack('>I', argument)
+        else:
+            output.append((majorType << 5) | 27)
+            output += struct.pack('>Q', argument)
+
+    @classmethod
+    def _writeCBOR(cls, output: bytearray, value) -> None:
+        if (value is None):
+            output.append(0xf6)
+        elif (isinstance(value, bool)):
+            output.append(0xf5 if value else 0xf4)
+        elif (isinstance(value, int)):
+            if (value >= 0):
+                cls._writeCBORHead(output, 0, value)
+            else:
+                cls._writeCBORHead(output, 1, -1 - value)
+        elif (isinstance(value, (Decimal, float))):
+            output.append(0xfb)
+            output += struct.pack('>d', float(value))
+        elif (isinstance(value, datetime)):
+            # tag 0: standard date/time string
+            cls._writeCBORHead(output, 6, 0)
+            cls._writeCBOR(output, value.isoformat())
+        elif (isinstance(value, dict)):
+            cls._writeCBORHead(output, 5, len(value))
+            for key in value:
+                cls._writeCBOR(output, key)
+                cls._writeCBOR(output, value[key])
+        elif (isinstance(value, (list, tuple))):
+            cls._writeCBORHead(output, 4, len(value))
+            for item in value:
+                cls._writeCBOR(output, item)
+        else:
+            encoded = str(value).encode("utf-8")
+            cls._writeCBORHead(output, 3, len(encoded))
+            output += encoded
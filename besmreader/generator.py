@@ -0,0 +1,266 @@
+from datetime import datetime, timedelta
+from threading import Thread, Event
+import math
+import os
+import random
+import time
+import zlib
+
+from pytz import timezone
+
+from .capture import P1ReplayPort
+from .helper import LoggedClass
+from .telegram import P1TelegramCRC
+
+class P1TelegramGenerator:
+
+    """
+        Generates valid e-MUCS (Belgian DSMR 5) telegrams, in the format of docs/obis.md, for load testing.
+        Each generator simulates one meter from a seed:
+            * a household consumption (base load, daily profile and appliances switched on and off)
+              and an optional solar production, on 1 or 3 phases
+            * energy indexes integrated from the power, in the day (1) or night (2) tariff
+            * the quarter-hour average demand (1-0:1.4.0), the peak of the month (1-0:1.6.0) and the
+              history of the peaks of the previous months (0-0:98.1.0) used by capacity tariffs
+            * an optional M-Bus gas meter, whose reading is updated every 5 minutes
+        Telegrams are returned as bytes, from "/" to the CRC line, and have a valid CRC.
+    """
+    GAS_READING_PERIOD = 300
+    PEAK_HISTORY_MONTHS = 13
+
+    def __init__(self, meterNumber: int = 0, phases: int = 1, gas: bool = True, solarPeakPower: float = 0.0,
+                 meterTimeZone = timezone("Europe/Brussels"), seed: int = None) -> None:
+        if (phases not in (1, 3)):
+            raise ValueError("phases must be 1 or 3")
+
+        self._random = random.Random(seed if (seed is not None) else meterNumber)
+        self._phases = phases
+        self._gas = gas
+        self._solarPeakPower = solarPeakPower
+        self._meterTimeZone = meterTimeZone
+
+        self._header = "/FLU5\\253%06d_A" % (meterNumber % 1000000)
+        self._equipmentId = ("1SAG%016d" % meterNumber).encode("ascii").hex().upper()
+        self._gasEquipmentId = ("3SAG%016d" % meterNumber).encode("ascii").hex().upper()
+
+        # indexes in kWh / m3: a meter installed some time ago
+        self._consumedEnergy = [self._random.uniform(100, 5000), self._random.uniform(100, 5000)]
+        self._injectedEnergy = [self._random.uniform(0, 2000) if (solarPeakPower > 0) else 0.0, 0.0]
+        self._gasVolume = self._random.uniform(100, 3000) if (gas) else 0.0
+        self._gasReading = (None, self._gasVolume)
+
+        self._baseLoad = self._random.uniform(0.1, 0.4)
+        self._appliances = list()
+        self._cloudFactor = 1.0
+        self._voltages = [self._random.uniform(228, 236) for phase in range(phases)]
+
+        self._lastTime = None
+        self._quarterStart = None
+        self._quarterEnergy = 0.0
+        self._monthPeak = None
+        self._peakHistory = list()
+
+    def _formatTime(self, anyTime: datetime) -> str:
+        meterTime = anyTime.astimezone(self._meterTimeZone)
+        return meterTime.strftime("%y%m%d%H%M%S") + ("S" if meterTime.dst() else "W")
+
+    def _tariff(self, meterTime: datetime) -> int:
+        # day tariff on weekdays from 7h to 22h, night tariff otherwise
+        if ((meterTime.weekday() < 5) and (7 <= meterTime.hour < 22)):
+            return 1
+        return 2
+
+    def _consumption(self, meterTime: datetime, elapsedSeconds: float) -> float:
+        hour = meterTime.hour + meterTime.minute / 60
+        # morning and evening peaks of a household
+        profile = 0.3 * math.exp(-((hour - 7.5) ** 2) / 2) + 0.8 * math.exp(-((hour - 19) ** 2) / 4)
+
+        # appliances (kettle, oven, washing machine...) are switched on at random and run for a few minutes
+        self._appliances = [(power, endTime) for power, endTime in self._appliances if (endTime > meterTime)]
+        if (self._random.random() < elapsedSeconds / 1800):
+            self._appliances.append((self._random.choice((0.8, 1.2, 2.0, 2.4, 3.0)), meterTime + timedelta(seconds=self._random.uniform(60, 1800))))
+
+        noise = self._random.gauss(0, 0.02)
+        return max(0.05, self._baseLoad + profile + sum(power for power, endTime in self._appliances) + noise)
+
+    def _production(self, meterTime: datetime) -> float:
+        if (self._solarPeakPower <= 0):
+            return 0.0
+        hour = meterTime.hour + meterTime.minute / 60
+        self._cloudFactor = min(1.0, max(0.1, self._cloudFactor + self._random.gauss(0, 0.02)))
+        return max(0.0, self._solarPeakPower * self._cloudFactor * math.sin(math.pi * (hour - 6) / 15)) if (6 < hour < 21) else 0.0
+
+    def _updateDemand(self, telegramTime: datetime, meterTime: datetime, consumedPower: float, elapsedSeconds: float) -> float:
+        """
+            Accumulates the consumed energy of the current quarter-hour, updates the peak of the month at the
+            end of each quarter-hour and returns the current average demand in kW
+        """
+        quarterStart = telegramTime.replace(minute=telegramTime.minute - telegramTime.minute % 15, second=0, microsecond=0)
+        if (self._quarterStart is None):
+            self._quarterStart = quarterStart
+        elif (quarterStart != self._quarterStart):
+            quarterDemand = self._quarterEnergy * 4
+            if ((self._monthPeak is None) or (quarterDemand > self._monthPeak[1])):
+                self._monthPeak = (self._formatTime(self._quarterStart), quarterDemand)
+            if (self._quarterStart.astimezone(self._meterTimeZone).month != meterTime.month):
+                # new month: the peak of the previous month goes to the history
+                self._peakHistory.insert(0, (self._formatTime(quarterStart), ) + self._monthPeak)
+                del self._peakHistory[P1TelegramGenerator.PEAK_HISTORY_MONTHS:]
+                self._monthPeak = None
+            self._quarterStart = quarterStart
+            self._quarterEnergy = 0.0
+
+        self._quarterEnergy += consumedPower * elapsedSeconds / 3600
+        quarterElapsedHours = max((telegramTime - self._quarterStart).total_seconds(), 1) / 3600
+        return self._quarterEnergy / quarterElapsedHours if (quarterElapsedHours < 0.25) else self._quarterEnergy * 4
+
+    def telegram(self, telegramTime: datetime) -> bytes:
+        """
+            Returns the telegram sent by the meter at telegramTime (an aware datetime). Consecutive calls must
+            use increasing times: the power of the previous telegram is integrated until telegramTime.
+        """
+        meterTime = telegramTime.astimezone(self._meterTimeZone)
+        elapsedSeconds = (telegramTime - self._lastTime).total_seconds() if (self._lastTime is not None) else 1.0
+        self._lastTime = telegramTime
+
+        consumedPower = self._consumption(meterTime, elapsedSeconds)
+        producedPower = self._production(meterTime)
+        netPower = consumedPower - producedPower
+        tariff = self._tariff(meterTime)
+        if (netPower >= 0):
+            self._consumedEnergy[tariff - 1] += netPower * elapsedSeconds / 3600
+        else:
+            self._injectedEnergy[tariff - 1] += -netPower * elapsedSeconds / 3600
+        demand = self._updateDemand(telegramTime, meterTime, max(netPower, 0), elapsedSeconds)
+
+        lines = [
+            self._header,
+            "",
+            "0-0:96.1.4(50217)",
+            "0-0:96.1.1(%s)" % self._equipmentId,
+            "0-0:1.0.0(%s)" % self._formatTime(telegramTime),
+            "1-0:1.8.1(%010.3f*kWh)" % self._consumedEnergy[0],
+            "1-0:1.8.2(%010.3f*kWh)" % self._consumedEnergy[1],
+            "1-0:2.8.1(%010.3f*kWh)" % self._injectedEnergy[0],
+            "1-0:2.8.2(%010.3f*kWh)" % self._injectedEnergy[1],
+            "0-0:96.14.0(%04d)" % tariff,
+            "1-0:1.4.0(%06.3f*kW)" % demand
+        ]
+        if (self._monthPeak is not None):
+            lines.append("1-0:1.6.0(%s)(%06.3f*kW)" % self._monthPeak)
+        else:
+            lines.append("1-0:1.6.0(%s)(%06.3f*kW)" % (self._formatTime(self._quarterStart), demand))
+        lines.append("0-0:98.1.0(%d)(1-0:1.6.0)(1-0:1.6.0)" % len(self._peakHistory)
+                     + ("".join("(%s)(%s)(%06.3f*kW)" % peak for peak in self._peakHistory) if (self._peakHistory) else "()"))
+        lines.append("1-0:1.7.0(%06.3f*kW)" % max(netPower, 0))
+        lines.append("1-0:2.7.0(%06.3f*kW)" % max(-netPower, 0))
+
+        # power and current of each phase (L1: 21/22/31/32, L2: 41/42/51/52, L3: 61/62/71/72)
+        phasePowers = [netPower / self._phases] * self._phases
+        for phase in range(self._phases):
+            lines.append("1-0:%d1.7.0(%06.3f*kW)" % (2 + 2 * phase, max(phasePowers[phase], 0)))
+        for phase in range(self._phases):
+            lines.append("1-0:%d2.7.0(%06.3f*kW)" % (2 + 2 * phase, max(-phasePowers[phase], 0)))
+        for phase in range(self._phases):
+            # the voltage fluctuates around 232V, injection raises it
+            targetVoltage = 232 + (2 * -phasePowers[phase] if (phasePowers[phase] < 0) else 0)
+            self._voltages[phase] = min(253, max(207, self._voltages[phase] + 0.1 * (targetVoltage - self._voltages[phase]) + self._random.gauss(0, 0.3)))
+        for phase in range(self._phases):
+            lines.append("1-0:%d2.7.0(%05.1f*V)" % (3 + 2 * phase, self._voltages[phase]))
+        for phase in range(self._phases):
+            lines.append("1-0:%d1.7.0(%06.2f*A)" % (3 + 2 * phase, abs(phasePowers[phase]) * 1000 / self._voltages[phase]))
+
+        lines.append("0-0:96.3.10(1)")
+        lines.append("0-0:17.0.0(999.9*kW)")
+        for phase in range(self._phases):
+            lines.append("1-0:%d1.4.0(999*A)" % (3 + 2 * phase))
+        lines.append("0-0:96.13.0()")
+
+        if (self._gas):
+            gasReadingTime = datetime.fromtimestamp(telegramTime.timestamp() // P1TelegramGenerator.GAS_READING_PERIOD * P1TelegramGenerator.GAS_READING_PERIOD, telegramTime.tzinfo)
+            # heating and hot water: more gas in the morning and the evening
+            self._gasVolume += self._random.uniform(0, 0.4 if (meterTime.hour in (6, 7, 8, 18, 19, 20, 21)) else 0.1) * elapsedSeconds / 3600
+            if (self._gasReading[0] != gasReadingTime):
+                self._gasReading = (gasReadingTime, self._gasVolume)
+            lines.append("0-1:24.1.0(003)")
+            lines.append("0-1:96.1.1(%s)" % self._gasEquipmentId)
+            lines.append("0-1:24.4.0(1)")
+            lines.append("0-1:24.2.3(%s)(%09.3f*m3)" % (self._formatTime(gasReadingTime), self._gasReading[1]))
+
+        telegramBody = ("\r\n".join(lines) + "\r\n!").encode("ascii")
+        return telegramBody + ("%04X\r\n" % P1TelegramCRC.compute(telegramBody)).encode("ascii")
+
+    def telegrams(self, startTime: datetime, interval: float = 1.0):
+        """
+            Endless iterator over the (telegramTime, telegram) sent every interval seconds from startTime
+        """
+        telegramIndex = 0
+        while (True):
+            telegramTime = startTime + timedelta(seconds=telegramIndex * interval)
+            yield telegramTime, self.telegram(telegramTime)
+            telegramIndex += 1
+
+    @classmethod
+    def fromConfig(cls, generatorConfig: dict, meterId: str, meterTimeZone) -> "P1TelegramGenerator":
+        """
+            Creates the generator of a "generator" configuration. Each meter id gets its own serial number and seed.
+        """
+        return cls(zlib.crc32(meterId.encode("utf-8")) % 1000000, generatorConfig.get("phases", 1), generatorConfig.get("gas", True),
+                   generatorConfig.get("solarPeakPower", 0.0), meterTimeZone, generatorConfig.get("seed"))
+
+class P1GeneratorPort (P1ReplayPort):
+
+    """
+        A stand-in for serial.Serial which receives the telegrams of a P1TelegramGenerator, so that they go
+        through the whole pipeline without a serial port:
+            * rate telegrams are sent per second (0: as fast as possible)
+            * the time of the telegrams starts now and is incremented by interval seconds for each telegram:
+              with a rate of 10 and an interval of 1, the meter runs 10 times faster than a real one
+    """
+
+    def __init__(self, generator: P1TelegramGenerator, rate: float = 1.0, interval: float = 1.0, timeout: float = 5) -> None:
+        self._generator = generator
+        self._rate = rate
+        self._interval = interval
+        P1ReplayPort.__init__(self, None, 1.0 if (rate > 0) else 0, False, timeout)
+
+    def _openRecords(self):
+        rate = self._rate if (self._rate > 0) else 1.0
+        return ((telegramIndex / rate, telegram) for telegramIndex, (telegramTime, telegram)
+                in enumerate(self._generator.telegrams(datetime.now().astimezone(), self._interval)))
+
+class P1PtyGeneratorThread (Thread, LoggedClass):
+
+    """
+        A Thread which writes the telegrams of a P1TelegramGenerator to a pseudo-terminal, at rate telegrams per second,
+        until stopEvent is set. The slave side of the pseudo-terminal (ptyName) can be used as the "port" of a
+        serialPortConfig: the program reads it like a real P1 cable. Only available on POSIX systems.
+    """
+
+    def __init__(self, generator: P1TelegramGenerator, stopEvent: Event, rate: float = 1.0, interval: float = 1.0) -> None:
+        LoggedClass.__init__(self)
+        Thread.__init__(self)
+        self.daemon = True
+        self.generator = generator
+        self.stopEvent = stopEvent
+        self.rate = rate
+        self.interval = interval
+        self.masterFd, slaveFd = os.openpty()
+        self.ptyName = os.ttyname(slaveFd)
+        # the slave stays open so that the pseudo-terminal exists when the reader is not connected
+        self.slaveFd = slaveFd
+
+    def run(self) -> None:
+        super().logger.info('Writing telegrams to %s', self.ptyName)
+        startTime = time.monotonic()
+        for telegramIndex, (telegramTime, telegram) in enumerate(self.generator.telegrams(datetime.now().astimezone(), self.interval)):
+            if (self.rate > 0):
+                if (self.stopEvent.wait(max(0, startTime + telegramIndex / self.rate - time.monotonic()))):
+                    break
+            elif (self.stopEvent.is_set()):
+                break
+            os.write(self.masterFd, telegram)
+
+        os.close(self.masterFd)
+        os.close(self.slaveFd)
+        super().logger.info('Stopped writing to %s', self.ptyName)
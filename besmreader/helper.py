@@ -1,6 +1,15 @@
 import logging
 from threading import Thread
 
+class P1ConfigurationError (Exception):
+    """
+        Exception in the P1Configuration of the overall module
+    """
+
+    def __init__(self, message="Configuration is incorrect"):
+        self.message = message
+        super().__init__(self.message)
+
 class LoggedClass:
 
     """
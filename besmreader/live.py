@@ -0,0 +1,315 @@
+from collections import deque
+from datetime import datetime
+from threading import Lock, Thread
+import asyncio
+import base64
+import hashlib
+import struct
+
+from .encoding import P1PayloadEncoder
+from .helper import LoggedClass
+from .metrics import P1Metrics
+
+_WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_WEBSOCKET_TEXT = 0x1
+_WEBSOCKET_CLOSE = 0x8
+_WEBSOCKET_PING = 0x9
+_WEBSOCKET_PONG = 0xA
+
+class P1LiveClient:
+
+    """
+        A client of the stream (Server-Sent Events or WebSocket) with its own bounded buffer of frames.
+        Frames are bytes objects shared by all the clients: they are encoded once per message.
+        When the buffer is full (a client which reads slower than the telegrams arrive), the oldest
+        frame is dropped, so that a slow client only gets the newest readings and never slows down the others.
+    """
+    __slots__ = ("writer", "isWebSocket", "frames", "wakeEvent", "droppedCount")
+
+    def __init__(self, writer: asyncio.StreamWriter, isWebSocket: bool, bufferSize: int) -> None:
+        self.writer = writer
+        self.isWebSocket = isWebSocket
+        self.frames = deque(maxlen=bufferSize)
+        self.wakeEvent = asyncio.Event()
+        self.droppedCount = 0
+
+    def push(self, frame: bytes) -> bool:
+        """
+            Queues a frame, returns False if the oldest frame was dropped to make room for it
+        """
+        dropped = (len(self.frames) == self.frames.maxlen)
+        if (dropped):
+            self.droppedCount += 1
+        self.frames.append(frame)
+        self.wakeEvent.set()
+        return (not dropped)
+
+class P1LiveServer (LoggedClass):
+
+    """
+        A local HTTP server (asyncio, in its own thread) which serves the latest readings to many clients
+        (dashboards, automations...) without a MQTT broker:
+            * GET /snapshot: the latest value of every topic, as JSON
+            * GET /events: a Server-Sent Events stream, one event per message, starting with the snapshot
+            * GET /ws: the same stream over a WebSocket (text frames)
+        Messages use the JSON batch format of P1PayloadEncoder: {"time": ..., "values": {"<topic>": {...}}}.
+
+        publish() is called by the processing thread and never blocks it: messages are handed to the event loop
+        through a bounded buffer (the oldest messages are dropped if the loop is late) with at most one pending
+        wake-up of the loop. Each message is encoded once, and the same bytes are queued to all the clients.
+    """
+    HANDOFF_SIZE = 64
+    REQUEST_TIMEOUT = 10.0
+    MAX_REQUEST_SIZE = 8192
+    WEBSOCKET_MAX_PAYLOAD = 125
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, maxClients: int = 500, clientBufferSize: int = 16,
+                 heartbeatInterval: float = 15.0, allowOrigin: str = None, metricsName: str = "live") -> None:
+        LoggedClass.__init__(self)
+        self._maxClients = maxClients
+        self._clientBufferSize = clientBufferSize
+        self._heartbeatInterval = heartbeatInterval
+        self._allowOrigin = allowOrigin
+        self._clients = set()
+        self._connections = dict()
+        self._snapshotValues = dict()
+        self._snapshotTime = None
+        self._snapshotBytes = None
+
+        self._handOffLock = Lock()
+        self._pendingMessages = deque(maxlen=P1LiveServer.HANDOFF_SIZE)
+        self._wakeScheduled = False
+
+        self._messagesCounter = P1Metrics.counter("besm_live_messages_total", "Messages sent to the clients of the live server", processor=metricsName)
+        self._droppedCounter = P1Metrics.counter("besm_live_dropped_total", "Frames dropped because a client of the live server was too slow", processor=metricsName)
+        P1Metrics.gauge("besm_live_clients", "Clients connected to the stream of the live server", lambda: len(self._clients), processor=metricsName)
+
+        self._loop = asyncio.new_event_loop()
+        # bound at once (without SO_REUSEPORT), so that a port which is already used is a configuration error
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self.__handleConnection, host, port, limit=P1LiveServer.MAX_REQUEST_SIZE))
+        except OSError:
+            self._loop.close()
+            raise
+        self._thread = Thread(target=self.__runLoop, name="P1LiveServer", daemon=True)
+        self._thread.start()
+        super().logger.info('Serving live readings on http://%s:%d/', *self._server.sockets[0].getsockname()[:2])
+
+    def reconfigure(self, maxClients: int, clientBufferSize: int, heartbeatInterval: float, allowOrigin: str) -> None:
+        """
+            Changes the settings which do not need a new socket (eg on a configuration reload). Connected clients
+            keep their buffer size
+        """
+        self._maxClients = maxClients
+        self._clientBufferSize = clientBufferSize
+        self._heartbeatInterval = heartbeatInterval
+        self._allowOrigin = allowOrigin
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    @property
+    def clientCount(self) -> int:
+        return len(self._clients)
+
+    def __runLoop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def publish(self, messageTime: datetime, selectedValues: list) -> None:
+        """
+            Sends a list of (topic, obisCode, value, unit) tuples to the clients, from any thread
+        """
+        with self._handOffLock:
+            self._pendingMessages.append((messageTime, selectedValues))
+            if (self._wakeScheduled):
+                return
+            self._wakeScheduled = True
+        self._loop.call_soon_threadsafe(self.__dispatchPending)
+
+    def close(self) -> None:
+        if (self._loop.is_closed()):
+            return
+        asyncio.run_coroutine_threadsafe(self.__shutdown(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop.close()
+
+    async def __shutdown(self) -> None:
+        self._server.close()
+        # aborted rather than closed: a slow client would keep its connection open until its data is sent
+        for writer in self._connections.values():
+            writer.transport.abort()
+        if (self._connections):
+            await asyncio.wait(list(self._connections), timeout=1.0)
+        await self._server.wait_closed()
+
+    # everything below runs in the event loop thread
+
+    def __dispatchPending(self) -> None:
+        with self._handOffLock:
+            messages = list(self._pendingMessages)
+            self._pendingMessages.clear()
+            self._wakeScheduled = False
+
+        for messageTime, selectedValues in messages:
+            batch = P1PayloadEncoder.toBatch(messageTime, selectedValues)
+            self._snapshotValues.update(batch["values"])
+            self._snapshotTime = messageTime
+            self._snapshotBytes = None
+            if (self._clients):
+                self.__broadcast(P1PayloadEncoder.encodeJSON(batch))
+
+    def __broadcast(self, payload: bytes) -> None:
+        # one frame of each kind for all the clients
+        eventFrame = None
+        webSocketFrame = None
+        for client in self._clients:
+            if (client.isWebSocket):
+                if (webSocketFrame is None):
+                    webSocketFrame = P1LiveServer.__webSocketFrame(_WEBSOCKET_TEXT, payload)
+                frame = webSocketFrame
+            else:
+                if (eventFrame is None):
+                    eventFrame = b"data: " + payload + b"\n\n"
+                frame = eventFrame
+            if (not client.push(frame)):
+                self._droppedCounter.inc()
+        self._messagesCounter.inc()
+
+    def __snapshot(self) -> bytes:
+        if (self._snapshotBytes is None):
+            self._snapshotBytes = P1PayloadEncoder.encodeJSON({"time": self._snapshotTime, "values": self._snapshotValues})
+        return self._snapshotBytes
+
+    async def __handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connectionTask = asyncio.current_task()
+        self._connections[connectionTask] = writer
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), P1LiveServer.REQUEST_TIMEOUT)
+            method, path, headers = P1LiveServer.__parseRequest(request)
+            path = path.split("?")[0]
+
+            if (method != "GET"):
+                await self.__respond(writer, "405 Method Not Allowed", b"")
+            elif (path == "/snapshot"):
+                await self.__respond(writer, "200 OK", self.__snapshot(), "application/json")
+            elif ((path == "/events") or (path == "/ws")):
+                await self.__stream(reader, writer, headers, path == "/ws")
+            else:
+                await self.__respond(writer, "404 Not Found", b"")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError, ConnectionError):
+            pass
+        except Exception:
+            super().logger.exception('Live server connection failed')
+        finally:
+            del self._connections[connectionTask]
+            writer.close()
+
+    @staticmethod
+    def __parseRequest(request: bytes) -> tuple:
+        lines = request.decode("latin-1").split("\r\n")
+        method, path, version = lines[0].split(" ")
+        headers = dict()
+        for line in lines[1:]:
+            name, separator, value = line.partition(":")
+            if (separator):
+                headers[name.strip().lower()] = value.strip()
+        return method, path, headers
+
+    def __headers(self, status: str, contentType: str = None, extraHeaders: list = None) -> bytes:
+        headers = ["HTTP/1.1 " + status]
+        if (contentType is not None):
+            headers.append("Content-Type: " + contentType)
+        if (self._allowOrigin is not None):
+            headers.append("Access-Control-Allow-Origin: " + self._allowOrigin)
+        headers.extend(extraHeaders if (extraHeaders is not None) else ["Connection: close"])
+        return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1")
+
+    async def __respond(self, writer: asyncio.StreamWriter, status: str, body: bytes, contentType: str = "text/plain") -> None:
+        writer.write(self.__headers(status, contentType, ["Content-Length: " + str(len(body)), "Connection: close"]) + body)
+        await writer.drain()
+
+    async def __stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: dict, isWebSocket: bool) -> None:
+        if (len(self._clients) >= self._maxClients):
+            await self.__respond(writer, "503 Service Unavailable", b"Too many clients\n")
+            return
+
+        if (isWebSocket):
+            webSocketKey = headers.get("sec-websocket-key")
+            if ((headers.get("upgrade", "").lower() != "websocket") or (webSocketKey is None)):
+                await self.__respond(writer, "400 Bad Request", b"WebSocket upgrade expected\n")
+                return
+            acceptKey = base64.b64encode(hashlib.sha1(webSocketKey.encode("latin-1") + _WEBSOCKET_GUID).digest()).decode("latin-1")
+            writer.write(self.__headers("101 Switching Protocols", None, ["Upgrade: websocket", "Connection: Upgrade", "Sec-WebSocket-Accept: " + acceptKey]))
+        else:
+            writer.write(self.__headers("200 OK", "text/event-stream", ["Cache-Control: no-cache", "Connection: keep-alive"]))
+
+        client = P1LiveClient(writer, isWebSocket, self._clientBufferSize)
+        snapshot = self.__snapshot()
+        client.push(P1LiveServer.__webSocketFrame(_WEBSOCKET_TEXT, snapshot) if (isWebSocket) else b"data: " + snapshot + b"\n\n")
+        self._clients.add(client)
+        # the client only sends WebSocket control frames (or closes the connection): reading them detects disconnections
+        readerTask = asyncio.ensure_future(self.__readWebSocket(reader, client) if (isWebSocket) else P1LiveServer.__readEventStream(reader))
+        readerTask.add_done_callback(lambda task: client.wakeEvent.set())
+        try:
+            await self.__writeFrames(client, readerTask)
+        finally:
+            self._clients.discard(client)
+            readerTask.cancel()
+
+    async def __writeFrames(self, client: P1LiveClient, readerTask: asyncio.Future) -> None:
+        heartbeatFrame = P1LiveServer.__webSocketFrame(_WEBSOCKET_PING, b"") if (client.isWebSocket) else b": heartbeat\n\n"
+        while (not readerTask.done()):
+            if (not client.frames):
+                try:
+                    await asyncio.wait_for(client.wakeEvent.wait(), self._heartbeatInterval)
+                except asyncio.TimeoutError:
+                    client.frames.append(heartbeatFrame)
+                client.wakeEvent.clear()
+            while (client.frames):
+                client.writer.write(client.frames.popleft())
+                # frames queued meanwhile wait in the bounded buffer of the client, not in the transport
+                await client.writer.drain()
+
+    @staticmethod
+    async def __readEventStream(reader: asyncio.StreamReader) -> None:
+        # an event stream client sends nothing after its request: whatever it sends is discarded until it closes the connection
+        while (await reader.read(P1LiveServer.MAX_REQUEST_SIZE)):
+            pass
+
+    async def __readWebSocket(self, reader: asyncio.StreamReader, client: P1LiveClient) -> None:
+        """
+            Reads the (masked) frames sent by a WebSocket client until it closes the connection: pings are
+            answered, other frames are ignored
+        """
+        while (True):
+            header = await reader.readexactly(2)
+            opcode = header[0] & 0x0F
+            payloadLength = header[1] & 0x7F
+            if (payloadLength == 126):
+                payloadLength = struct.unpack(">H", await reader.readexactly(2))[0]
+            elif (payloadLength == 127):
+                payloadLength = struct.unpack(">Q", await reader.readexactly(8))[0]
+            if ((payloadLength > P1LiveServer.MAX_REQUEST_SIZE) or ((opcode >= _WEBSOCKET_CLOSE) and (payloadLength > P1LiveServer.WEBSOCKET_MAX_PAYLOAD))):
+                raise ValueError("WebSocket frame too long")
+            mask = await reader.readexactly(4) if (header[1] & 0x80) else b"\x00\x00\x00\x00"
+            payload = await reader.readexactly(payloadLength)
+
+            if (opcode == _WEBSOCKET_CLOSE):
+                client.writer.write(P1LiveServer.__webSocketFrame(_WEBSOCKET_CLOSE, b""))
+                return
+            if (opcode == _WEBSOCKET_PING):
+                client.push(P1LiveServer.__webSocketFrame(_WEBSOCKET_PONG, bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))))
+
+    @staticmethod
+    def __webSocketFrame(opcode: int, payload: bytes) -> bytes:
+        payloadLength = len(payload)
+        if (payloadLength < 126):
+            header = struct.pack(">BB", 0x80 | opcode, payloadLength)
+        elif (payloadLength < 0x10000):
+            header = struct.pack(">BBH", 0x80 | opcode, 126, payloadLength)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, payloadLength)
+        return header + payload
@@ -0,0 +1,79 @@
+from threading import Lock
+
+from .scheduler import P1Scheduler
+
+class P1Meter:
+
+    """
+        A smart meter read by the program. Each meter has:
+            * an id, used to tag the data read from its serial port
+            * its own serial port configuration, or instead of the serial port: a capture file to replay
+              or a generator of synthetic telegrams
+            * an optional capture file in which all the data read is recorded
+            * a topic prefix, added to all the topics published for this meter
+            * its own scheduler, as triggers, aggregations and "changed" values are per meter
+
+        Processors (and their connections) are shared by all meters.
+        The scheduler is used while holding schedulerLock, so that a configuration reload can replace it
+        between two telegrams.
+    """
+    DEFAULT_METER_ID = "default"
+
+    def __init__(self, meterId: str, serialPortConfig: dict, topicPrefix: str, scheduler: P1Scheduler, replayConfig: dict = None, captureConfig: dict = None,
+                 generatorConfig: dict = None) -> None:
+        self._meterId = meterId
+        self._serialPortConfig = serialPortConfig
+        self._topicPrefix = topicPrefix
+        self._scheduler = scheduler
+        self._schedulerLock = Lock()
+        self._replayConfig = replayConfig
+        self._captureConfig = captureConfig
+        self._generatorConfig = generatorConfig
+
+    @property
+    def meterId(self) -> str:
+        return self._meterId
+
+    @property
+    def serialPortConfig(self) -> dict:
+        return self._serialPortConfig
+
+    @property
+    def replayConfig(self) -> dict:
+        """
+            Configuration of the capture file replayed instead of the serial port, None to read the serial port
+        """
+        return self._replayConfig
+
+    @property
+    def generatorConfig(self) -> dict:
+        """
+            Configuration of the synthetic telegrams generated instead of reading the serial port, None to read the serial port
+        """
+        return self._generatorConfig
+
+    @property
+    def captureConfig(self) -> dict:
+        """
+            Configuration of the capture file recording the data read, None if no capture is done
+        """
+        return self._captureConfig
+
+    @property
+    def topicPrefix(self) -> str:
+        return self._topicPrefix
+
+    @property
+    def scheduler(self) -> P1Scheduler:
+        return self._scheduler
+
+    @scheduler.setter
+    def scheduler(self, scheduler: P1Scheduler) -> None:
+        self._scheduler = scheduler
+
+    @property
+    def schedulerLock(self) -> Lock:
+        return self._schedulerLock
+
+    def __repr__(self) -> str:
+        return "P1Meter(" + self._meterId + ")"
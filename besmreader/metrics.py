@@ -0,0 +1,263 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread, Event
+import logging
+
+from .helper import LoggedClass
+
+class P1Counter:
+
+    """
+        A monotonic counter. To keep increments cheap, they are not locked: a counter must only be
+        incremented by one thread (each stage of the pipeline has its own counters) and can be read
+        by any thread.
+    """
+    __slots__ = ("_value", )
+
+    def __init__(self) -> None:
+        self._value = 0
+
+    @property
+    def value(self):
+        return self._value
+
+    def inc(self, amount=1) -> None:
+        self._value += amount
+
+class P1Gauge:
+
+    """
+        A gauge whose value is read from a function when the metrics are exported (eg a queue size),
+        so that it has no cost for the pipeline.
+    """
+    __slots__ = ("_function", )
+
+    def __init__(self, function) -> None:
+        self._function = function
+
+    @property
+    def value(self):
+        try:
+            return self._function()
+        except Exception:
+            return float("nan")
+
+class P1Histogram:
+
+    """
+        A histogram with fixed buckets (upper bounds, in seconds for latencies).
+        Observations cost one bisection on the buckets. Like counters, a histogram must only be
+        updated by one thread: a concurrent export may be one observation behind.
+    """
+    __slots__ = ("_buckets", "_counts", "_sum", "_count")
+
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def cumulativeBuckets(self) -> list[tuple[float, int]]:
+        """
+            Returns the (upper bound, cumulative count) of each bucket, the last bound being +Inf
+        """
+        counts = list(self._counts)
+        cumulativeCount = 0
+        cumulativeBuckets = list()
+        for upperBound, bucketCount in zip(self._buckets + (float("inf"), ), counts):
+            cumulativeCount += bucketCount
+            cumulativeBuckets.append((upperBound, cumulativeCount))
+        return cumulativeBuckets
+
+    def quantile(self, quantile: float) -> float:
+        """
+            Upper bound of the bucket containing the quantile (None if there is no observation)
+        """
+        if (self._count == 0):
+            return None
+        rank = quantile * self._count
+        for upperBound, cumulativeCount in self.cumulativeBuckets():
+            if (cumulativeCount >= rank):
+                return upperBound
+        return float("inf")
+
+class P1Metrics:
+
+    """
+        The registry of all the metrics of the program. Metrics are identified by their name and labels
+        and are created on first use, so that any module can get a metric without configuration:
+            P1Metrics.counter("besm_telegrams_total", "Telegrams parsed", meter="default").inc()
+
+        Metrics are kept when threads are restarted so that counters never go backwards.
+    """
+    _metrics = dict()
+    _helpTexts = dict()
+    _types = dict()
+    _lock = Lock()
+
+    @classmethod
+    def __getOrCreate(cls, metricType: str, name: str, helpText: str, labels: dict, factory):
+        key = (name, tuple(sorted(labels.items())))
+        metric = cls._metrics.get(key)
+        if (metric is None):
+            with cls._lock:
+                metric = cls._metrics.get(key)
+                if (metric is None):
+                    metric = factory()
+                    cls._metrics[key] = metric
+                    cls._helpTexts[name] = helpText
+                    cls._types[name] = metricType
+        return metric
+
+    @classmethod
+    def counter(cls, name: str, helpText: str, **labels) -> P1Counter:
+        return cls.__getOrCreate("counter", name, helpText, labels, P1Counter)
+
+    @classmethod
+    def histogram(cls, name: str, helpText: str, buckets: tuple = P1Histogram.DEFAULT_BUCKETS, **labels) -> P1Histogram:
+        return cls.__getOrCreate("histogram", name, helpText, labels, lambda: P1Histogram(buckets))
+
+    @classmethod
+    def gauge(cls, name: str, helpText: str, function, **labels) -> P1Gauge:
+        """
+            Registers (or replaces, eg after a restart of the threads) a gauge reading its value from function
+        """
+        key = (name, tuple(sorted(labels.items())))
+        gauge = P1Gauge(function)
+        with cls._lock:
+            cls._metrics[key] = gauge
+            cls._helpTexts[name] = helpText
+            cls._types[name] = "gauge"
+        return gauge
+
+    @staticmethod
+    def __formatLabels(labels: tuple, extraLabel: tuple = None) -> str:
+        if (extraLabel is not None):
+            labels = labels + (extraLabel, )
+        if (not labels):
+            return ""
+        return "{" + ",".join('%s="%s"' % (labelName, str(labelValue).replace('\\', '\\\\').replace('"', '\\"')) for labelName, labelValue in labels) + "}"
+
+    @staticmethod
+    def __formatValue(value) -> str:
+        if (value == float("inf")):
+            return "+Inf"
+        return repr(float(value)) if isinstance(value, float) else str(value)
+
+    @classmethod
+    def renderPrometheus(cls) -> str:
+        """
+            Returns all the metrics in the Prometheus text exposition format
+        """
+        with cls._lock:
+            metrics = sorted(cls._metrics.items(), key=lambda item: item[0])
+
+        lines = list()
+        currentName = None
+        for (name, labels), metric in metrics:
+            if (name != currentName):
+                lines.append("# HELP %s %s" % (name, cls._helpTexts[name]))
+                lines.append("# TYPE %s %s" % (name, cls._types[name]))
+                currentName = name
+
+            if (isinstance(metric, P1Histogram)):
+                for upperBound, cumulativeCount in metric.cumulativeBuckets():
+                    lines.append("%s_bucket%s %d" % (name, cls.__formatLabels(labels, ("le", cls.__formatValue(upperBound))), cumulativeCount))
+                lines.append("%s_sum%s %s" % (name, cls.__formatLabels(labels), repr(metric.sum)))
+                lines.append("%s_count%s %d" % (name, cls.__formatLabels(labels), metric.count))
+            else:
+                lines.append("%s%s %s" % (name, cls.__formatLabels(labels), cls.__formatValue(metric.value)))
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def summary(cls) -> str:
+        """
+            Returns a one line summary of the metrics for the logs: counters and gauges values,
+            count and approximate median / 99th percentile of histograms
+        """
+        with cls._lock:
+            metrics = sorted(cls._metrics.items(), key=lambda item: item[0])
+
+        parts = list()
+        for (name, labels), metric in metrics:
+            label = name + cls.__formatLabels(labels)
+            if (isinstance(metric, P1Histogram)):
+                if (metric.count > 0):
+                    parts.append("%s count=%d p50<=%s p99<=%s" % (label, metric.count, cls.__formatValue(metric.quantile(0.5)), cls.__formatValue(metric.quantile(0.99))))
+            else:
+                parts.append("%s=%s" % (label, cls.__formatValue(metric.value)))
+        return ", ".join(parts)
+
+class _P1MetricsRequestHandler (BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        if (self.path.split("?")[0] != "/metrics"):
+            self.send_error(404)
+            return
+
+        body = P1Metrics.renderPrometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        logging.getLogger("besm.P1MetricsHTTPServerThread").debug(format, *args)
+
+class P1MetricsHTTPServerThread (Thread, LoggedClass):
+
+    """
+        A Thread serving the metrics in Prometheus format on http://host:port/metrics.
+        It is started once and keeps running when the other threads are restarted.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        LoggedClass.__init__(self)
+        Thread.__init__(self)
+        self.daemon = True
+        self.httpServer = ThreadingHTTPServer((host, port), _P1MetricsRequestHandler)
+        self.httpServer.daemon_threads = True
+
+    def run(self) -> None:
+        super().logger.info('Serving metrics on http://%s:%d/metrics', *self.httpServer.server_address[:2])
+        self.httpServer.serve_forever()
+
+    def stop(self) -> None:
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+class P1MetricsLoggerThread (Thread, LoggedClass):
+
+    """
+        A Thread which logs a summary of the metrics every logInterval seconds until stopEvent is set
+    """
+
+    def __init__(self, stopEvent: Event, logInterval: float) -> None:
+        LoggedClass.__init__(self)
+        Thread.__init__(self)
+        self.daemon = True
+        self.stopEvent = stopEvent
+        self.logInterval = logInterval
+
+    def run(self) -> None:
+        super().logger.info('Starting')
+        while (not self.stopEvent.wait(self.logInterval)):
+            super().logger.info('Metrics: %s', P1Metrics.summary())
+        super().logger.info('Stopped')
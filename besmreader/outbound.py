@@ -0,0 +1,86 @@
+from collections import deque, OrderedDict
+from threading import Condition
+
+class P1OutboundQueue:
+
+    """
+        A bounded, thread-safe queue of (topic, payload) messages waiting to be sent by a processor.
+        When the queue is full, the overflow policy decides what is lost:
+            * dropOldest: the oldest message is dropped to make room for the new one
+            * coalesce: only the latest payload of each topic is kept, in the order topics were
+            first queued. If the queue is full of distinct topics, the oldest topic is dropped.
+        As in P1PipelineQueue, droppedCount counts the messages lost because the queue was full (overflow) and
+        replacedCount the payloads replaced by a newer payload of the same topic (coalesce only).
+    """
+
+    def __init__(self, maxSize: int = 1000, overflowPolicy: str = "dropOldest") -> None:
+        self._maxSize = maxSize
+        self._overflowPolicy = overflowPolicy
+        self._condition = Condition()
+        self._droppedCount = 0
+        self._replacedCount = 0
+        if (overflowPolicy == "coalesce"):
+            self._messages = OrderedDict()
+        else:
+            self._messages = deque()
+
+    @property
+    def droppedCount(self) -> int:
+        return self._droppedCount
+
+    @property
+    def replacedCount(self) -> int:
+        return self._replacedCount
+
+    @property
+    def maxSize(self) -> int:
+        return self._maxSize
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def put(self, topic: str, payload) -> None:
+        with self._condition:
+            if (self._overflowPolicy == "coalesce"):
+                if (topic in self._messages):
+                    self._replacedCount += 1
+                elif (len(self._messages) >= self._maxSize):
+                    self._messages.popitem(last=False)
+                    self._droppedCount += 1
+                self._messages[topic] = payload
+            else:
+                if (len(self._messages) >= self._maxSize):
+                    self._messages.popleft()
+                    self._droppedCount += 1
+                self._messages.append((topic, payload))
+            self._condition.notify()
+
+    def putBack(self, topic: str, payload) -> None:
+        """
+            Puts a message which could not be sent back at the head of the queue, unless it is full
+            (or, for coalesce, unless a newer payload for the same topic was queued in the meantime).
+        """
+        with self._condition:
+            if (len(self._messages) >= self._maxSize):
+                self._droppedCount += 1
+            elif (self._overflowPolicy == "coalesce"):
+                if (topic in self._messages):
+                    self._replacedCount += 1
+                else:
+                    self._messages[topic] = payload
+                    self._messages.move_to_end(topic, last=False)
+            else:
+                self._messages.appendleft((topic, payload))
+            self._condition.notify()
+
+    def get(self, timeout: float = None) -> tuple:
+        """
+            Returns the oldest (topic, payload) message, or None if there was none within timeout seconds
+        """
+        with self._condition:
+            if ((not self._messages) and (not self._condition.wait_for(lambda: len(self._messages) > 0, timeout))):
+                return None
+            if (self._overflowPolicy == "coalesce"):
+                return self._messages.popitem(last=False)
+            return self._messages.popleft()
+
@@ -2,29 +2,48 @@ from abc import abstractmethod
 from paho.mqtt import client as paho
 from jsonschema import validate as jsvalidate
 from datetime import datetime, timedelta
+from decimal import Decimal
+from threading import Thread, Event
 import json
 
-from .helper import LoggedClass
+from .helper import LoggedClass, P1ConfigurationError
 import logging
 import ssl
 import os
+import time
 
 from .sequence import P1Sequence
+from .outbound import P1OutboundQueue
+from .encoding import P1PayloadEncoder
+from .spool import P1Spool
+from .store import P1TimeSeriesStore
+from .live import P1LiveServer
+from .metrics import P1Metrics
 
 class P1Processor:
 
     """
         Interface for all P1 Port information processors
     """
+    # settings which a configuration reload changes without recreating the processor (see reconfigure)
+    RELOADABLE_SETTINGS = ("topics", )
 
-    def __init__(self, processorConfig: dict) -> None:
+    def __init__(self, processorConfig: dict, processorName: str = None) -> None:
         self._processorConfig = processorConfig
+        self._processorName = processorName if (processorName is not None) else self.getConfigurationName()
         self.__init__validateSchema()
+        self._valuesCounter = P1Metrics.counter("besm_processor_values_total", "Values sent to the processor", processor=self._processorName)
 
         if (len(self._processorConfig["topics"]) < 1):
-            raise P1ConfigurationError('Configuration error: ' + self.__class__.__name__ + ' has no topics defined') # type: ignore
+            raise P1ConfigurationError('Configuration error: ' + self.__class__.__name__ + ' has no topics defined')
 
     def __init__validateSchema(self) -> None:
+        self.validateConfiguration(self._processorConfig)
+
+    def validateConfiguration(self, processorConfig: dict) -> None:
+        """
+            Validates processorConfig against the schema of this type of processor
+        """
         schemaFileName = os.path.join(os.getcwd(), "schema", self.getConfigurationName() + '.processor.schema.json')
         jsonSchema = None
         
@@ -32,14 +51,48 @@ class P1Processor:
             schemaFile = open(schemaFileName)
             jsonSchema = json.load(schemaFile)
             schemaFile.close()
-            jsvalidate(self._processorConfig, jsonSchema)
+            jsvalidate(processorConfig, jsonSchema)
         else:
-            raise P1ConfigurationError('Configuration error: Could not find schema for processor: ' + self.getConfigurationName()) # type: ignore
-
-    def processSequence(self, p1Sequence: P1Sequence, applyTo: dict) -> None:
-        for obisCode in applyTo:
-            if ((p1Sequence.hasInformation(obisCode)) and (obisCode in self._processorConfig["topics"])):
-                self.processInformation(self._processorConfig["topics"][obisCode], p1Sequence.getInformationValue(obisCode), p1Sequence.getInformationUnit(obisCode))
+            raise P1ConfigurationError('Configuration error: Could not find schema for processor: ' + self.getConfigurationName())
+
+    @property
+    def topics(self) -> dict:
+        return self._processorConfig["topics"]
+
+    @topics.setter
+    def topics(self, topics: dict) -> None:
+        """
+            Changes the topics without recreating the processor (eg on a configuration reload)
+        """
+        self._processorConfig["topics"] = topics
+
+    def reconfigure(self, processorConfig: dict) -> None:
+        """
+            Applies the RELOADABLE_SETTINGS of processorConfig (already validated) to the running processor
+        """
+        for setting in self.RELOADABLE_SETTINGS:
+            if (setting in processorConfig):
+                self._processorConfig[setting] = processorConfig[setting]
+            else:
+                self._processorConfig.pop(setting, None)
+
+    @property
+    def processorName(self) -> str:
+        return self._processorName
+
+    def processSequence(self, p1Sequence: P1Sequence, plan: tuple, topicPrefix: str = "") -> None:
+        """
+            Processes the information of p1Sequence selected by plan, a list of (obisCode, code, index, topic)
+            tuples compiled by P1Configuration for the schedule which triggered the processor.
+            Topics of the plan already start with topicPrefix, the prefix of the meter which sent p1Sequence.
+        """
+        processedValues = 0
+        for obisCode, code, index, topic in plan:
+            p1Value = p1Sequence.getSelectedValue(code, index)
+            if (p1Value is not None):
+                self.processInformation(topic, p1Value.value, p1Value.unit)
+                processedValues += 1
+        self._valuesCounter.inc(processedValues)
 
     @abstractmethod
     def processInformation(self, processLabel: str, processValue: str, processUnit: str) -> None:
@@ -60,8 +113,8 @@ class PrintP1Processor (P1Processor):
         A P1 Port Information processor that prints data to stdout
     """
 
-    def __init__(self, processorConfig: dict) -> None:
-        super().__init__(processorConfig)
+    def __init__(self, processorConfig: dict, processorName: str = None) -> None:
+        super().__init__(processorConfig, processorName)
 
     def processInformation(self, processLabel: str, processValue: str, processUnit: str) -> None:
         print(processLabel + " = " + str(processValue) + " " + str(processUnit))
@@ -75,8 +128,8 @@ class PrintP1Processor (P1Processor):
 
 class LoggerP1Processor (P1Processor, LoggedClass):
 
-    def __init__(self, processorConfig: dict) -> None:
-        P1Processor.__init__(self, processorConfig)
+    def __init__(self, processorConfig: dict, processorName: str = None) -> None:
+        P1Processor.__init__(self, processorConfig, processorName)
         LoggedClass.__init__(self)
 
         if (not "logLevel" in processorConfig):
@@ -98,15 +151,33 @@ class MQTTP1Processor (P1Processor, LoggedClass):
 
     """
         A P1 Port Information processor that sends data to MQTT
+
+        In "sync" publish mode, messages are published from the processing thread and reconnection
+        is attempted from the processing thread when publishing fails.
+        In "async" publish mode, messages are put on a bounded outbound queue and published by a
+        dedicated thread while paho's network loop (loop_start) handles (re)connections in the background.
+
+        In "async" publish mode, a persistent spool can be configured: messages which cannot be sent
+        while disconnected are stored on disk and replayed in order, at a limited rate, after reconnection.
+
+        If "batch" is enabled, all the values selected by a schedule trigger are published as one
+        JSON or CBOR message on the batch topic instead of one message per topic.
     """
 
-    def __init__(self, processorConfig: dict) -> None:
-        P1Processor.__init__(self, processorConfig)
+    def __init__(self, processorConfig: dict, processorName: str = None) -> None:
+        P1Processor.__init__(self, processorConfig, processorName)
         LoggedClass.__init__(self)
 
         self.__already_connected_once = False
         self.__assume_connected = False
         self.__cooldown = None
+        self.__connectedEvent = Event()
+        self.__stopPublishingEvent = Event()
+        self.__publisherThread = None
+        self._outboundQueue = None
+        self._spool = None
+        self._publishCounter = P1Metrics.counter("besm_mqtt_publishes_total", "MQTT messages published", processor=self.processorName)
+        self._publishFailureCounter = P1Metrics.counter("besm_mqtt_publish_failures_total", "MQTT messages which could not be published", processor=self.processorName)
         pahoClientInit = dict()
 
         pahoClientInit["transport"] = "tcp"
@@ -169,7 +240,7 @@ class MQTTP1Processor (P1Processor, LoggedClass):
                     tlsConfig["certfile"] = os.path.abspath(os.path.join(os.getcwd(), 'config', self._processorConfig['tls']['certfile']))
                     tlsConfig["keyfile"] = os.path.abspath(os.path.join(os.getcwd(), 'config', self._processorConfig['tls']['keyfile']))
                 else:
-                    raise P1ConfigurationError("For TLS authentication, both 'certfile' and 'keyfile' must be provided") # type: ignore
+                    raise P1ConfigurationError("For TLS authentication, both 'certfile' and 'keyfile' must be provided")
 
             self._mqttClient.tls_set(**tlsConfig)
             
@@ -190,7 +261,7 @@ class MQTTP1Processor (P1Processor, LoggedClass):
         
         # catch potential mistake on password
         if ((not 'username' in self._processorConfig) and ('password' in self._processorConfig)):
-            raise P1ConfigurationError('Missing username: MQTT Processor cannot have a password without a username') # type: ignore
+            raise P1ConfigurationError('Missing username: MQTT Processor cannot have a password without a username')
 
         #
         # Port configuration
@@ -198,7 +269,154 @@ class MQTTP1Processor (P1Processor, LoggedClass):
         if (not 'port' in self._processorConfig):
             self._processorConfig['port'] = 1883
 
-        self.connectMQTT()
+        if (self.isAsynchronous):
+            self.__init__asynchronousPublishing()
+        elif ("spool" in self._processorConfig):
+            raise P1ConfigurationError('MQTT Processor can only use a spool with the async publishMode')
+        else:
+            self.connectMQTT()
+
+    def __init__asynchronousPublishing(self) -> None:
+        queueConfig = self._processorConfig.get("outboundQueue", dict())
+        self._outboundQueue = P1OutboundQueue(queueConfig.get("maxSize", 1000), queueConfig.get("overflowPolicy", "dropOldest"))
+        P1Metrics.gauge("besm_mqtt_outbound_queue_depth", "Messages waiting in the MQTT outbound queue", self._outboundQueue.__len__, processor=self.processorName)
+        P1Metrics.gauge("besm_mqtt_outbound_dropped", "Messages dropped by the MQTT outbound queue, by reason", lambda: self._outboundQueue.droppedCount,
+            processor=self.processorName, reason="overflow")
+        P1Metrics.gauge("besm_mqtt_outbound_dropped", "Messages dropped by the MQTT outbound queue, by reason", lambda: self._outboundQueue.replacedCount,
+            processor=self.processorName, reason="replaced")
+
+        if ("spool" in self._processorConfig):
+            spoolConfig = self._processorConfig["spool"]
+            self._spool = P1Spool(os.path.abspath(spoolConfig["path"]), int(spoolConfig.get("maxSizeMB", 64) * 1024 * 1024),
+                spoolConfig.get("syncBatchSize", 100), spoolConfig.get("syncInterval", 1.0))
+            if (self._spool.count > 0):
+                super().logger.info('MQTT spool contains %d messages to replay', self._spool.count)
+            P1Metrics.gauge("besm_mqtt_spool_messages", "Messages waiting in the MQTT spool", lambda: self._spool.count, processor=self.processorName)
+            P1Metrics.gauge("besm_mqtt_spool_evicted", "Messages evicted from the MQTT spool when it was full", lambda: self._spool.evictedCount, processor=self.processorName)
+
+        self._mqttClient.on_connect = self._onConnect
+        self._mqttClient.on_disconnect = self._onDisconnect
+        self._mqttClient.reconnect_delay_set(min_delay=1, max_delay=60)
+        self._mqttClient.connect_async(self._processorConfig['broker'], self._processorConfig['port'], 60)
+        self._mqttClient.loop_start()
+
+        self.__publisherThread = Thread(target=self._publishFromOutboundQueue, name="MQTTPublisher", daemon=True)
+        self.__publisherThread.start()
+
+    @property
+    def isAsynchronous(self) -> bool:
+        return (self._processorConfig.get("publishMode", "sync") == "async")
+
+    @property
+    def outboundQueue(self) -> P1OutboundQueue:
+        return self._outboundQueue
+
+    @property
+    def spool(self) -> P1Spool:
+        return self._spool
+
+    @property
+    def replayRate(self) -> float:
+        return self._processorConfig["spool"].get("replayRate", 50)
+
+    def _onConnect(self, client, userdata, flags, rc, properties=None) -> None:
+        if (rc == 0):
+            super().logger.info('MQTT connected')
+            self.__connectedEvent.set()
+        else:
+            super().logger.error('MQTT connection refused: %s', paho.connack_string(rc))
+
+    def _onDisconnect(self, client, userdata, rc, properties=None) -> None:
+        self.__connectedEvent.clear()
+        if (rc != 0):
+            super().logger.warning('MQTT connection lost (%s), %d messages queued', str(rc), len(self._outboundQueue))
+
+    def _publishFromOutboundQueue(self) -> None:
+        """
+            Publisher thread of the "async" publish mode: sends queued messages while connected.
+            Messages stay in the bounded outbound queue (where the overflow policy applies) while
+            disconnected or while paho still has data to write on a slow connection.
+            With a spool, messages are moved from the outbound queue to the spool while disconnected,
+            and as long as the spool is not empty so that they are replayed in order.
+        """
+        while (not self.__stopPublishingEvent.is_set()):
+            if (not self.__connectedEvent.is_set()):
+                if (self._spool is not None):
+                    self._spoolOutboundQueue(1)
+                else:
+                    self.__connectedEvent.wait(1)
+                continue
+
+            if ((self._spool is not None) and (self._spool.count > 0)):
+                self._spoolOutboundQueue()
+                self._replayFromSpool()
+                continue
+
+            message = self._outboundQueue.get(1)
+            if (message is None):
+                continue
+
+            topic, payload = message
+            try:
+                isPublished = (self._mqttClient.publish(topic=topic, payload=payload).rc == paho.MQTT_ERR_SUCCESS)
+            except Exception:
+                super().logger.exception('MQTT publish failed for %s', topic)
+                isPublished = False
+
+            if (not isPublished):
+                # kept for the next attempt, whatever the cause of the failure
+                self._publishFailureCounter.inc()
+                if (self._spool is not None):
+                    self._spool.append(topic, payload)
+                else:
+                    self._outboundQueue.putBack(topic, payload)
+                self.__stopPublishingEvent.wait(0.1)
+                continue
+
+            self._publishCounter.inc()
+            self._waitForPendingWrites()
+
+    def _waitForPendingWrites(self) -> None:
+        # do not stack messages in paho while the broker is slow: keep them in the bounded queue
+        while (self._mqttClient.want_write() and self.__connectedEvent.is_set() and not self.__stopPublishingEvent.is_set()):
+            self.__stopPublishingEvent.wait(0.01)
+
+    def _spoolOutboundQueue(self, timeout: float = 0) -> None:
+        message = self._outboundQueue.get(timeout)
+        while (message is not None):
+            self._spool.append(*message)
+            message = self._outboundQueue.get(0)
+        self._spool.flushIfDue()
+
+    def _replayFromSpool(self) -> None:
+        """
+            Publishes the oldest spooled messages, at most replayRate messages per second
+        """
+        replayRate = self.replayRate
+        messages = self._spool.peek(max(1, int(replayRate / 10)))
+        startTime = time.monotonic()
+
+        sentMessages = list()
+        for message in messages:
+            if (self.__stopPublishingEvent.is_set() or not self.__connectedEvent.is_set()):
+                break
+            publishResult = self._mqttClient.publish(topic=message[1], payload=message[2])
+            if (publishResult.rc != paho.MQTT_ERR_SUCCESS):
+                self._publishFailureCounter.inc()
+                break
+            self._publishCounter.inc()
+            sentMessages.append(message)
+            self._waitForPendingWrites()
+
+        self._spool.remove(sentMessages)
+        if (self._spool.count == 0):
+            super().logger.info('MQTT spool replayed')
+
+        waitTime = (len(sentMessages) / replayRate) - (time.monotonic() - startTime)
+        if (len(sentMessages) < len(messages)):
+            waitTime = max(waitTime, 0.1)
+        if (waitTime > 0):
+            self.__stopPublishingEvent.wait(waitTime)
 
     def connectMQTT(self) -> None:
         try:
@@ -216,32 +434,170 @@ class MQTTP1Processor (P1Processor, LoggedClass):
             super().logger.error('MQTT (re)connect failed. Cooling down for 2 seconds.')
             self.__cooldown = datetime.now() + timedelta(seconds = 2)
 
+    @property
+    def isBatchEnabled(self) -> bool:
+        return (("batch" in self._processorConfig) and self._processorConfig["batch"]["enabled"])
+
+    def processSequence(self, p1Sequence: P1Sequence, plan: tuple, topicPrefix: str = "") -> None:
+        if (not self.isBatchEnabled):
+            super().processSequence(p1Sequence, plan, topicPrefix)
+            return
+
+        selectedValues = list()
+        for obisCode, code, index, topic in plan:
+            p1Value = p1Sequence.getSelectedValue(code, index)
+            if (p1Value is not None):
+                selectedValues.append((topic, obisCode, p1Value.value, p1Value.unit))
+
+        self._valuesCounter.inc(len(selectedValues))
+        if (selectedValues):
+            batchConfig = self._processorConfig["batch"]
+            batch = P1PayloadEncoder.toBatch(p1Sequence.messageTimeinSystemTimezone, selectedValues)
+            self.publishPayload(topicPrefix + batchConfig["topic"], P1PayloadEncoder.encode(batchConfig.get("format", "json"), batch))
+
     def processInformation(self, processLabel: str, processValue: str, processUnit: str) -> None:
+        self.publishPayload(processLabel, str(processValue))
+
+    def publishPayload(self, topic: str, payload) -> None:
+        if (self._outboundQueue is not None):
+            self._outboundQueue.put(topic, payload)
+            return
+
         try:
             if (not self.__assume_connected):
                 self.connectMQTT()
-            self._mqttClient.publish(topic=processLabel, payload=str(processValue))
+            publishResult = self._mqttClient.publish(topic=topic, payload=payload)
+            if (publishResult.rc == paho.MQTT_ERR_SUCCESS):
+                self._publishCounter.inc()
+            else:
+                self._publishFailureCounter.inc()
         except:
-            super().logger.error('MQTT publish failed for %s %s', str(processValue), str(processUnit))
+            self._publishFailureCounter.inc()
+            super().logger.error('MQTT publish failed for %s', topic)
             super().logger.info('MQTT will try to reconnect on next schedule')
             self.__assume_connected = False
 
     def closeProcessor(self) -> None:
+        if (self.__publisherThread is not None):
+            self.__stopPublishingEvent.set()
+            self.__publisherThread.join()
+            if (self._spool is not None):
+                self._spoolOutboundQueue()
+                self._spool.close()
+                if (self._spool.count > 0):
+                    super().logger.info('MQTT closing with %d messages in spool', self._spool.count)
+            elif (len(self._outboundQueue) > 0):
+                super().logger.warning('MQTT closing with %d unsent messages', len(self._outboundQueue))
+
         try:
             self._mqttClient.disconnect()
         except:
             super().logger.error('MQTT disconnect failed')
+
+        if (self.__publisherThread is not None):
+            self._mqttClient.loop_stop()
     
     @staticmethod
     def getConfigurationName() -> str:
         return "mqtt"
 
+class StoreP1Processor (P1Processor, LoggedClass):
+
+    """
+        A P1 Port Information processor that stores numeric values in an embedded time-series store (sqlite),
+        with 1 minute, 15 minutes and 1 hour rollups. Each topic is a series, values are stored at the time
+        of the telegram. Dates and texts are not stored.
+    """
+
+    def __init__(self, processorConfig: dict, processorName: str = None) -> None:
+        P1Processor.__init__(self, processorConfig, processorName)
+        LoggedClass.__init__(self)
+
+        retention = {resolutionName: days if (days != 0) else None for resolutionName, days in processorConfig.get("retention", dict()).items()}
+        self._store = P1TimeSeriesStore(processorConfig["path"], retention, processorConfig.get("syncBatchSize", 500), processorConfig.get("syncInterval", 10))
+        super().logger.info('Storing values in %s', processorConfig["path"])
+
+    @property
+    def store(self) -> P1TimeSeriesStore:
+        return self._store
+
+    def processSequence(self, p1Sequence: P1Sequence, plan: tuple, topicPrefix: str = "") -> None:
+        timestamp = p1Sequence.messageTimeinSystemTimezone.timestamp()
+        processedValues = 0
+        for obisCode, code, index, topic in plan:
+            p1Value = p1Sequence.getSelectedValue(code, index)
+            if ((p1Value is not None) and (type(p1Value.value) is Decimal)):
+                self._store.append(topic, timestamp, float(p1Value.value), p1Value.unit)
+                processedValues += 1
+        self._valuesCounter.inc(processedValues)
+        self._store.flushIfDue()
+
+    def processInformation(self, processLabel: str, processValue: str, processUnit: str) -> None:
+        # values without telegram are stored at the current time
+        if (type(processValue) is Decimal):
+            self._store.append(processLabel, time.time(), float(processValue), processUnit)
+
+    def closeProcessor(self) -> None:
+        self._store.close()
+
+    @staticmethod
+    def getConfigurationName() -> str:
+        return "store"
+
+class LiveP1Processor (P1Processor, LoggedClass):
+
+    """
+        A P1 Port Information processor that serves the values on a local HTTP server: the latest values
+        (snapshot) and a live stream (Server-Sent Events or WebSocket) to many clients at once.
+        All the values selected by a schedule trigger are sent as one message, in the JSON batch format.
+        A configuration reload keeps the server (and its clients) unless its host or port changed.
+    """
+    RELOADABLE_SETTINGS = ("topics", "maxClients", "clientBufferSize", "heartbeatInterval", "allowOrigin")
+
+    def __init__(self, processorConfig: dict, processorName: str = None) -> None:
+        P1Processor.__init__(self, processorConfig, processorName)
+        LoggedClass.__init__(self)
+
+        self._liveServer = P1LiveServer(processorConfig.get("host", "127.0.0.1"), processorConfig.get("port", 8081), processorConfig.get("maxClients", 500),
+            processorConfig.get("clientBufferSize", 16), processorConfig.get("heartbeatInterval", 15), processorConfig.get("allowOrigin"), self.processorName)
+
+    def reconfigure(self, processorConfig: dict) -> None:
+        super().reconfigure(processorConfig)
+        self._liveServer.reconfigure(processorConfig.get("maxClients", 500), processorConfig.get("clientBufferSize", 16),
+            processorConfig.get("heartbeatInterval", 15), processorConfig.get("allowOrigin"))
+
+    @property
+    def liveServer(self) -> P1LiveServer:
+        return self._liveServer
+
+    def processSequence(self, p1Sequence: P1Sequence, plan: tuple, topicPrefix: str = "") -> None:
+        selectedValues = list()
+        for obisCode, code, index, topic in plan:
+            p1Value = p1Sequence.getSelectedValue(code, index)
+            if (p1Value is not None):
+                selectedValues.append((topic, obisCode, p1Value.value, p1Value.unit))
+
+        self._valuesCounter.inc(len(selectedValues))
+        if (selectedValues):
+            self._liveServer.publish(p1Sequence.messageTimeinSystemTimezone, selectedValues)
+
+    def processInformation(self, processLabel: str, processValue: str, processUnit: str) -> None:
+        # values without telegram are sent at the current time
+        self._liveServer.publish(datetime.now().astimezone(), [(processLabel, None, processValue, processUnit)])
+
+    def closeProcessor(self) -> None:
+        self._liveServer.close()
+
+    @staticmethod
+    def getConfigurationName() -> str:
+        return "live"
+
 class P1ProcessorFactory:
 
     """
         A factory for creating P1 processors from a configuration.
     """
-    _processorClassList = [MQTTP1Processor, PrintP1Processor, LoggerP1Processor]
+    _processorClassList = [MQTTP1Processor, PrintP1Processor, LoggerP1Processor, StoreP1Processor, LiveP1Processor]
     _procesorDictionary = None
 
     @classmethod
@@ -254,9 +610,9 @@ class P1ProcessorFactory:
         return cls._procesorDictionary
 
     @classmethod
-    def createProcessor(cls, processorConfig: dict) -> None:
+    def createProcessor(cls, processorConfig: dict, processorName: str = None) -> None:
         thisMap = cls.getProcessorDictionary()
         if (processorConfig["type"] in thisMap):
-            return thisMap[processorConfig["type"]](processorConfig)
+            return thisMap[processorConfig["type"]](processorConfig, processorName)
         
-        raise P1ConfigurationError('Configuration error: Processor type does not exist: ' + processorConfig["type"]) # type: ignore
\ No newline at end of file
+        raise P1ConfigurationError('Configuration error: Processor type does not exist: ' + processorConfig["type"])
\ No newline at end of file
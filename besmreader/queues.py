@@ -0,0 +1,109 @@
+from collections import deque, OrderedDict
+from queue import Queue, Full
+
+from .metrics import P1Metrics
+
+class P1PipelineQueue (Queue):
+
+    """
+        A bounded queue between two threads of the pipeline (eg reader -> parser), so that memory does not
+        grow without limit when a stage stalls (eg blocking MQTT publish). It behaves as a queue.Queue for
+        the consumer. When the queue is full, the overflow policy decides what happens to put():
+            * block: the producer waits up to blockTimeout seconds for room (backpressure), then the new
+            item is dropped so that the producer can check its stop event
+            * dropOldest: the oldest item is dropped to make room for the new one
+            * conflate: only the latest item of each key (by default the meter, first element of the
+            (meter, ...) tuples of the pipeline) is kept, in the order keys were first queued, so that a
+            late consumer only processes the newest telegram of each meter. If the queue is full of
+            distinct keys, the oldest key is dropped.
+        Items are counted in the besm_queue_dropped_total{queue, reason} metric, as in P1OutboundQueue:
+            * overflow (droppedCount): items lost because the queue was full
+            * replaced (replacedCount): conflated items, replaced by a newer item of the same key
+    """
+
+    OVERFLOW_POLICIES = ("block", "dropOldest", "conflate")
+
+    def __init__(self, name: str, maxSize: int = 1000, overflowPolicy: str = "block", blockTimeout: float = 1.0, conflateKey=None) -> None:
+        if (overflowPolicy not in P1PipelineQueue.OVERFLOW_POLICIES):
+            raise ValueError("Unknown overflow policy: " + overflowPolicy)
+        self._name = name
+        self._maxSize = maxSize
+        self._overflowPolicy = overflowPolicy
+        self._blockTimeout = blockTimeout
+        self._conflateKey = conflateKey if (conflateKey is not None) else (lambda item: item[0])
+        self._droppedCount = 0
+        self._replacedCount = 0
+        self._droppedCounter = P1Metrics.counter("besm_queue_dropped_total", "Items dropped by the inter-thread queues, by reason", queue=name, reason="overflow")
+        self._replacedCounter = P1Metrics.counter("besm_queue_dropped_total", "Items dropped by the inter-thread queues, by reason", queue=name, reason="replaced")
+        # only the block policy relies on the bound of queue.Queue, other policies never block the producer
+        Queue.__init__(self, maxSize if (overflowPolicy == "block") else 0)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def maxSize(self) -> int:
+        return self._maxSize
+
+    @property
+    def overflowPolicy(self) -> str:
+        return self._overflowPolicy
+
+    @property
+    def droppedCount(self) -> int:
+        return self._droppedCount
+
+    @property
+    def replacedCount(self) -> int:
+        return self._replacedCount
+
+    def put(self, item, block: bool = True, timeout: float = None) -> None:
+        if (self._overflowPolicy != "block"):
+            Queue.put(self, item, False)
+            return
+        try:
+            Queue.put(self, item, block, self._blockTimeout if (timeout is None) else timeout)
+        except Full:
+            with self.mutex:
+                self.__countDropped()
+
+    def __countDropped(self) -> None:
+        # always called with self.mutex held: the counter is safe even with several producers
+        self._droppedCount += 1
+        self._droppedCounter.inc()
+
+    def __countReplaced(self) -> None:
+        self._replacedCount += 1
+        self._replacedCounter.inc()
+
+    # queue.Queue storage, called with self.mutex held
+
+    def _init(self, maxsize: int) -> None:
+        if (self._overflowPolicy == "conflate"):
+            self.queue = OrderedDict()
+        else:
+            self.queue = deque()
+
+    def _qsize(self) -> int:
+        return len(self.queue)
+
+    def _put(self, item) -> None:
+        if (self._overflowPolicy == "conflate"):
+            key = self._conflateKey(item)
+            if (key in self.queue):
+                self.__countReplaced()
+            elif (len(self.queue) >= self._maxSize):
+                self.queue.popitem(last=False)
+                self.__countDropped()
+            self.queue[key] = item
+        else:
+            if ((self._overflowPolicy == "dropOldest") and (len(self.queue) >= self._maxSize)):
+                self.queue.popleft()
+                self.__countDropped()
+            self.queue.append(item)
+
+    def _get(self):
+        if (self._overflowPolicy == "conflate"):
+            return self.queue.popitem(last=False)[1]
+        return self.queue.popleft()
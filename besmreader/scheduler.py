@@ -1,59 +1,191 @@
-from statistics import mean
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
 from collections import deque
+from croniter import croniter
+import heapq
+import logging
 
 from .sequence import P1Sequence
 
 
 class P1Scheduler:
 
-    def __init__(self, config):
-        self.__schedules = config.scheduling
+    """
+        Triggers the schedules of one meter: aggregates values between triggers and sends the
+        values selected by a schedule to its processor when it is triggered.
+
+        Schedules are kept in a heap ordered by next trigger time, so that only the schedules which
+        are triggered are visited for a telegram. Values of aggregation schedules are accumulated in a
+        single pass over the OBIS codes used by all these schedules.
+
+        If several triggers of a schedule were missed (eg no telegram during a serial port outage),
+        the schedule is triggered once and the missed triggers are skipped.
+
+        In "deadband" mode, a value is only sent if it moved away from the last value sent for its OBIS code
+        by more than a threshold, or if it was not sent for maxSilence seconds (heartbeat). Only the last
+        value sent for each OBIS code is kept, in schedule["_lastPublished"].
+
+        If the meter has a P1CapacityTracker, its virtual OBIS codes are set after the transformations,
+        before any value is aggregated or sent.
+    """
+    logger = logging.getLogger("besm.P1Scheduler")
+
+    def __init__(self, config, schedules: list, capacityTracker=None):
+        self.__schedules = schedules
         self.__config = config
+        self.__capacityTracker = capacityTracker
+        self.__triggerHeap = [(schedule["cron_next_trigger"], scheduleIndex) for scheduleIndex, schedule in enumerate(schedules)]
+        heapq.heapify(self.__triggerHeap)
+        self.__accumulations = P1Scheduler.__compileAccumulations(schedules)
+
+    @staticmethod
+    def __compileAccumulations(schedules: list) -> tuple:
+        """
+            Groups the aggregators of all schedules by OBIS code so that each value is read once per telegram.
+            Returns a tuple of (code, index, ((scheduleIndex, aggregator), ...)).
+        """
+        accumulations = dict()
+        for scheduleIndex, schedule in enumerate(schedules):
+            if ("aggregators" in schedule):
+                for obisId, code, index in schedule["selectors"]:
+                    accumulations.setdefault((code, index), list()).append((scheduleIndex, schedule["aggregators"][obisId]))
+
+        return tuple((code, index, tuple(aggregators)) for (code, index), aggregators in accumulations.items())
+
+    @staticmethod
+    def compileDeadbands(schedule: dict) -> dict:
+        """
+            Returns the (absolute threshold, relative threshold, maxSilence timedelta or None) of each OBIS
+            code of a "deadband" schedule, from its "deadband" configuration and its per-code overrides
+        """
+        deadbandConfig = schedule.get("deadband", dict())
+        deadbands = dict()
+        for obisId in schedule["applyTo"]:
+            codeConfig = dict(deadbandConfig)
+            codeConfig.update(deadbandConfig.get("codes", dict()).get(obisId, dict()))
+            maxSilence = codeConfig.get("maxSilence")
+            deadbands[obisId] = (Decimal(str(codeConfig.get("absolute", 0))), Decimal(str(codeConfig.get("percent", 0))) / 100,
+                timedelta(seconds=maxSilence) if (maxSilence is not None) else None)
+        return deadbands
+
+    @property
+    def schedules(self) -> list:
+        return self.__schedules
+
+    @property
+    def capacityTracker(self):
+        return self.__capacityTracker
 
     def processP1(self, p1Sequence: P1Sequence) -> None:
         if (not p1Sequence.hasTimeinSystemTimezone):
             return
-        
-        p1Sequence.applyTransformations()
 
-        for schedule in self.__schedules:
-            if ((p1Sequence.hasTimeinSystemTimezone) and (p1Sequence.messageTimeinSystemTimezone >= schedule["cron_next_trigger"])):
-                self.processor = self.__config.getProcessor(schedule["processor"])
+        p1Sequence.applyTransformations(self.__config.p1Transformations)
+        if (self.__capacityTracker is not None):
+            self.__capacityTracker.processP1(p1Sequence)
+        messageTime = p1Sequence.messageTimeinSystemTimezone
+
+        triggerHeap = self.__triggerHeap
+        triggeredIndexes = list()
+        while (triggerHeap and (triggerHeap[0][0] <= messageTime)):
+            triggeredIndexes.append(heapq.heappop(triggerHeap)[1])
 
-                self._doAddAveragesOnChronTrigger(schedule, p1Sequence)
-                applyToSchedule = self._doFilterApplyToScheduleOnChronTrigger(schedule, p1Sequence)
+        self._doAggregateChronNotTime(p1Sequence, frozenset(triggeredIndexes))
 
-                self.processor.processSequence(p1Sequence, applyToSchedule)
-                schedule["cron_next_trigger"] = schedule["cron"].get_next(datetime)
-            else:
-                self._doAverageChronNotTime(schedule, p1Sequence)
+        # triggered schedules are processed in the configuration order
+        triggeredIndexes.sort()
+        for scheduleIndex in triggeredIndexes:
+            schedule = self.__schedules[scheduleIndex]
+            self._doAddAggregatesOnChronTrigger(schedule, p1Sequence)
+            plan = self._doFilterApplyToScheduleOnChronTrigger(schedule, p1Sequence)
 
-    def _doAddAveragesOnChronTrigger(self, schedule: dict, p1Sequence: P1Sequence) -> None:
-        if (schedule["mode"] == "average"):
-            for obisId in schedule["applyTo"]:
-                if (len(schedule["history"][obisId])>0):
-                    p1Sequence.addInformation(obisId, round(mean(schedule["history"][obisId]),3), p1Sequence.getInformationUnit(obisId))
-                schedule["history"][obisId].clear()
+            schedule["processorInstance"].processSequence(p1Sequence, plan, schedule["topicPrefix"])
+            heapq.heappush(triggerHeap, (self._doAdvanceChron(schedule, messageTime), scheduleIndex))
 
-    def _doFilterApplyToScheduleOnChronTrigger(self, schedule: dict, p1Sequence: P1Sequence) -> list:
-        applyToSchedule = schedule["applyTo"]
+    def _doAdvanceChron(self, schedule: dict, messageTime: datetime) -> datetime:
+        nextTrigger = schedule["cron"].get_next(datetime)
+        if (nextTrigger <= messageTime):
+            # catch-up: restart the cron from the message time instead of triggering once per missed tick
+            P1Scheduler.logger.debug('Skipping missed triggers of schedule "%s" until %s', schedule["cronFormat"], str(messageTime))
+            schedule["cron"] = croniter(schedule["cronFormat"], messageTime)
+            nextTrigger = schedule["cron"].get_next(datetime)
+
+        schedule["cron_next_trigger"] = nextTrigger
+        return nextTrigger
+
+    def _doAddAggregatesOnChronTrigger(self, schedule: dict, p1Sequence: P1Sequence) -> None:
+        if ("aggregators" in schedule):
+            triggerTime = p1Sequence.messageTimeinSystemTimezone
+            for obisId, code, index in schedule["selectors"]:
+                aggregator = schedule["aggregators"][obisId]
+                if (aggregator.count > 0):
+                    p1Value = p1Sequence.getSelectedValue(code, index)
+                    p1Sequence.setSelectedValue(code, index, round(aggregator.result(triggerTime),3), p1Value.unit if (p1Value is not None) else None)
+                aggregator.reset(triggerTime)
+
+    def _doFilterApplyToScheduleOnChronTrigger(self, schedule: dict, p1Sequence: P1Sequence) -> tuple:
+        plan = schedule["plan"]
 
         if (schedule["mode"] == "changed"):
             formerSequence = schedule.get("_previousSequence")
             if (not formerSequence is None):
-                actualApplyTo = deque()
-                for obisCode in applyToSchedule:
-                    if (p1Sequence.getInformationValue(obisCode) != schedule["_previousSequence"].getInformationValue(obisCode)):
-                        actualApplyTo.append(obisCode)
-                applyToSchedule = list(actualApplyTo)
-            
+                actualPlan = deque()
+                for selector in plan:
+                    if (self.__getSelectedValueOrZero(p1Sequence, selector) != self.__getSelectedValueOrZero(formerSequence, selector)):
+                        actualPlan.append(selector)
+                plan = tuple(actualPlan)
+
             schedule["_previousSequence"] = p1Sequence
-        
-        return applyToSchedule
-
-    def _doAverageChronNotTime(self, schedule: dict, p1Sequence: P1Sequence) -> None:
-        if (schedule["mode"] == "average"):
-            for obisId in schedule["applyTo"]:
-                if (p1Sequence.hasInformation(obisId)):
-                    schedule["history"][obisId].append(p1Sequence.getInformationValue(obisId))
\ No newline at end of file
+
+        elif (schedule["mode"] == "deadband"):
+            plan = self.__filterDeadband(schedule, p1Sequence, plan)
+
+        return plan
+
+    @staticmethod
+    def __filterDeadband(schedule: dict, p1Sequence: P1Sequence, plan: tuple) -> tuple:
+        messageTime = p1Sequence.messageTimeinSystemTimezone
+        deadbands = schedule["deadbands"]
+        lastPublished = schedule["_lastPublished"]
+        actualPlan = list()
+        for selector in plan:
+            p1Value = p1Sequence.getSelectedValue(selector[1], selector[2])
+            if (p1Value is None):
+                continue
+
+            value = p1Value.value
+            published = lastPublished.get(selector[0])
+            if (published is not None):
+                publishedValue, publishedTime = published
+                absoluteThreshold, relativeThreshold, maxSilence = deadbands[selector[0]]
+                if ((maxSilence is None) or (messageTime - publishedTime < maxSilence)):
+                    if ((type(value) is Decimal) and (type(publishedValue) is Decimal)):
+                        # the threshold is the largest of the absolute and relative ones
+                        if (abs(value - publishedValue) <= max(absoluteThreshold, relativeThreshold * abs(publishedValue))):
+                            continue
+                    elif (value == publishedValue):
+                        # dates and texts are sent when they change
+                        continue
+
+            lastPublished[selector[0]] = (value, messageTime)
+            actualPlan.append(selector)
+        return tuple(actualPlan)
+
+    def _doAggregateChronNotTime(self, p1Sequence: P1Sequence, triggeredIndexes: frozenset) -> None:
+        """
+            Adds the values of p1Sequence to the aggregators of all the schedules which are not triggered (triggeredIndexes)
+        """
+        messageTime = p1Sequence.messageTimeinSystemTimezone
+        for code, index, aggregators in self.__accumulations:
+            p1Value = p1Sequence.getSelectedValue(code, index)
+            # only numeric values can be aggregated (eg not the date of 1-0:1.6.0/0)
+            if ((p1Value is not None) and (type(p1Value.value) is Decimal)):
+                for scheduleIndex, aggregator in aggregators:
+                    if (not scheduleIndex in triggeredIndexes):
+                        aggregator.add(p1Value.value, messageTime)
+
+    @staticmethod
+    def __getSelectedValueOrZero(p1Sequence: P1Sequence, selector: tuple):
+        # same semantics as getInformationValue: missing information is 0
+        p1Value = p1Sequence.getSelectedValue(selector[1], selector[2])
+        return p1Value.value if (p1Value is not None) else 0
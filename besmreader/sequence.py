@@ -1,32 +1,71 @@
-from pytz import timezone
-from tzlocal import get_localzone
-
-from collections import deque
 from datetime import datetime
 from decimal import Decimal
-import re
+from sys import intern
+import logging
+
+from .tokenizer import OBISLineTokenizer
+from .timestamps import P1TimestampDecoder
+from .metrics import P1Metrics
+
+_searchDecimal = OBISLineTokenizer.REGEXP_OBIS_VALUE_DECIMAL.search
+_ZERO = Decimal(0)
+
+class P1Value:
+
+    """
+        One value of an OBIS information with its (optional) unit.
+        P1Value objects are shared between sequences and must not be modified.
+    """
+    __slots__ = ("value", "unit")
+
+    def __init__(self, value, unit: str = None) -> None:
+        self.value = value
+        self.unit = unit
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, P1Value) and (self.value == other.value) and (self.unit == other.unit)
+
+    def __hash__(self) -> int:
+        return hash((self.value, self.unit))
+
+    def __repr__(self) -> str:
+        return f"P1Value({self.value!r}, {self.unit!r})"
 
 class P1Sequence:
     
     """
         A P1Sequence is a set of OBIS-format information starting with a \FLU sequence
         and ending with a !ABCD hash.
+
+        Informations are stored as {OBIS code: (P1Value, ...)} with interned OBIS codes and units.
+        Decimal values read from the P1 Port are cached by their raw text, so that values which do not
+        change from one telegram to the next (indexes, zero power...) are shared between sequences.
+        Timestamps are decoded by the P1TimestampDecoder of the meter (or a decoder shared by all sequences).
+
+        If the configuration provides a set of needed OBIS codes, datalines of other OBIS codes are
+        skipped without being parsed.
     """
+    __slots__ = ("_packetHeader", "_packetSignature", "_informations", "_systemTimeZoneMessageTime", "_timestampDecoder", "_neededCodes", "_receivedTime")
+
     OBIS_PACKET_DATE = r'0-0:1.0.0'
-    REGEXP_OBIS_CODE_AND_VALUES = r'((\d+-\d+:\d+\.\d+\.\d+(\.\d+)?(\*\d+)?)(\([\w ,.!?/*-+=:]*\))+)'
-    REGEXP_OBIS_VALUE_DATE = r'(\d+)([SW])'
-    REGEXP_OBIS_VALUE_DECIMAL = r'((\d+(\.\d+)?)(\*(\w+))*)$'
-    REGEXP_OBIS_VALUE_TEXT = r'([\w ,.!?/*-+=:]*)'
-    REGEXP_OBIS_VALUE_CODE = r'(\d+-\d+:\d+\.\d+\.\d+(\.\d+)?(\*\d+)?)'
+    DECIMAL_VALUE_CACHE_SIZE = 4096
+    logger = logging.getLogger("besm.P1Sequence")
+    parseErrorCounter = P1Metrics.counter("besm_parse_errors_total", "OBIS datalines which could not be parsed")
 
-    def __init__(self, header: str, configuration):
+    _decimalValueCache = dict()
+
+    def __init__(self, header: str, configuration, timestampDecoder: P1TimestampDecoder = None):
         self._packetHeader = header
         self._packetSignature = None
         self._informations = dict()
         self._systemTimeZoneMessageTime = None
-        self._smartMeterTimezone = configuration.smartMeterTimeZone
-        self._systemTimeZone = get_localzone()
-        self._config = configuration
+        self._timestampDecoder = timestampDecoder if (timestampDecoder is not None) else P1TimestampDecoder.forTimeZone(configuration.smartMeterTimeZone)
+        self._neededCodes = configuration.neededOBISCodes
+        self._receivedTime = None
+
+    @staticmethod
+    def getSystemTimeZone():
+        return P1TimestampDecoder.getSystemTimeZone()
 
     @property
     def messageTimeinSystemTimezone(self) -> datetime:
@@ -34,7 +73,18 @@ class P1Sequence:
     
     @property
     def hasTimeinSystemTimezone(self) -> bool:
-        return (self.__setMessageTimeInSystemTimezone is not None)
+        return (self._systemTimeZoneMessageTime is not None)
+
+    @property
+    def receivedTime(self) -> float:
+        """
+            time.perf_counter() when the first data of the telegram was read, None if unknown
+        """
+        return self._receivedTime
+
+    @receivedTime.setter
+    def receivedTime(self, receivedTime: float):
+        self._receivedTime = receivedTime
 
     @property
     def packetSignature(self) -> str:
@@ -55,143 +105,159 @@ class P1Sequence:
     #
     # returns a list of (OBISCode, multiValueIndex)
     #
-    def _splitInformationOBISCode(self, obisCode: str) -> tuple[str, int]:
+    @staticmethod
+    def splitOBISCode(obisCode: str) -> tuple[str, int]:
         foundLabels = obisCode.split('/')
         if (foundLabels):
             if (len(foundLabels) < 2):
                 foundLabels.append("0")
-            return foundLabels[0], int(foundLabels[1])
+            return intern(foundLabels[0]), int(foundLabels[1])
         else:
             return None, None
 
-    def hasInformation(self, obisCode: str):
+    @staticmethod
+    def compileSelector(obisCode: str) -> tuple[str, str, int]:
+        """
+            Resolves an OBIS code in the slightly modified format (eg "1-0:1.6.0/1") once
+            into a (obisCode, code, index) selector for getSelectedValue
+        """
+        label, subItem = P1Sequence.splitOBISCode(obisCode)
+        return obisCode, label, subItem
+
+    def _splitInformationOBISCode(self, obisCode: str) -> tuple[str, int]:
+        return P1Sequence.splitOBISCode(obisCode)
+
+    def getSelectedValue(self, code: str, index: int) -> P1Value:
+        """
+            Fast accessor for selectors compiled with compileSelector: no string parsing.
+            Returns None if the information was not received.
+        """
+        values = self._informations.get(code)
+        if ((values is not None) and (len(values) > index)):
+            return values[index]
+        return None
+
+    def setSelectedValue(self, code: str, index: int, value, unit: str = None) -> None:
+        """
+            Replaces the value at the index of a multi-value information (or adds the information).
+            Missing values before the index are stored as None and considered as not received.
+        """
+        p1Value = P1Value(Decimal(value), intern(unit) if (unit is not None) else None)
+        values = self._informations.get(code, ())
+        if (len(values) <= index):
+            values = values + (None, ) * (index + 1 - len(values))
+        self._informations[intern(code)] = values[:index] + (p1Value, ) + values[index + 1:]
+
+    def setInformationValues(self, code: str, p1Values: tuple) -> None:
+        """
+            Replaces all the values of an information (or adds the information), without any conversion
+        """
+        self._informations[intern(code)] = p1Values
+
+    def _getValue(self, obisCode: str) -> P1Value:
         label, subItem = self._splitInformationOBISCode(obisCode)
-        return (label in self._informations) and (len(self._informations[label]) > subItem)
+        return self.getSelectedValue(label, subItem)
+
+    def hasInformation(self, obisCode: str):
+        return (self._getValue(obisCode) is not None)
 
     def getInformationValue(self, obisCode: str):
-        label, subItem = self._splitInformationOBISCode(obisCode)
-        if(label in self._informations):
-            if (len(self._informations[label]) > subItem):
-                return self._informations[label][subItem]["value"]
+        p1Value = self._getValue(obisCode)
+        if (p1Value is not None):
+            return p1Value.value
 
         return 0
 
     def getInformationUnit(self, obisCode: str):
-        label, subItem = self._splitInformationOBISCode(obisCode)
-        if(label in self._informations):
-            if (len(self._informations[label]) > subItem):
-                if ("unit" in self._informations[label][subItem]):
-                    return self._informations[label][subItem]["unit"]
+        p1Value = self._getValue(obisCode)
+        if (p1Value is not None):
+            return p1Value.unit
 
         return None
     
     def getInformationType(self, obisCode: str):
-        label, subItem = self._splitInformationOBISCode(obisCode)
-        if(label in self._informations):
-            if (len(self._informations[label]) > subItem):
-                if ("unit" in self._informations[label][subItem]):
-                    return type(self._informations[label][subItem]["value"])
+        # as before the slotted records: only values with a unit have a type
+        p1Value = self._getValue(obisCode)
+        if ((p1Value is not None) and (p1Value.unit is not None)):
+            return type(p1Value.value)
         
         return None
 
     def addInformationFromDataLine(self, dataLine: str):
-        if (self.__keepAcceptingInformation()):
-            foundOBISInfo = re.findall(P1Sequence.REGEXP_OBIS_CODE_AND_VALUES, dataLine)
-
-            if (foundOBISInfo):
-                # Remove parenthesis before and after values
-                obisData = foundOBISInfo[0][0].split("(")
-                i = 0
-                while i < len(obisData):
-                    obisData[i] = obisData[i].replace(")", "")
-                    i += 1
-                
-                obisIdentifier = obisData[0]
+        # no information is accepted after the signature (checked inline: this runs for every line of every telegram)
+        if (self._packetSignature is None):
+            # cheap check on the OBIS code at the beginning of the line before any regular expression
+            neededCodes = self._neededCodes
+            if ((neededCodes is not None) and (dataLine.partition('(')[0] not in neededCodes)):
+                return
+
+            obisIdentifier, rawValues = OBISLineTokenizer.splitLine(dataLine)
+
+            if (obisIdentifier is not None):
                 # OBIS Code is 0, the rest are values
                 if (obisIdentifier == P1Sequence.OBIS_PACKET_DATE):
-                    obisIsDate = re.findall(P1Sequence.REGEXP_OBIS_VALUE_DATE, obisData[1])
-                    if (obisIsDate):
-                        self.__setMessageTimeInSystemTimezone(obisIsDate[0][0], obisIsDate[0][1])
+                    dateTxt, tzTxt = OBISLineTokenizer.matchTimestamp(rawValues[0])
+                    if (dateTxt is not None):
+                        self._systemTimeZoneMessageTime = self._timestampDecoder.decodeClock(dateTxt, tzTxt)
                 else:
                     try:
-                        obisContents = deque()
-                        for obisValue in obisData[1:]:
-                            obisIsValueDecimal = re.findall(P1Sequence.REGEXP_OBIS_VALUE_DECIMAL, obisValue)
-                            if (obisIsValueDecimal):
-                                theValue = Decimal(obisIsValueDecimal[0][1])
-                                theUnit = obisIsValueDecimal[0][4]
-                                theData = {
-                                    "value": theValue
-                                }
-                                if (theUnit != ''):
-                                    theData["unit"] = theUnit
-                                obisContents.append(theData)
-                                pass
-                            else:
-                                obisIsValueDate = re.findall(P1Sequence.REGEXP_OBIS_VALUE_DATE, obisValue)
-                                if (obisIsValueDate):
-                                    dateTxt = obisIsValueDate[0][0]
-                                    tzTxt = obisIsValueDate[0][1]
-
-                                    is_dst = (tzTxt == "S")
-                                    thisDate = datetime(year = int(dateTxt[0:2]) + 2000, month = int(dateTxt[2:4]), day = int(dateTxt[4:6]), hour = int(dateTxt[6:8]), minute = int(dateTxt[8:10]), second = int(dateTxt[10:12]))
-                                    localThisDateTime = self._smartMeterTimezone.localize(thisDate, is_dst)
-                                    obisContents.append({
-                                        "value": localThisDateTime.astimezone(self._systemTimeZone)
-                                    })
-                                else:
-                                    obisIsValueCode = re.findall(P1Sequence.REGEXP_OBIS_VALUE_CODE, obisValue)
-                                    if (obisIsValueCode):
-                                        theCode = obisIsValueCode[0][0]
-                                        obisContents.append({
-                                            "value": theCode
-                                        })
-                                    else:
-                                        obisIsValueText = re.findall(P1Sequence.REGEXP_OBIS_VALUE_TEXT, obisValue)
-                                        if (obisIsValueText):
-                                            theText = obisIsValueText[0]
-                                            obisContents.append({
-                                                "value": theText
-                                            })
-
-                        self._informations[obisIdentifier] = list(obisContents)
+                        decimalValueCache = P1Sequence._decimalValueCache
+                        obisContents = list()
+                        for rawValue in rawValues:
+                            p1Value = decimalValueCache.get(rawValue)
+                            if (p1Value is None):
+                                p1Value = self.__parseValue(rawValue)
+                            obisContents.append(p1Value)
+
+                        self._informations[intern(obisIdentifier)] = tuple(obisContents)
                     except Exception as exceptionMet:
-                        super().logger.debug('Exception while parsing OBIS data: %s', str(type(exceptionMet)))
-                        super().logger.info('OBIS dataline not parsed: %s', str(dataLine))
-                        pass
+                        P1Sequence.parseErrorCounter.inc()
+                        P1Sequence.logger.debug('Exception while parsing OBIS data: %s', str(type(exceptionMet)))
+                        P1Sequence.logger.info('OBIS dataline not parsed: %s', str(dataLine))
+
+    def __parseValue(self, rawValue: str) -> P1Value:
+        # fast path for the most common value type
+        foundDecimal = _searchDecimal(rawValue)
+        if (foundDecimal is not None):
+            theValue, theUnit = foundDecimal.groups()
+            p1Value = P1Value(Decimal(theValue), intern(theUnit) if theUnit else None)
+
+            decimalValueCache = P1Sequence._decimalValueCache
+            if (len(decimalValueCache) >= P1Sequence.DECIMAL_VALUE_CACHE_SIZE):
+                decimalValueCache.clear()
+            decimalValueCache[rawValue] = p1Value
+            return p1Value
+
+        valueType, theValue, theUnit = OBISLineTokenizer.tokenizeValue(rawValue)
+        if (valueType == OBISLineTokenizer.TIMESTAMP):
+            return P1Value(self._timestampDecoder.decodeValue(*theValue))
+        return P1Value(theValue)
 
     def addInformation(self, obisIdentifier: str, obisValue: float, obisUnit: str = None):
-        self._informations[obisIdentifier] = [
-            {
-                "value": Decimal(obisValue),
-                "unit": obisUnit
-            }
-        ]
-
-    def __setMessageTimeInSystemTimezone(self, dateTxt: str, tzTxt: str):
-        is_dst = (tzTxt == "S")
-        messageDate = datetime(year = int(dateTxt[0:2]) + 2000, month = int(dateTxt[2:4]), day = int(dateTxt[4:6]), hour = int(dateTxt[6:8]), minute = int(dateTxt[8:10]), second = int(dateTxt[10:12]))
-        localMessageDateTime = self._smartMeterTimezone.localize(messageDate, is_dst)
-        self._systemTimeZoneMessageTime = localMessageDateTime.astimezone(self._systemTimeZone)
-
-    def __keepAcceptingInformation(self):
-        return (not self.hasPacketSignature)
-
-    def applyTransformations(self):
-        transformations = self._config.p1Transformations
-        for id in transformations:
-            info = dict()
-            result = 0
-            if (transformations[id]["operation"] == "sum"):
-                for operand in transformations[id]["operands"]:
-                    result += self.getInformationValue(operand)
-            
-            info["obisIdentifier"] = id
-            info["obisValue"] = result
-            if ("unit" in transformations[id]):
-                info["obisUnit"] = transformations[id]["unit"]
-
-            self.addInformation(**info)
+        self._informations[intern(obisIdentifier)] = (P1Value(Decimal(obisValue), intern(obisUnit) if (obisUnit is not None) else None), )
+
+    def applyTransformations(self, transformations):
+        """
+            Applies the steps of compiled P1Transformations. Missing operands count as 0. A result which
+            cannot be computed (eg a ratio by 0 or an operand which is not a number) is not set.
+        """
+        informations = self._informations
+        for operation, operandSlots, code, index, unit in transformations.steps:
+            operandValues = list()
+            for operandCode, operandIndex in operandSlots:
+                values = informations.get(operandCode)
+                p1Value = values[operandIndex] if ((values is not None) and (len(values) > operandIndex)) else None
+                operandValues.append(_ZERO if (p1Value is None) else p1Value.value)
+
+            try:
+                result = operation(operandValues)
+            except (ArithmeticError, TypeError):
+                continue
+
+            if (index is None):
+                informations[code] = (P1Value(result, unit), )
+            else:
+                self.setSelectedValue(code, index, result, unit)
 
     def __str__(self):
         theString = ""
@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import time
+
+class P1Spool:
+
+    """
+        A persistent FIFO of (topic, payload) messages, stored in a sqlite database in WAL mode,
+        used to keep messages which could not be sent while the broker (or the network) is down.
+
+        Appended messages are committed (and therefore fsync'ed) in batches: when syncBatchSize
+        messages are pending or when the oldest pending message is older than syncInterval seconds.
+        When the stored messages exceed maxSize bytes, the oldest ones are evicted. Space freed in
+        the database file is reused, so the file does not grow much beyond maxSize.
+
+        A spool must only be used by one thread at a time.
+    """
+    _EVICTION_RATIO = 0.9
+
+    def __init__(self, path: str, maxSize: int = 64 * 1024 * 1024, syncBatchSize: int = 100, syncInterval: float = 1.0) -> None:
+        self._maxSize = maxSize
+        self._syncBatchSize = syncBatchSize
+        self._syncInterval = syncInterval
+        self._pendingCount = 0
+        self._pendingSince = None
+        self._evictedCount = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if (not os.path.isdir(directory)):
+            os.makedirs(directory)
+
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=FULL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, payload BLOB NOT NULL)")
+
+        self._count, self._size = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(topic) + LENGTH(payload)), 0) FROM spool").fetchone()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def evictedCount(self) -> int:
+        return self._evictedCount
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, topic: str, payload) -> None:
+        if (isinstance(payload, str)):
+            payload = payload.encode("utf-8")
+
+        if (self._pendingCount == 0):
+            self._connection.execute("BEGIN")
+            self._pendingSince = time.monotonic()
+
+        self._connection.execute("INSERT INTO spool (topic, payload) VALUES (?, ?)", (topic, payload))
+        self._pendingCount += 1
+        self._count += 1
+        self._size += len(topic) + len(payload)
+
+        if (self._size > self._maxSize):
+            self.__evictOldest()
+
+        if (self._pendingCount >= self._syncBatchSize):
+            self.flush()
+
+    def __evictOldest(self) -> None:
+        sizeToFree = self._size - int(self._maxSize * P1Spool._EVICTION_RATIO)
+        freedSize = 0
+        freedCount = 0
+        lastId = None
+        cursor = self._connection.execute("SELECT id, LENGTH(topic) + LENGTH(payload) FROM spool ORDER BY id")
+        for messageId, messageSize in cursor:
+            freedSize += messageSize
+            freedCount += 1
+            lastId = messageId
+            if (freedSize >= sizeToFree):
+                break
+        cursor.close()
+
+        if (lastId is not None):
+            self._connection.execute("DELETE FROM spool WHERE id <= ?", (lastId,))
+            self._count -= freedCount
+            self._size -= freedSize
+            self._evictedCount += freedCount
+
+    def flushIfDue(self) -> None:
+        if ((self._pendingCount > 0) and (time.monotonic() - self._pendingSince >= self._syncInterval)):
+            self.flush()
+
+    def flush(self) -> None:
+        if (self._pendingCount > 0):
+            self._connection.execute("COMMIT")
+            self._pendingCount = 0
+            self._pendingSince = None
+
+    def peek(self, limit: int) -> list[tuple[int, str, bytes]]:
+        """
+            Returns the (id, topic, payload) of the limit oldest messages, without removing them
+        """
+        return self._connection.execute("SELECT id, topic, payload FROM spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def remove(self, messages: list[tuple[int, str, bytes]]) -> None:
+        """
+            Removes messages returned by peek once they have been sent
+        """
+        if (not messages):
+            return
+
+        self.flush()
+        self._connection.execute("DELETE FROM spool WHERE id <= ?", (messages[-1][0],))
+        self._count = max(0, self._count - len(messages))
+        self._size = max(0, self._size - sum(len(topic) + len(payload) for _, topic, payload in messages))
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
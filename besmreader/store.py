@@ -0,0 +1,241 @@
+import os
+import sqlite3
+import time
+
+class P1Rollup:
+
+    """
+        The min, max, sum, count and last value (value of the latest sample time, at lastTime) of a series
+        during one bucket of a rollup resolution
+    """
+    __slots__ = ("bucket", "min", "max", "sum", "count", "last", "lastTime")
+
+    def __init__(self, bucket: int, minValue: float = None, maxValue: float = None, sumValue: float = 0.0, count: int = 0, last: float = None,
+            lastTime: int = None) -> None:
+        self.bucket = bucket
+        self.min = minValue
+        self.max = maxValue
+        self.sum = sumValue
+        self.count = count
+        self.last = last
+        self.lastTime = lastTime
+
+    def add(self, value: float, sampleTime: int) -> None:
+        if (self.count == 0):
+            self.min = value
+            self.max = value
+        elif (value < self.min):
+            self.min = value
+        elif (value > self.max):
+            self.max = value
+        self.sum += value
+        self.count += 1
+        # a late reading does not replace the value of a later sample
+        if ((self.lastTime is None) or (sampleTime >= self.lastTime)):
+            self.last = value
+            self.lastTime = sampleTime
+
+    def replace(self, formerValue: float, value: float, sampleTime: int) -> None:
+        """
+            Replaces the value of a sample already counted. Without the other samples of the bucket, min and max
+            can only be widened: they keep formerValue if it was the min or the max
+        """
+        self.sum += value - formerValue
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if (sampleTime == self.lastTime):
+            self.last = value
+
+class P1TimeSeriesStore:
+
+    """
+        An embedded time-series store in a sqlite database (WAL mode), to keep months of readings on the
+        SD card of the gateway and answer range queries without an external database.
+
+        Readings are stored in "samples" and aggregated at once into 1 minute, 15 minutes and 1 hour rollups
+        (min, max, average and last value of each bucket). The buckets being filled are kept in memory:
+        the rollups are written once per commit, not once per reading.
+
+        Writes are committed in batches: when syncBatchSize readings are pending or when the oldest pending
+        reading is older than syncInterval seconds. With synchronous=NORMAL, a power failure can lose the last
+        commits but never corrupts the database. Readings and rollups older than the retention (in days) of
+        their resolution are pruned once per PRUNE_INTERVAL seconds.
+
+        append() and flush() must only be called by one thread at a time, query() can be called by any thread.
+    """
+    RESOLUTIONS = {"1m": 60, "15m": 900, "1h": 3600}
+    DEFAULT_RETENTION = {"raw": 7, "1m": 31, "15m": 366, "1h": None}
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self, path: str, retention: dict = None, syncBatchSize: int = 500, syncInterval: float = 10.0) -> None:
+        self._path = path
+        self._retention = dict(P1TimeSeriesStore.DEFAULT_RETENTION)
+        if (retention is not None):
+            self._retention.update(retention)
+        self._syncBatchSize = syncBatchSize
+        self._syncInterval = syncInterval
+        self._pendingCount = 0
+        self._pendingSince = None
+        self._lastPruneTime = None
+
+        self._seriesIds = dict()
+        self._rollups = dict()
+        self._closedRollups = dict()
+        self._dirtyRollups = set()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if (not os.path.isdir(directory)):
+            os.makedirs(directory)
+
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, unit TEXT)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS samples (series INTEGER NOT NULL, time INTEGER NOT NULL, value REAL NOT NULL, "
+            "PRIMARY KEY (series, time)) WITHOUT ROWID")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS rollups (series INTEGER NOT NULL, resolution INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+            "min REAL NOT NULL, max REAL NOT NULL, sum REAL NOT NULL, count INTEGER NOT NULL, last REAL NOT NULL, lastTime INTEGER NOT NULL, "
+            "PRIMARY KEY (series, resolution, bucket)) WITHOUT ROWID")
+        for seriesId, name in self._connection.execute("SELECT id, name FROM series"):
+            self._seriesIds[name] = seriesId
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def append(self, seriesName: str, timestamp: float, value: float, unit: str = None) -> None:
+        """
+            Stores the value of seriesName at timestamp (seconds since the epoch, rounded down to the second)
+        """
+        if (self._pendingCount == 0):
+            self._connection.execute("BEGIN")
+            self._pendingSince = time.monotonic()
+
+        seriesId = self._seriesIds.get(seriesName)
+        if (seriesId is None):
+            seriesId = self.__createSeries(seriesName, unit)
+
+        sampleTime = int(timestamp)
+        if (self._connection.execute("INSERT OR IGNORE INTO samples (series, time, value) VALUES (?, ?, ?)", (seriesId, sampleTime, value)).rowcount > 0):
+            for resolution in P1TimeSeriesStore.RESOLUTIONS.values():
+                self.__getRollup(seriesId, resolution, sampleTime - sampleTime % resolution).add(value, sampleTime)
+        else:
+            self.__replaceSample(seriesId, sampleTime, value)
+
+        self._pendingCount += 1
+        if (self._pendingCount >= self._syncBatchSize):
+            self.flush()
+
+    def __createSeries(self, seriesName: str, unit: str) -> int:
+        seriesId = self._connection.execute("INSERT INTO series (name, unit) VALUES (?, ?)", (seriesName, unit)).lastrowid
+        self._seriesIds[seriesName] = seriesId
+        return seriesId
+
+    def __getRollup(self, seriesId: int, resolution: int, bucket: int) -> P1Rollup:
+        """
+            Returns the rollup of bucket, which becomes the bucket being filled, marked to be written at the next flush
+        """
+        rollupKey = (seriesId, resolution)
+        rollup = self._rollups.get(rollupKey)
+        if ((rollup is None) or (rollup.bucket != bucket)):
+            if ((rollup is not None) and (rollupKey in self._dirtyRollups)):
+                self._closedRollups[rollupKey + (rollup.bucket, )] = rollup
+            rollup = self.__loadRollup(seriesId, resolution, bucket)
+            self._rollups[rollupKey] = rollup
+        self._dirtyRollups.add(rollupKey)
+        return rollup
+
+    def __loadRollup(self, seriesId: int, resolution: int, bucket: int) -> P1Rollup:
+        # continues a bucket closed since the last flush, or written before a restart (or before a late reading)
+        rollup = self._closedRollups.pop((seriesId, resolution, bucket), None)
+        if (rollup is not None):
+            return rollup
+        row = self._connection.execute("SELECT min, max, sum, count, last, lastTime FROM rollups WHERE series = ? AND resolution = ? AND bucket = ?",
+            (seriesId, resolution, bucket)).fetchone()
+        if (row is None):
+            return P1Rollup(bucket)
+        return P1Rollup(bucket, *row)
+
+    def __replaceSample(self, seriesId: int, sampleTime: int, value: float) -> None:
+        """
+            Replaces the value of a sample already stored (eg replayed telegrams), so that it is not counted twice.
+            The buckets whose samples are all kept are computed again from the samples, the older ones (partly
+            pruned) are updated with the difference.
+        """
+        formerValue = self._connection.execute("SELECT value FROM samples WHERE series = ? AND time = ?", (seriesId, sampleTime)).fetchone()[0]
+        if (formerValue == value):
+            return
+        self._connection.execute("UPDATE samples SET value = ? WHERE series = ? AND time = ?", (value, seriesId, sampleTime))
+        # samples are pruned from the oldest: a bucket starting after the oldest sample has all its samples
+        oldestTime = self._connection.execute("SELECT min(time) FROM samples WHERE series = ?", (seriesId, )).fetchone()[0]
+        for resolution in P1TimeSeriesStore.RESOLUTIONS.values():
+            bucket = sampleTime - sampleTime % resolution
+            rollup = self.__getRollup(seriesId, resolution, bucket)
+            if (oldestTime <= bucket):
+                rollup.min, rollup.max, rollup.sum, rollup.count = self._connection.execute("SELECT min(value), max(value), sum(value), count(*) "
+                    "FROM samples WHERE series = ? AND time >= ? AND time < ?", (seriesId, bucket, bucket + resolution)).fetchone()
+                rollup.lastTime, rollup.last = self._connection.execute("SELECT time, value FROM samples WHERE series = ? AND time >= ? AND time < ? "
+                    "ORDER BY time DESC LIMIT 1", (seriesId, bucket, bucket + resolution)).fetchone()
+            else:
+                rollup.replace(formerValue, value, sampleTime)
+
+    def flushIfDue(self) -> None:
+        if ((self._pendingCount > 0) and (time.monotonic() - self._pendingSince >= self._syncInterval)):
+            self.flush()
+
+    def flush(self) -> None:
+        if (self._pendingCount == 0):
+            return
+
+        rollupRows = [(seriesId, resolution, rollup.bucket) + self.__rollupValues(rollup)
+            for (seriesId, resolution, bucket), rollup in self._closedRollups.items()]
+        rollupRows.extend((seriesId, resolution, self._rollups[(seriesId, resolution)].bucket) + self.__rollupValues(self._rollups[(seriesId, resolution)])
+            for seriesId, resolution in self._dirtyRollups)
+        self._connection.executemany("INSERT OR REPLACE INTO rollups (series, resolution, bucket, min, max, sum, count, last, lastTime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rollupRows)
+        self._closedRollups.clear()
+        self._dirtyRollups.clear()
+
+        if ((self._lastPruneTime is None) or (time.monotonic() - self._lastPruneTime >= P1TimeSeriesStore.PRUNE_INTERVAL)):
+            self.__prune()
+
+        self._connection.execute("COMMIT")
+        self._pendingCount = 0
+        self._pendingSince = None
+
+    @staticmethod
+    def __rollupValues(rollup: P1Rollup) -> tuple:
+        return (rollup.min, rollup.max, rollup.sum, rollup.count, rollup.last, rollup.lastTime)
+
+    def __prune(self) -> None:
+        self._lastPruneTime = time.monotonic()
+        now = time.time()
+        if (self._retention["raw"] is not None):
+            self._connection.execute("DELETE FROM samples WHERE time < ?", (int(now - self._retention["raw"] * 86400), ))
+        for resolutionName, resolution in P1TimeSeriesStore.RESOLUTIONS.items():
+            if (self._retention[resolutionName] is not None):
+                self._connection.execute("DELETE FROM rollups WHERE resolution = ? AND bucket < ?", (resolution, int(now - self._retention[resolutionName] * 86400)))
+
+    def query(self, seriesName: str, startTime: float, endTime: float, resolution: str = "raw") -> list[tuple]:
+        """
+            Returns the committed readings of seriesName between startTime (included) and endTime (excluded):
+                * (time, value) tuples for the "raw" resolution
+                * (bucket start time, min, max, average, last) tuples for the "1m", "15m" and "1h" rollups
+        """
+        connection = sqlite3.connect(self._path)
+        try:
+            if (resolution == "raw"):
+                return connection.execute("SELECT time, value FROM samples JOIN series ON series.id = samples.series "
+                    "WHERE series.name = ? AND time >= ? AND time < ? ORDER BY time", (seriesName, int(startTime), int(endTime))).fetchall()
+            return connection.execute("SELECT bucket, min, max, sum / count, last FROM rollups JOIN series ON series.id = rollups.series "
+                "WHERE series.name = ? AND resolution = ? AND bucket >= ? AND bucket < ? ORDER BY bucket",
+                (seriesName, P1TimeSeriesStore.RESOLUTIONS[resolution], int(startTime), int(endTime))).fetchall()
+        finally:
+            connection.close()
+
+    def seriesNames(self) -> list[str]:
+        return sorted(self._seriesIds)
+
+    def close(self) -> None:
+        self.flush()
+        self._connection.close()
@@ -0,0 +1,181 @@
+from queue import Queue, Empty
+from threading import Event
+import time
+
+from .helper import LoggedClass
+from .metrics import P1Metrics
+
+class P1StageStopEvent (Event):
+
+    """
+        The stop event of one stage. Workers set their stop event when they fail: this event also
+        notifies the supervisor at once, so that failures are not detected by polling.
+    """
+
+    def __init__(self, stageName: str, notifications: Queue) -> None:
+        Event.__init__(self)
+        self._stageName = stageName
+        self._notifications = notifications
+
+    def set(self) -> None:
+        if (not self.is_set()):
+            Event.set(self)
+            self._notifications.put(self._stageName)
+
+class P1SupervisedStage:
+
+    """
+        A stage of the pipeline run by one thread, created by threadFactory(stopEvent) at each (re)start.
+            * onStop(thread) is called to unblock the thread when the stage is stopped (eg close the serial port)
+            * if restartAll is set, the stage stopping means that all stages must be restarted (eg health control)
+    """
+
+    def __init__(self, name: str, threadFactory, onStop=None, restartAll: bool = False) -> None:
+        self.name = name
+        self.threadFactory = threadFactory
+        self.onStop = onStop
+        self.restartAll = restartAll
+
+        self.thread = None
+        self.stopEvent = None
+        self.startTime = None
+        self.backoff = 0.0
+        self.restartTime = None
+        self.restartCounter = P1Metrics.counter("besm_stage_restarts_total", "Restarts of a stage of the pipeline after a failure", stage=name)
+
+class P1Supervisor (LoggedClass):
+
+    """
+        Starts the stages of the pipeline (readers, parser, schedulers...) and restarts a stage as soon as its
+        thread fails, without stopping the other stages: queues, processors and their connections are kept.
+
+        A failed stage is restarted after a backoff which starts at initialBackoff seconds and doubles at each
+        failure up to maxBackoff seconds. It is reset once the stage ran for STABLE_TIME seconds without failure.
+        If restartOnFailure is False, the first failure stops all the stages instead.
+
+        run() returns when stopProgramEvent is set, when all stages must be restarted (a restartAll stage stopped)
+        or when a stage failed without restartOnFailure. The stages are then stopped by stopAllStages().
+
+        When reloadEvent is set (eg by SIGHUP), onReload() is called from run() while the stages keep running.
+    """
+    STABLE_TIME = 60.0
+    # stopProgramEvent is set by a signal handler, which cannot safely wake the notifications queue
+    STOP_CHECK_INTERVAL = 1.0
+
+    def __init__(self, stopProgramEvent: Event, restartOnFailure: bool = True, initialBackoff: float = 0.1, maxBackoff: float = 30.0,
+                 reloadEvent: Event = None, onReload=None) -> None:
+        LoggedClass.__init__(self)
+        self.stopProgramEvent = stopProgramEvent
+        self.reloadEvent = reloadEvent
+        self.onReload = onReload
+        self.restartOnFailure = restartOnFailure
+        self.initialBackoff = initialBackoff
+        self.maxBackoff = maxBackoff
+        self._stages = dict()
+        self._notifications = Queue()
+        self._restartAllRequested = False
+
+    @property
+    def restartAllRequested(self) -> bool:
+        return self._restartAllRequested
+
+    def addStage(self, name: str, threadFactory, onStop=None, restartAll: bool = False) -> None:
+        self._stages[name] = P1SupervisedStage(name, threadFactory, onStop, restartAll)
+
+    def __startStage(self, stage: P1SupervisedStage) -> None:
+        stage.stopEvent = P1StageStopEvent(stage.name, self._notifications)
+        stage.thread = stage.threadFactory(stage.stopEvent)
+
+        # a thread ending without setting its stop event (eg an uncaught error) is also a failure
+        workerRun = stage.thread.run
+        stopEvent = stage.stopEvent
+        def supervisedRun():
+            try:
+                workerRun()
+            finally:
+                stopEvent.set()
+        stage.thread.run = supervisedRun
+
+        stage.startTime = time.monotonic()
+        stage.restartTime = None
+        stage.thread.start()
+
+    def __stopStage(self, stage: P1SupervisedStage, joinTimeout: float = None) -> None:
+        if (stage.thread is None):
+            return
+        Event.set(stage.stopEvent)
+        if (stage.onStop is not None):
+            try:
+                stage.onStop(stage.thread)
+            except Exception:
+                super().logger.exception('Could not stop stage %s', stage.name)
+        stage.thread.join(joinTimeout)
+        if (stage.thread.is_alive()):
+            super().logger.warning('Stage %s did not stop within %s seconds', stage.name, str(joinTimeout))
+
+    def __scheduleRestart(self, stage: P1SupervisedStage) -> None:
+        if (time.monotonic() - stage.startTime >= P1Supervisor.STABLE_TIME):
+            stage.backoff = 0.0
+        # the first failure is restarted at once, then the backoff doubles
+        delay = stage.backoff
+        stage.backoff = min(max(stage.backoff * 2, self.initialBackoff), self.maxBackoff)
+        stage.restartTime = time.monotonic() + delay
+        super().logger.warning('Stage %s failed, restarting it in %.2f seconds', stage.name, delay)
+
+    def __onStageStopped(self, stageName: str) -> bool:
+        """
+            Handles the notification of a stage which stopped. Returns False if run() must return.
+        """
+        stage = self._stages[stageName]
+        if ((stage.stopEvent is None) or (not stage.stopEvent.is_set()) or (stage.restartTime is not None)):
+            # notification of a former thread of the stage
+            return True
+
+        if (stage.restartAll):
+            super().logger.warning('Stage %s requested to restart all stages', stage.name)
+            self._restartAllRequested = True
+            return False
+        if (not self.restartOnFailure):
+            super().logger.error('Stage %s failed and restartOnFailure is not set: stopping', stage.name)
+            return False
+
+        # the thread has stopped or is stopping: free its resources (eg serial port) before the restart
+        self.__stopStage(stage, P1Supervisor.STOP_CHECK_INTERVAL)
+        self.__scheduleRestart(stage)
+        return True
+
+    def run(self) -> None:
+        super().logger.info('Starting %d stages', len(self._stages))
+        for stage in self._stages.values():
+            self.__startStage(stage)
+
+        while (not self.stopProgramEvent.is_set()):
+            now = time.monotonic()
+            restartTimes = [stage.restartTime for stage in self._stages.values() if (stage.restartTime is not None)]
+            waitTime = min([P1Supervisor.STOP_CHECK_INTERVAL] + [max(0, restartTime - now) for restartTime in restartTimes])
+
+            try:
+                stageName = self._notifications.get(True, waitTime)
+                if (not self.__onStageStopped(stageName)):
+                    return
+            except Empty:
+                pass
+
+            if ((self.reloadEvent is not None) and self.reloadEvent.is_set()):
+                self.reloadEvent.clear()
+                try:
+                    self.onReload()
+                except Exception as exceptionMet:
+                    super().logger.error('Reload failed, the running configuration is kept: %s', str(exceptionMet))
+
+            now = time.monotonic()
+            for stage in self._stages.values():
+                if ((stage.restartTime is not None) and (stage.restartTime <= now) and (not self.stopProgramEvent.is_set())):
+                    super().logger.info('Restarting stage %s', stage.name)
+                    stage.restartCounter.inc()
+                    self.__startStage(stage)
+
+    def stopAllStages(self) -> None:
+        super().logger.info('Stopping all stages')
+        for stage in self._stages.values():
+            self.__stopStage(stage)
@@ -0,0 +1,174 @@
+class P1TelegramFramer:
+
+    """
+        Splits the byte stream read from the P1 Port into complete telegrams, from the
+        "/" header up to and including the end of the "!ABCD" signature line.
+
+        Bytes are accumulated in a single reusable buffer. Bytes which do not belong to
+        a telegram (eg when the port is opened in the middle of a telegram) are discarded.
+    """
+
+    def __init__(self, maxFrameSize: int = 8192) -> None:
+        self._buffer = bytearray()
+        self._maxFrameSize = maxFrameSize
+        self._discardedBytes = 0
+
+    @property
+    def discardedBytes(self) -> int:
+        return self._discardedBytes
+
+    @property
+    def pendingBytes(self) -> int:
+        """
+            Number of bytes of the telegram being received
+        """
+        return len(self._buffer)
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+            Adds data to the buffer and returns the list of telegrams completed by it.
+        """
+        buffer = self._buffer
+        buffer += data
+        frames = list()
+        consumed = 0
+
+        start = buffer.find(b'/')
+        while (start >= 0):
+            # the signature line always starts at the beginning of a line
+            end = buffer.find(b'\n!', start)
+            if (end < 0):
+                break
+            lineEnd = buffer.find(b'\n', end + 2)
+            if (lineEnd < 0):
+                break
+
+            # a header in the middle means the previous telegram was truncated
+            restart = buffer.rfind(b'\n/', start, end)
+            if (restart >= 0):
+                start = restart + 1
+
+            self._discardedBytes += start - consumed
+            frames.append(bytes(buffer[start:lineEnd + 1]))
+            consumed = lineEnd + 1
+            start = buffer.find(b'/', consumed)
+
+        # keep only the (incomplete) telegram being received, if any
+        if (start < 0):
+            start = len(buffer)
+        self._discardedBytes += start - consumed
+        del buffer[:start]
+
+        if (len(buffer) > self._maxFrameSize):
+            # no signature within a reasonable size: restart from the next header, if any
+            nextStart = buffer.find(b'\n/', 1)
+            if (nextStart < 0):
+                self._discardedBytes += len(buffer)
+                buffer.clear()
+            else:
+                self._discardedBytes += nextStart + 1
+                del buffer[:nextStart + 1]
+
+        return frames
+
+
+def _buildCRC16Table() -> tuple:
+    table = list()
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if (crc & 1) else (crc >> 1)
+        table.append(crc)
+    return tuple(table)
+
+class P1TelegramCRC:
+
+    """
+        CRC16/ARC (polynomial x16+x15+x2+1, reflected, initial value 0) used by DSMR 4+ and e-MUCS
+        meters to sign telegrams. The CRC is computed over all bytes from the "/" of the header
+        up to and including the "!" of the signature line.
+
+        Most lines of a telegram do not change from one telegram to the next (identifiers, indexes...),
+        so the CRC of each line is memoized. The CRC being linear, the CRC after a line is the CRC of the
+        line alone XOR the former CRC shifted through as many zero bytes, which is read from two tables of
+        256 entries per line length. Only new lines are computed byte per byte.
+    """
+    _TABLE = _buildCRC16Table()
+    MAX_CACHED_LINES = 4096
+    # longer lines (eg garbage without line ends) are computed without memoization
+    MAX_CACHED_LINE_LENGTH = 256
+    # line: (CRC of the line alone, shift tables of the line length)
+    _lineCRCs = dict()
+    # _shiftTables[n]: (table of the low byte, table of the high byte) of a CRC shifted through n zero bytes
+    _shiftTables = [(tuple(range(256)), tuple(byte << 8 for byte in range(256)))]
+
+    @classmethod
+    def compute(cls, data: bytes) -> int:
+        lineCRCs = cls._lineCRCs
+        crc = 0
+        for line in data.splitlines(True):
+            cachedLine = lineCRCs.get(line)
+            if (cachedLine is None):
+                if (len(line) > cls.MAX_CACHED_LINE_LENGTH):
+                    crc = cls.__computeBytes(line, crc)
+                    continue
+                cachedLine = cls.__addLine(line)
+            lineCRC, lowTable, highTable = cachedLine
+            crc = lowTable[crc & 0xFF] ^ highTable[crc >> 8] ^ lineCRC
+        return crc
+
+    @classmethod
+    def __computeBytes(cls, data: bytes, crc: int = 0) -> int:
+        table = cls._TABLE
+        for byte in data:
+            crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+        return crc
+
+    @classmethod
+    def __addLine(cls, line: bytes) -> tuple:
+        lineCRCs = cls._lineCRCs
+        if (len(lineCRCs) >= cls.MAX_CACHED_LINES):
+            # lines with changing values (eg timestamps) are not worth keeping
+            lineCRCs.clear()
+        shiftTables = cls._shiftTables
+        if (len(line) >= len(shiftTables)):
+            shiftTables = cls.__extendShiftTables(len(line))
+        lineCRC = lineCRCs[line] = (cls.__computeBytes(line), ) + shiftTables[len(line)]
+        return lineCRC
+
+    @classmethod
+    def __extendShiftTables(cls, length: int) -> list:
+        # a new list is swapped in, so that parser threads never see a partial one
+        table = cls._TABLE
+        shiftTables = list(cls._shiftTables)
+        while (len(shiftTables) <= length):
+            lowTable, highTable = shiftTables[-1]
+            shiftTables.append((tuple((crc >> 8) ^ table[crc & 0xFF] for crc in lowTable), tuple((crc >> 8) ^ table[crc & 0xFF] for crc in highTable)))
+        cls._shiftTables = shiftTables
+        return shiftTables
+
+    @staticmethod
+    def parseSignature(signatureLine: str) -> int:
+        """
+            Returns the CRC contained in a "!ABCD" signature line, or None if there is none
+            (eg DSMR 2.2 meters which end telegrams with a single "!")
+        """
+        signature = signatureLine.strip()[1:5]
+        if (len(signature) != 4):
+            return None
+        try:
+            return int(signature, 16)
+        except ValueError:
+            return None
+
+    @classmethod
+    def verifyFrame(cls, rawFrame: bytes) -> bool:
+        """
+            Verifies a complete telegram as returned by P1TelegramFramer.
+            Returns None if the telegram has no CRC to verify.
+        """
+        end = rawFrame.rfind(b'\n!') + 2
+        expectedCRC = cls.parseSignature(rawFrame[end - 1:].decode("ascii", "replace"))
+        if (expectedCRC is None):
+            return None
+        return (cls.compute(rawFrame[:end]) == expectedCRC)
@@ -1,12 +1,19 @@
 import serial
 
-from queue import Queue
+from queue import Queue, Empty
 from threading import Thread, Event
+import os
 import re
 import time
 
 from .sequence import P1Sequence
+from .timestamps import P1TimestampDecoder
+from .telegram import P1TelegramFramer, P1TelegramCRC
+from .capture import P1CaptureWriter, P1ReplayPort
+from .generator import P1TelegramGenerator, P1GeneratorPort
 from .helper import LoggedClass
+from .meter import P1Meter
+from .metrics import P1Metrics
 
 class ReadFromCOMPortThread(Thread, LoggedClass):
 
@@ -17,33 +24,97 @@ class ReadFromCOMPortThread(Thread, LoggedClass):
         
             Don't forget to set a timeout in the configuration or it can keep waiting for
             datalines forever without checking the stopReadingEvent
+
+        In "line" reader mode, each dataline is put on the rawDataQueue.
+        In "frame" reader mode, the port is read by chunks and one complete telegram
+        (bytes from "/" to the end of the "!ABCD" line) is put on the rawDataQueue.
+
+        Data is put on the rawDataQueue as (meter, data, readTime) tuples so that several readers (one per meter)
+        can share the same queue. readTime is the time.perf_counter() when the (first) data was read.
+        If no meter is given, the first meter of the configuration is read.
+
+        If the meter has a "replay" configuration, a capture file is read instead of the serial port.
+        If the meter has a "generator" configuration, synthetic telegrams are read instead of the serial port.
+        If the meter has a "capture" configuration, all the data read is also recorded in a capture file.
     """
 
-    def __init__(self, rawDataQueue: Queue, stopReadingEvent: Event, configuration) -> None:
+    def __init__(self, rawDataQueue: Queue, stopReadingEvent: Event, configuration, meter: P1Meter = None) -> None:
         LoggedClass.__init__(self)
         Thread.__init__(self)
         self.rawDataQueue = rawDataQueue
         self.stopReadingEvent = stopReadingEvent
         self.daemon = True
         self.comPort = None
+        self.captureWriter = None
         self.globalConfiguration = configuration
+        self.meter = meter if (meter is not None) else configuration.meters[0]
+        self.readCounter = P1Metrics.counter("besm_reader_reads_total", "Lines (line mode) or telegrams (frame mode) read from the serial port", meter=self.meter.meterId)
     
     def run(self) -> None:
         
-        super().logger.info('Starting')
+        super().logger.info('Starting for meter %s', self.meter.meterId)
         try:
-            self.comPort = serial.Serial(**self.globalConfiguration.serialPortConfig)
-            while (not self.stopReadingEvent.is_set()):
-                rawLine = self.comPort.readline()
-                self.rawDataQueue.put(rawLine)
+            self.comPort = self._openPort()
+            if (self.meter.captureConfig is not None):
+                self.captureWriter = P1CaptureWriter(self.meter.captureConfig["path"])
+            if (self.globalConfiguration.readerMode == "frame"):
+                self._readFrames()
+            else:
+                self._readLines()
         except Exception as exceptionMet:
-            super().logger.error('Exception while reading from serial: %s', str(type(exceptionMet)))
-            super().logger.exception("Stack Trace")
-            self.stopReadingEvent.set()
+            # closing the port to stop the thread can raise an exception in the read
+            if (not self.stopReadingEvent.is_set()):
+                super().logger.error('Exception while reading from serial of meter %s: %s', self.meter.meterId, str(type(exceptionMet)))
+                super().logger.exception("Stack Trace")
+                self.stopReadingEvent.set()
 
         self.closePort()
-        super().logger.info('Stopped')
+        super().logger.info('Stopped for meter %s', self.meter.meterId)
     
+    def _openPort(self):
+        replayConfig = self.meter.replayConfig
+        if (replayConfig is not None):
+            super().logger.info('Replaying %s for meter %s', replayConfig["path"], self.meter.meterId)
+            return P1ReplayPort(replayConfig["path"], replayConfig.get("speed", 1), replayConfig.get("loop", False), self.meter.serialPortConfig["timeout"])
+        generatorConfig = self.meter.generatorConfig
+        if (generatorConfig is not None):
+            super().logger.info('Generating synthetic telegrams for meter %s', self.meter.meterId)
+            generator = P1TelegramGenerator.fromConfig(generatorConfig, self.meter.meterId, self.globalConfiguration.smartMeterTimeZone)
+            return P1GeneratorPort(generator, generatorConfig.get("rate", 1), generatorConfig.get("interval", 1), self.meter.serialPortConfig["timeout"])
+        return serial.Serial(**self.meter.serialPortConfig)
+
+    def _readLines(self) -> None:
+        meter = self.meter
+        readCounter = self.readCounter
+        captureWriter = self.captureWriter
+        while (not self.stopReadingEvent.is_set()):
+            rawLine = self.comPort.readline()
+            self.rawDataQueue.put((meter, rawLine, time.perf_counter()))
+            readCounter.inc()
+            if ((captureWriter is not None) and rawLine):
+                captureWriter.write(rawLine)
+
+    def _readFrames(self) -> None:
+        meter = self.meter
+        readCounter = self.readCounter
+        framer = P1TelegramFramer(self.globalConfiguration.readerMaxFrameSize)
+        frameStartTime = None
+        while (not self.stopReadingEvent.is_set()):
+            # blocks until at least one byte (or timeout), then takes everything available
+            rawChunk = self.comPort.read(self.comPort.in_waiting or 1)
+            if (rawChunk):
+                if (self.captureWriter is not None):
+                    self.captureWriter.write(rawChunk)
+                readTime = time.perf_counter()
+                if (frameStartTime is None):
+                    frameStartTime = readTime
+                for rawFrame in framer.feed(rawChunk):
+                    self.rawDataQueue.put((meter, rawFrame, frameStartTime))
+                    readCounter.inc()
+                    frameStartTime = readTime
+                if (framer.pendingBytes == 0):
+                    frameStartTime = None
+
     def closePort(self) -> None:
         if (self.comPort is not None):
             try: 
@@ -52,11 +123,23 @@ class ReadFromCOMPortThread(Thread, LoggedClass):
             except Exception:
                 pass
 
+        if (self.captureWriter is not None):
+            try:
+                self.captureWriter.close()
+            except Exception:
+                pass
+
 class ParseP1RawDataThread (Thread, LoggedClass):
 
     """
-        A Thread which interprets the rawDataLines from rawDataQueue to build P1 Sequence objects
-        and transmit them to the p1SequenceQueue.
+        A Thread which interprets the rawDataLines (or complete telegram frames in "frame" reader mode)
+        from rawDataQueue to build P1 Sequence objects and transmit them to the p1SequenceQueue.
+
+        Unless the CRC policy is "ignore", the CRC of each telegram is verified and telegrams with
+        a wrong CRC are counted, logged and/or dropped as per the configured policy.
+
+        Raw data is received as (meter, data, readTime) tuples. In "line" reader mode, the telegram being built
+        is kept per meter. P1 Sequences are put on the p1SequenceQueue as (meter, p1Sequence) tuples.
     """
 
     def __init__(self, rawDataQueue: Queue, p1SequenceQueue: Queue, stopReadingEvent: Event, configuration) -> None:
@@ -67,23 +150,29 @@ class ParseP1RawDataThread (Thread, LoggedClass):
         self.stopReadingEvent = stopReadingEvent
         self.globalConfiguration = configuration
 
-        self.currentSequence = P1Sequence(None, self.globalConfiguration)
+        self.currentSequences = dict()
+        self.currentRawTelegrams = dict()
+        self.timestampDecoders = dict()
+        self.crcPolicy = self.globalConfiguration.crcPolicy
+        self.crcErrorCount = 0
+        self.crcFailureCounter = P1Metrics.counter("besm_crc_failures_total", "Telegrams with a wrong CRC")
+        self.crcDroppedCounter = P1Metrics.counter("besm_telegrams_dropped_total", "Telegrams dropped before scheduling, by reason", reason="crc")
+        self.noTimestampDroppedCounter = P1Metrics.counter("besm_telegrams_dropped_total", "Telegrams dropped before scheduling, by reason", reason="noTimestamp")
+        self.parseHistogram = P1Metrics.histogram("besm_parse_seconds", "Time to parse a telegram (frame reader mode only)")
+        self.telegramCounters = dict()
         self.daemon = True
     
     def run(self) -> None:
         super().logger.info('Starting')
         try:
+            parseRawData = self._parseRawFrame if (self.globalConfiguration.readerMode == "frame") else self._parseRawLine
             while (not self.stopReadingEvent.is_set()):
-                rawDataLine = self.rawDataQueue.get(True, self.globalConfiguration.timeoutCycleLength)
-                if (len(rawDataLine) > 2):
-                    cleanDataLine = str(rawDataLine).rstrip()
-                    if (ParseP1RawDataThread.isObjectStart(cleanDataLine)):
-                        self.currentSequence = P1Sequence(cleanDataLine, self.globalConfiguration)
-                    elif (ParseP1RawDataThread.isObjectEnd(cleanDataLine)):
-                        self.currentSequence.packetSignature = cleanDataLine
-                        self.p1SequenceQueue.put(self.currentSequence)
-                    else:
-                        self.currentSequence.addInformationFromDataLine(cleanDataLine)
+                try:
+                    meter, rawData, readTime = self.rawDataQueue.get(True, self.globalConfiguration.timeoutCycleLength)
+                except Empty:
+                    # no data (eg frame mode without telegram): not a failure, check the stop event again
+                    continue
+                parseRawData(meter, rawData, readTime)
         except Exception as exceptionMet:
             if (not self.stopReadingEvent.is_set()):
                 super().logger.error('Exception while parsing raw data: %s', str(type(exceptionMet)))
@@ -92,6 +181,95 @@ class ParseP1RawDataThread (Thread, LoggedClass):
         
         super().logger.info('Stopped')
 
+    def _parseRawLine(self, meter: P1Meter, rawDataLine: bytes, readTime: float) -> None:
+        meterId = meter.meterId
+        currentRawTelegram = self.currentRawTelegrams.get(meterId)
+        if (currentRawTelegram is not None):
+            currentRawTelegram += rawDataLine
+
+        if (len(rawDataLine) > 2):
+            cleanDataLine = rawDataLine.decode("ascii", "replace").rstrip()
+            if (ParseP1RawDataThread.isObjectStart(cleanDataLine)):
+                self.currentSequences[meterId] = P1Sequence(cleanDataLine, self.globalConfiguration, self._getTimestampDecoder(meterId))
+                self.currentSequences[meterId].receivedTime = readTime
+                if (self.crcPolicy != "ignore"):
+                    self.currentRawTelegrams[meterId] = bytearray(rawDataLine[rawDataLine.find(b'/'):])
+            elif (ParseP1RawDataThread.isObjectEnd(cleanDataLine)):
+                currentSequence = self.__getCurrentSequence(meterId)
+                currentSequence.packetSignature = cleanDataLine
+                if (self._acceptTelegram(currentRawTelegram, currentSequence)):
+                    self.p1SequenceQueue.put((meter, currentSequence))
+                    self._countTelegram(meterId)
+                self.currentRawTelegrams[meterId] = None
+            else:
+                self.__getCurrentSequence(meterId).addInformationFromDataLine(cleanDataLine)
+
+    def __getCurrentSequence(self, meterId: str) -> P1Sequence:
+        # lines read before the first header of a meter go to a sequence without header
+        if (not meterId in self.currentSequences):
+            self.currentSequences[meterId] = P1Sequence(None, self.globalConfiguration, self._getTimestampDecoder(meterId))
+        return self.currentSequences[meterId]
+
+    def _parseRawFrame(self, meter: P1Meter, rawFrame: bytes, readTime: float) -> None:
+        parseStartTime = time.perf_counter()
+        # the frame is delimited by P1TelegramFramer: header first, signature last
+        frameLines = rawFrame.decode("ascii", "replace").splitlines()
+        p1Sequence = P1Sequence(frameLines[0], self.globalConfiguration, self._getTimestampDecoder(meter.meterId))
+        p1Sequence.receivedTime = readTime
+        for dataLine in frameLines[1:-1]:
+            if (dataLine):
+                p1Sequence.addInformationFromDataLine(dataLine)
+        p1Sequence.packetSignature = frameLines[-1]
+        acceptTelegram = self._acceptTelegram(rawFrame, p1Sequence)
+        self.parseHistogram.observe(time.perf_counter() - parseStartTime)
+        if (acceptTelegram):
+            self.p1SequenceQueue.put((meter, p1Sequence))
+            self._countTelegram(meter.meterId)
+
+    def _getTimestampDecoder(self, meterId: str) -> P1TimestampDecoder:
+        timestampDecoder = self.timestampDecoders.get(meterId)
+        if (timestampDecoder is None):
+            timestampDecoder = P1TimestampDecoder(self.globalConfiguration.smartMeterTimeZone)
+            self.timestampDecoders[meterId] = timestampDecoder
+        return timestampDecoder
+
+    def _countTelegram(self, meterId: str) -> None:
+        telegramCounter = self.telegramCounters.get(meterId)
+        if (telegramCounter is None):
+            telegramCounter = P1Metrics.counter("besm_telegrams_total", "Telegrams parsed and sent to the schedulers", meter=meterId)
+            self.telegramCounters[meterId] = telegramCounter
+        telegramCounter.inc()
+
+    def _acceptTelegram(self, rawTelegram: bytes, p1Sequence: P1Sequence) -> bool:
+        """
+            Applies the CRC policy to the telegram and returns True if it must be processed.
+            Telegrams which cannot be verified (no raw data or no CRC) are always processed.
+            Telegrams without timestamp (eg lines dropped by the raw queue) cannot be scheduled and are dropped.
+        """
+        if (not p1Sequence.hasTimeinSystemTimezone):
+            super().logger.warning('Telegram %s has no timestamp and is dropped', p1Sequence.packetSignature)
+            self.noTimestampDroppedCounter.inc()
+            return False
+
+        if ((self.crcPolicy == "ignore") or (rawTelegram is None)):
+            return True
+
+        crcIsValid = P1TelegramCRC.verifyFrame(rawTelegram)
+        if ((crcIsValid is None) or crcIsValid):
+            return True
+
+        self.crcErrorCount += 1
+        self.crcFailureCounter.inc()
+        if (self.crcPolicy == "count"):
+            super().logger.debug('CRC check failed for telegram %s (%d failures)', p1Sequence.packetSignature, self.crcErrorCount)
+            return True
+
+        super().logger.warning('CRC check failed for telegram %s (%d failures)', p1Sequence.packetSignature, self.crcErrorCount)
+        if (self.crcPolicy == "drop"):
+            self.crcDroppedCounter.inc()
+            return False
+        return True
+
     @staticmethod
     def isObjectStart(data) -> bool:
         return len(re.findall(r'/\w{4}\\', data)) != 0
@@ -104,7 +282,7 @@ class ProcessP1SequencesThread(Thread, LoggedClass):
     
     """
         A Thred which gets P1Sequence from the p1SequenceQueue and does calculations and processing
-        as instructed by the P1Configuration
+        as instructed by the P1Configuration, using the scheduler of the meter which sent it
     """
 
     def __init__(self, p1SequenceQueue: Queue, stopReadingEvent: Event, configuration) -> None:
@@ -115,15 +293,26 @@ class ProcessP1SequencesThread(Thread, LoggedClass):
         self.averaging = dict()
         self.daemon = True
         self.globalConfiguration = configuration
+        self.schedulerHistogram = P1Metrics.histogram("besm_scheduler_seconds", "Time to process a telegram by the scheduler and the triggered processors")
+        self.latencyHistogram = P1Metrics.histogram("besm_telegram_latency_seconds", "Time from the first data of a telegram read to the end of its processing")
     
     def run(self) -> None:
         super().logger.info('Starting...')
 
         try:
             while (not self.stopReadingEvent.is_set()):
-                p1Sequence = self.p1SequenceQueue.get(True, self.globalConfiguration.timeoutCycleLength)
+                try:
+                    meter, p1Sequence = self.p1SequenceQueue.get(True, self.globalConfiguration.timeoutCycleLength)
+                except Empty:
+                    continue
                 if (p1Sequence is not None):
-                    self.globalConfiguration.scheduler.processP1(p1Sequence)
+                    processStartTime = time.perf_counter()
+                    with meter.schedulerLock:
+                        meter.scheduler.processP1(p1Sequence)
+                    processEndTime = time.perf_counter()
+                    self.schedulerHistogram.observe(processEndTime - processStartTime)
+                    if (p1Sequence.receivedTime is not None):
+                        self.latencyHistogram.observe(processEndTime - p1Sequence.receivedTime)
         except Exception as exceptionMet:
             if (not self.stopReadingEvent.is_set()):
                 super().logger.error('Exception processing sequences: %s', str(type(exceptionMet)))
@@ -162,3 +351,36 @@ class HealthControllerThread (Thread, LoggedClass):
             self.stopReading.set()
         
         super().logger.info('Stopped')
+
+class ConfigurationWatcherThread (Thread, LoggedClass):
+
+    """
+        A Thread which sets the reloadEvent when the configuration file is modified, until stopReadingEvent is set
+    """
+    CHECK_INTERVAL = 2
+
+    def __init__(self, stopReadingEvent: Event, configFilePath: str, reloadEvent: Event) -> None:
+        LoggedClass.__init__(self)
+        Thread.__init__(self)
+        self.daemon = True
+        self.stopReadingEvent = stopReadingEvent
+        self.configFilePath = configFilePath
+        self.reloadEvent = reloadEvent
+
+    def __getModificationTime(self) -> float:
+        try:
+            return os.stat(self.configFilePath).st_mtime
+        except OSError:
+            return None
+
+    def run(self) -> None:
+        super().logger.info('Watching %s', self.configFilePath)
+        lastModificationTime = self.__getModificationTime()
+        while (not self.stopReadingEvent.wait(ConfigurationWatcherThread.CHECK_INTERVAL)):
+            modificationTime = self.__getModificationTime()
+            if ((modificationTime is not None) and (modificationTime != lastModificationTime)):
+                super().logger.info('%s was modified, reloading the configuration', self.configFilePath)
+                lastModificationTime = modificationTime
+                self.reloadEvent.set()
+        super().logger.info('Stopped')
+
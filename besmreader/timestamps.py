@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from tzlocal import get_localzone
+
+class P1TimestampDecoder:
+
+    """
+        Decodes the YYMMDDhhmmss[SW] timestamps of a meter (in the smart meter time zone) to datetimes in the
+        system time zone, without calling pytz localize() and astimezone() for every telegram:
+            * the UTC offset is resolved once per hour (and per S/W flag, which tells apart the repeated hour
+              when DST ends): a timestamp is the start of its hour plus its minutes and seconds. An hour in which
+              the system time zone offset changes is decoded without cache
+            * repeated values (eg the date of the monthly peak in 1-0:1.6.0, the same on thousands of telegrams)
+              are memoized in a small LRU
+        Each meter has its own decoder, so that the LRU of one meter is not evicted by another one.
+        A decoder must only be used by one thread (the parser).
+    """
+    HOUR_CACHE_SIZE = 8
+    VALUE_CACHE_SIZE = 64
+
+    _systemTimeZone = None
+    _sharedDecoders = dict()
+
+    def __init__(self, smartMeterTimeZone, systemTimeZone=None, valueCacheSize: int = VALUE_CACHE_SIZE) -> None:
+        self._smartMeterTimeZone = smartMeterTimeZone
+        self._systemTimeZone = systemTimeZone if (systemTimeZone is not None) else P1TimestampDecoder.getSystemTimeZone()
+        self._valueCacheSize = valueCacheSize
+        self._hourStarts = dict()
+        self._values = OrderedDict()
+
+    @classmethod
+    def getSystemTimeZone(cls):
+        # resolved once: get_localzone() is too expensive to be called for every telegram
+        if (cls._systemTimeZone is None):
+            cls._systemTimeZone = get_localzone()
+        return cls._systemTimeZone
+
+    @classmethod
+    def forTimeZone(cls, smartMeterTimeZone) -> "P1TimestampDecoder":
+        """
+            The decoder shared by the sequences built without a decoder of their meter (eg in the benchmarks)
+        """
+        decoder = cls._sharedDecoders.get(smartMeterTimeZone)
+        if (decoder is None):
+            decoder = P1TimestampDecoder(smartMeterTimeZone)
+            cls._sharedDecoders[smartMeterTimeZone] = decoder
+        return decoder
+
+    def decodeClock(self, dateTxt: str, tzTxt: str) -> datetime:
+        """
+            Decodes the telegram clock (0-0:1.0.0): a new value at each telegram, which is not memoized
+        """
+        hourKey = dateTxt[0:8] + tzTxt
+        hourStart = self._hourStarts.get(hourKey, self)
+        if (hourStart is self):
+            hourStart = self.__decodeHourStart(dateTxt, tzTxt)
+            if (len(self._hourStarts) >= P1TimestampDecoder.HOUR_CACHE_SIZE):
+                self._hourStarts.clear()
+            self._hourStarts[hourKey] = hourStart
+
+        minute = int(dateTxt[8:10])
+        second = int(dateTxt[10:12])
+        if ((hourStart is None) or (minute > 59) or (second > 59)):
+            # invalid values raise the same errors as without cache
+            return self.__decode(dateTxt, tzTxt)
+        return hourStart + timedelta(minutes=minute, seconds=second)
+
+    def decodeValue(self, dateTxt: str, tzTxt: str) -> datetime:
+        """
+            Decodes a timestamp value (eg the date of a peak), memoized in the LRU
+        """
+        valueKey = dateTxt + tzTxt
+        values = self._values
+        decodedValue = values.get(valueKey)
+        if (decodedValue is not None):
+            values.move_to_end(valueKey)
+            return decodedValue
+
+        decodedValue = self.decodeClock(dateTxt, tzTxt)
+        values[valueKey] = decodedValue
+        if (len(values) > self._valueCacheSize):
+            values.popitem(last=False)
+        return decodedValue
+
+    def __decodeHourStart(self, dateTxt: str, tzTxt: str) -> datetime:
+        """
+            Returns the start of the hour of the timestamp in the system time zone,
+            or None if the system time zone offset changes during that hour
+        """
+        hourStart = self.__decode(dateTxt[0:8] + "0000", tzTxt)
+        hourEnd = (hourStart + timedelta(hours=1)).astimezone(self._systemTimeZone)
+        if (hourStart.utcoffset() != hourEnd.utcoffset()):
+            return None
+        return hourStart
+
+    def __decode(self, dateTxt: str, tzTxt: str) -> datetime:
+        is_dst = (tzTxt == "S")
+        thisDate = datetime(year = int(dateTxt[0:2]) + 2000, month = int(dateTxt[2:4]), day = int(dateTxt[4:6]), hour = int(dateTxt[6:8]), minute = int(dateTxt[8:10]), second = int(dateTxt[10:12]))
+        localThisDateTime = self._smartMeterTimeZone.localize(thisDate, is_dst)
+        return localThisDateTime.astimezone(self._systemTimeZone)
@@ -0,0 +1,81 @@
+import re
+
+class OBISLineTokenizer:
+
+    """
+        A single-pass tokenizer for OBIS data lines (eg `1-0:1.6.0(230318200000W)(04.470*kW)`).
+        All patterns are compiled once and each value is classified as one of:
+            * DECIMAL: a number with an optional unit (eg `000316.698*kWh`)
+            * TIMESTAMP: a YYMMDDhhmmss[SW] date (eg `230318200000W`)
+            * OBIS_REFERENCE: a reference to another OBIS code (eg `1-0:1.6.0`)
+            * TEXT: anything else (including empty values)
+
+        The classification order and patterns are the ones historically used by P1Sequence
+        so that the parsed values are identical.
+    """
+    DECIMAL = 0
+    TIMESTAMP = 1
+    OBIS_REFERENCE = 2
+    TEXT = 3
+
+    REGEXP_OBIS_CODE_AND_VALUES = re.compile(r'(\d+-\d+:\d+\.\d+\.\d+(?:\.\d+)?(?:\*\d+)?)((?:\([\w ,.!?/*-+=:]*\))+)')
+    REGEXP_OBIS_VALUE_DATE = re.compile(r'(\d+)([SW])')
+    REGEXP_OBIS_VALUE_DECIMAL = re.compile(r'(\d+(?:\.\d+)?)(?:\*(\w+))*$')
+    REGEXP_OBIS_VALUE_CODE = re.compile(r'\d+-\d+:\d+\.\d+\.\d+(?:\.\d+)?(?:\*\d+)?')
+
+    @classmethod
+    def splitLine(cls, dataLine: str) -> tuple[str, list[str]]:
+        """
+            Returns the OBIS code and the list of raw values (without parenthesis) of the
+            first OBIS information found in dataLine, or (None, None) if there is none.
+        """
+        foundOBISInfo = cls.REGEXP_OBIS_CODE_AND_VALUES.search(dataLine)
+        if (foundOBISInfo is None):
+            return None, None
+
+        # values cannot contain parenthesis, so "(a)(b)" can be split on ")("
+        return foundOBISInfo.group(1), foundOBISInfo.group(2)[1:-1].split(")(")
+
+    @classmethod
+    def matchTimestamp(cls, rawValue: str) -> tuple[str, str]:
+        """
+            Returns the (YYMMDDhhmmss, S|W) parts of a date value or (None, None)
+        """
+        foundDate = cls.REGEXP_OBIS_VALUE_DATE.search(rawValue)
+        if (foundDate is None):
+            return None, None
+        return foundDate.group(1), foundDate.group(2)
+
+    @classmethod
+    def tokenizeValue(cls, rawValue: str) -> tuple[int, object, str]:
+        """
+            Classifies one raw value and returns a (type, value, unit) tuple where value is:
+                * a decimal string for DECIMAL (unit may be set)
+                * a (YYMMDDhhmmss, S|W) tuple for TIMESTAMP
+                * the referenced code for OBIS_REFERENCE
+                * the text itself for TEXT
+        """
+        foundDecimal = cls.REGEXP_OBIS_VALUE_DECIMAL.search(rawValue)
+        if (foundDecimal is not None):
+            return cls.DECIMAL, foundDecimal.group(1), foundDecimal.group(2)
+
+        foundDate = cls.REGEXP_OBIS_VALUE_DATE.search(rawValue)
+        if (foundDate is not None):
+            return cls.TIMESTAMP, (foundDate.group(1), foundDate.group(2)), None
+
+        foundCode = cls.REGEXP_OBIS_VALUE_CODE.search(rawValue)
+        if (foundCode is not None):
+            return cls.OBIS_REFERENCE, foundCode.group(0), None
+
+        return cls.TEXT, rawValue, None
+
+    @classmethod
+    def tokenize(cls, dataLine: str) -> tuple[str, list[tuple[int, object, str]]]:
+        """
+            Returns the OBIS code and the list of typed (type, value, unit) tokens of dataLine,
+            or (None, None) if dataLine does not contain OBIS information.
+        """
+        obisIdentifier, rawValues = cls.splitLine(dataLine)
+        if (obisIdentifier is None):
+            return None, None
+        return obisIdentifier, [cls.tokenizeValue(rawValue) for rawValue in rawValues]
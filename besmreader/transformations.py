@@ -0,0 +1,135 @@
+from decimal import Decimal
+from sys import intern
+import math
+import re
+
+from .sequence import P1Sequence
+
+_ZERO = Decimal(0)
+_ONE = Decimal(1)
+
+def _sum(values: list) -> Decimal:
+    return sum(values, _ZERO)
+
+def _difference(values: list) -> Decimal:
+    return values[0] - sum(values[1:], _ZERO)
+
+def _product(values: list) -> Decimal:
+    return math.prod(values, start=_ONE)
+
+def _ratio(values: list) -> Decimal:
+    return values[0] / values[1]
+
+class P1Transformations:
+
+    """
+        The p1Transform section compiled once at configuration load into an ordered list of steps, so that
+        applying the transformations to a telegram (P1Sequence.applyTransformations) is a flat sequence
+        of reads of resolved (code, index) slots, without any string parsing.
+
+        Transformations form a DAG: a transformation can use the result of any other transformation,
+        whatever their order in the configuration. They are sorted so that a result is computed before
+        it is used (keeping the configuration order otherwise). A transformation which uses its own OBIS
+        code reads the value sent by the meter. Cycles are rejected with a ValueError.
+
+        Operations (missing operands count as 0):
+            * sum: sum of the operands
+            * difference: first operand minus the sum of the others
+            * product: product of the operands
+            * ratio: first operand divided by the second one (no result if the second one is 0)
+            * phaseSum: sum of the L1, L2 and L3 values of each L1 operand (eg 1-0:21.7.0 sums
+              1-0:21.7.0, 1-0:41.7.0 and 1-0:61.7.0)
+            * netPower: first operand minus the second one, by default 1-0:1.7.0 - 1-0:2.7.0
+              (power consumed minus power injected)
+    """
+
+    OPERATIONS = {"sum": _sum, "difference": _difference, "product": _product, "ratio": _ratio, "phaseSum": _sum, "netPower": _difference}
+    NET_POWER_OPERANDS = ["1-0:1.7.0", "1-0:2.7.0"]
+    # the C group of L2 and L3 values is the one of L1 plus 20 and 40 (eg 21.7.0, 41.7.0 and 61.7.0)
+    PHASE_OFFSET = 20
+    REGEXP_OBIS_CODE = re.compile(r'^(\d+-\d+:)(\d+)(\.\d+\.\d+)$')
+
+    def __init__(self, p1TransformConfig: dict) -> None:
+        self._operands = {obisCode: self.__expandOperands(obisCode, transformation) for obisCode, transformation in p1TransformConfig.items()}
+
+        steps = list()
+        for obisCode in self.__sortTransformations():
+            transformation = p1TransformConfig[obisCode]
+            code, index = P1Sequence.splitOBISCode(obisCode)
+            # like the values of the meter, a result without index replaces all the values of its code
+            outputIndex = index if ('/' in obisCode) else None
+            unit = transformation.get("unit")
+            steps.append((P1Transformations.OPERATIONS[transformation["operation"]],
+                tuple(P1Sequence.splitOBISCode(operand) for operand in self._operands[obisCode]),
+                code, outputIndex, intern(unit) if (unit is not None) else None))
+        self._steps = tuple(steps)
+
+    @property
+    def steps(self) -> tuple:
+        """
+            (operation, ((operand code, operand index), ...), result code, result index or None, unit) in execution order
+        """
+        return self._steps
+
+    @property
+    def operandCodes(self) -> frozenset:
+        """
+            OBIS codes (without multi-value index) read by the transformations
+        """
+        return frozenset(P1Sequence.splitOBISCode(operand)[0] for operands in self._operands.values() for operand in operands)
+
+    def __len__(self) -> int:
+        return len(self._steps)
+
+    @staticmethod
+    def __expandOperands(obisCode: str, transformation: dict) -> list:
+        operation = transformation["operation"]
+        if (not operation in P1Transformations.OPERATIONS):
+            raise ValueError("Unknown operation for " + obisCode + ": " + operation)
+        operands = transformation.get("operands")
+
+        if (operation == "netPower"):
+            operands = operands if (operands is not None) else P1Transformations.NET_POWER_OPERANDS
+        elif (operands is None):
+            raise ValueError("Missing operands for " + obisCode)
+        elif (operation == "phaseSum"):
+            operands = [phaseOperand for operand in operands for phaseOperand in P1Transformations.__phaseOperands(obisCode, operand)]
+
+        if ((operation in ("ratio", "netPower")) and (len(operands) != 2)):
+            raise ValueError(operation + " of " + obisCode + " needs exactly 2 operands")
+        if ((operation == "difference") and (len(operands) < 1)):
+            raise ValueError("difference of " + obisCode + " needs at least 1 operand")
+        return list(operands)
+
+    @staticmethod
+    def __phaseOperands(obisCode: str, operand: str) -> list:
+        label, separator, subItem = operand.partition('/')
+        foundCode = P1Transformations.REGEXP_OBIS_CODE.match(label)
+        if ((foundCode is None) or (not 21 <= int(foundCode.group(2)) < 21 + P1Transformations.PHASE_OFFSET)):
+            raise ValueError("phaseSum of " + obisCode + " needs L1 operands (eg 1-0:21.7.0): " + operand)
+        prefix, phaseGroup, suffix = foundCode.groups()
+        return [prefix + str(int(phaseGroup) + phaseIndex * P1Transformations.PHASE_OFFSET) + suffix + separator + subItem for phaseIndex in range(3)]
+
+    def __sortTransformations(self) -> list:
+        """
+            Returns the OBIS codes of the transformations in execution order (stable topological sort)
+        """
+        producers = dict()
+        for obisCode in self._operands:
+            producers.setdefault(P1Sequence.splitOBISCode(obisCode)[0], list()).append(obisCode)
+
+        dependencies = dict()
+        for obisCode, operands in self._operands.items():
+            dependencies[obisCode] = {producer for operand in operands for producer in producers.get(P1Sequence.splitOBISCode(operand)[0], ())
+                if (producer != obisCode)}
+
+        sortedCodes = list()
+        remainingCodes = list(self._operands)
+        while (remainingCodes):
+            readyCodes = [obisCode for obisCode in remainingCodes if (dependencies[obisCode].isdisjoint(remainingCodes))]
+            if (not readyCodes):
+                raise ValueError("p1Transform has a cycle between " + ", ".join(remainingCodes))
+            # one at a time, so that the configuration order is kept between independent transformations
+            sortedCodes.append(readyCodes[0])
+            remainingCodes.remove(readyCodes[0])
+        return sortedCodes
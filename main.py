@@ -1,5 +1,3 @@
-from collections import deque
-from queue import Queue
 from threading import Event
 import logging
 import time
@@ -7,7 +5,9 @@ import os
 import signal
 
 import besmreader.threads as besmThreads
-from besmreader.helper import ThreadHelper
+from besmreader.metrics import P1Metrics, P1MetricsHTTPServerThread, P1MetricsLoggerThread
+from besmreader.queues import P1PipelineQueue
+from besmreader.supervisor import P1Supervisor
 
 import besmreader.configuration as besmConfig
 
@@ -18,17 +18,26 @@ restartOnFailure = True
     Setup to stop the program properly using CTRL+C
 """
 stopProgramEvent = Event()
-sharedStopEvent = Event()
+reloadConfigurationEvent = Event()
+metricsServerThread = None
 
 def beSMSignalHandler(sigNum, Frame):
     logger.info("Stopping the program when all threads are finished...")
     stopProgramEvent.set()
-    sharedStopEvent.set()
+
+def beSMReloadSignalHandler(sigNum, Frame):
+    logger.info("Reloading the configuration...")
+    reloadConfigurationEvent.set()
 
 signal.signal(signal.SIGINT, beSMSignalHandler)
 
+# SIGHUP reloads the configuration without stopping the threads (not available on Windows)
+if (hasattr(signal, "SIGHUP")):
+    signal.signal(signal.SIGHUP, beSMReloadSignalHandler)
+
 """
-    Main program loop, launching and controlling threads execution
+    Main program loop, launching the threads under a supervisor which restarts the threads that fail.
+    The configuration is reloaded and all threads are relaunched only when the health control requests it.
 """
 while ((not stopProgramEvent.is_set()) and restartOnFailure):
     besmConfig.LoggerConfigurator.loadConfiguration(os.path.join(os.getcwd(), "config", "logger_config.json"))
@@ -39,45 +48,51 @@ while ((not stopProgramEvent.is_set()) and restartOnFailure):
     globalConfiguration = besmConfig.P1Configuration("config.json")
     restartOnFailure = globalConfiguration.restartOnFailure
 
-    # Create a shared event to stop all threads
-    logger.info('Creating Shared Event Controller')
-    sharedStopEvent = Event()
-
-    # Create the shared queues
+    # Create the shared queues, they are kept when a thread is restarted
     logger.info('Creating Shared Queues')
-    rawQueue = Queue()
-    p1SequenceQueue = Queue()
+    rawQueue = P1PipelineQueue("raw", blockTimeout=globalConfiguration.timeoutCycleLength, **globalConfiguration.queueConfig("raw"))
+    p1SequenceQueue = P1PipelineQueue("p1Sequence", blockTimeout=globalConfiguration.timeoutCycleLength, **globalConfiguration.queueConfig("p1Sequence"))
+    P1Metrics.gauge("besm_queue_depth", "Items waiting in the inter-thread queues", rawQueue.qsize, queue="raw")
+    P1Metrics.gauge("besm_queue_depth", "Items waiting in the inter-thread queues", p1SequenceQueue.qsize, queue="p1Sequence")
 
-    readerThread = besmThreads.ReadFromCOMPortThread(rawQueue, sharedStopEvent, globalConfiguration)
+    # The metrics endpoint is started once and keeps serving when the threads are restarted
+    if ((metricsServerThread is None) and (globalConfiguration.metricsHTTPPort is not None)):
+        metricsServerThread = P1MetricsHTTPServerThread(globalConfiguration.metricsHTTPHost, globalConfiguration.metricsHTTPPort)
+        metricsServerThread.start()
 
-    threadsDeque = deque([
-        besmThreads.ProcessP1SequencesThread(p1SequenceQueue, sharedStopEvent, globalConfiguration),
-        besmThreads.ParseP1RawDataThread(rawQueue, p1SequenceQueue, sharedStopEvent, globalConfiguration),
-        readerThread
-    ])
+    # Each stage gets its own stop event, set by its thread when it fails
+    reloadConfigurationEvent.clear()
+    supervisor = P1Supervisor(stopProgramEvent, globalConfiguration.restartOnFailure, globalConfiguration.restartInitialBackoff, globalConfiguration.restartMaxBackoff,
+        reloadConfigurationEvent, globalConfiguration.reload)
+
+    if (globalConfiguration.watchConfigFile):
+        supervisor.addStage("configurationWatcher",
+            lambda stopEvent: besmThreads.ConfigurationWatcherThread(stopEvent, globalConfiguration.configFilePath, reloadConfigurationEvent))
 
     if (globalConfiguration.healthControlEnabled):
-        threadsDeque.appendleft(besmThreads.HealthControllerThread(sharedStopEvent, globalConfiguration))
+        supervisor.addStage("healthControl", lambda stopEvent: besmThreads.HealthControllerThread(stopEvent, globalConfiguration), restartAll=True)
+
+    if (globalConfiguration.metricsLogInterval is not None):
+        supervisor.addStage("metricsLogger", lambda stopEvent: P1MetricsLoggerThread(stopEvent, globalConfiguration.metricsLogInterval))
 
-    threadsList = list(threadsDeque)
+    supervisor.addStage("scheduler", lambda stopEvent: besmThreads.ProcessP1SequencesThread(p1SequenceQueue, stopEvent, globalConfiguration))
+    supervisor.addStage("parser", lambda stopEvent: besmThreads.ParseP1RawDataThread(rawQueue, p1SequenceQueue, stopEvent, globalConfiguration))
 
-    ThreadHelper.startAllThreads(*threadsList)
+    # One reader per meter, all meters share the parser, the schedulers thread and the processors
+    for meter in globalConfiguration.meters:
+        supervisor.addStage("reader." + meter.meterId,
+            lambda stopEvent, meter=meter: besmThreads.ReadFromCOMPortThread(rawQueue, stopEvent, globalConfiguration, meter),
+            onStop=lambda readerThread: readerThread.closePort())
 
-    while (not sharedStopEvent.is_set()):
-        
-        if(not ThreadHelper.checkAllThreadsAreAlive(*threadsList)):
-            sharedStopEvent.set()
-        
-        time.sleep(10)
+    supervisor.run()
 
     logger.warning('Waiting for threads to terminate...')
-    
-    readerThread.closePort()
-    ThreadHelper.waitForAllThreadsToFinish(*threadsList)
-    logger.warning('All Threads terminated, relaunching...')
+    supervisor.stopAllStages()
+    logger.warning('All Threads terminated')
 
     logger.info('Closing processors')
     globalConfiguration.closeProcessors()
 
-    if (not stopProgramEvent.is_set()): 
+    if ((not stopProgramEvent.is_set()) and restartOnFailure):
+        logger.warning('Relaunching...')
         time.sleep(globalConfiguration.timeoutCycleLength)
\ No newline at end of file
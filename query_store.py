@@ -0,0 +1,32 @@
+from datetime import datetime
+import argparse
+import time
+
+from besmreader.store import P1TimeSeriesStore
+
+"""
+    Queries the time-series store written by a store processor, while the application is running.
+
+    Run from the repository root with:
+        python query_store.py data/besm.sqlite [--series power/consumed] [--resolution 15m]
+                              [--start 2024-01-01T00:00] [--end 2024-01-02T00:00]
+"""
+
+argumentParser = argparse.ArgumentParser(prog="python query_store.py", description="Queries a time-series store written by a store processor")
+argumentParser.add_argument("path", help="path of the store database")
+argumentParser.add_argument("--series", help="series (topic) to query, the series are listed if not set", default=None)
+argumentParser.add_argument("--resolution", choices=["raw"] + list(P1TimeSeriesStore.RESOLUTIONS), default="15m")
+argumentParser.add_argument("--start", help="ISO start time (default: 24 hours ago)", default=None)
+argumentParser.add_argument("--end", help="ISO end time (default: now)", default=None)
+arguments = argumentParser.parse_args()
+
+timeSeriesStore = P1TimeSeriesStore(arguments.path)
+if (arguments.series is None):
+    for seriesName in timeSeriesStore.seriesNames():
+        print(seriesName)
+else:
+    endTime = datetime.fromisoformat(arguments.end).timestamp() if (arguments.end is not None) else time.time()
+    startTime = datetime.fromisoformat(arguments.start).timestamp() if (arguments.start is not None) else endTime - 86400
+    for row in timeSeriesStore.query(arguments.series, startTime, endTime, arguments.resolution):
+        print(";".join([datetime.fromtimestamp(row[0]).astimezone().isoformat()] + [str(value) for value in row[1:]]))
+timeSeriesStore.close()